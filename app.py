@@ -1,24 +1,30 @@
+import time
+_SCRIPT_START = time.perf_counter()
 import os, streamlit as st
-st.write("🚀 Root files:", os.listdir("."))
-import sys, subprocess
-st.write("📦 Installed packages:")
-freeze = subprocess.check_output([sys.executable, "-m", "pip", "freeze"]).decode().splitlines()
-cv_pkgs = [p for p in freeze if "opencv" in p.lower()]
-st.write(cv_pkgs)
 import cv2
-st.write("✅ cv2 loaded, version:", cv2.__version__)
-import numpy as np
-from PIL import Image
 import pandas as pd
 from datetime import datetime
-import random
+import logging
 import os
 import plotly.express as px
 from emotion_utils.detector import EmotionDetector
-import tempfile
-from location_utils.extract_gps import extract_gps, convert_gps
-from location_utils.geocoder import get_address_from_coords
-from location_utils.landmark import load_models,detect_landmark, query_landmark_coords,LANDMARK_KEYWORDS
+from pipeline_utils.image_context import ImageContext
+from pipeline_utils.history import MAX_MAP_POINTS, geohash_cell_size, get_history_store
+from pipeline_utils.pipeline import run_pipeline
+from pipeline_utils.models import registry
+from pipeline_utils.render import get_renderer, thumbnail_data_uri
+from pipeline_utils import metrics
+from pipeline_utils.inference_worker import INFERENCE_WORKER, InferenceWorkerError, RemoteEmotionDetector
+
+_IMPORT_SECONDS = time.perf_counter() - _SCRIPT_START
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment diagnostics are opt-in: APP_DEBUG=1 or ?debug=1 in the URL
+APP_DEBUG = os.environ.get("APP_DEBUG", "0") == "1"
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") == "1"
 
 
 # ----------------- App Configuration -----------------
@@ -31,21 +37,36 @@ st.set_page_config(
 
 @st.cache_resource
 def get_detector():
+    if INFERENCE_WORKER:
+        # Models live in the shared worker process; this process only draws
+        try:
+            return RemoteEmotionDetector()
+        except InferenceWorkerError as e:
+            logger.warning(f"[MAIN] {e}; running models in-process")
     return EmotionDetector()
 
 detector = get_detector()
 
-def save_history(username, emotion, confidence, location):
+@st.cache_resource
+def get_history():
+    return get_history_store()
+
+history_store = get_history()
+
+HISTORY_PAGE_SIZES = [25, 50, 100, 250]
+TREND_BUCKETS = ["hour", "day", "week"]
+
+def save_history(username, emotion, confidence, location, coords=None, image_sha=None):
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    df = pd.DataFrame([[username, emotion, confidence, location, now]], 
-                     columns=["Username","Emotion","Confidence","Location","timestamp"])
+    lat, lon = coords if coords else (None, None)
     try:
-        if os.path.exists("history.csv"):
-            prev = pd.read_csv("history.csv")
-            df = pd.concat([prev, df])
-        df.to_csv("history.csv", index=False)
+        with metrics.span("history_write"):
+            history_store.append(username, emotion, confidence, location, now, lat=lat, lon=lon,
+                                 image_sha=image_sha)
+        return True
     except Exception as e:
         st.error(f"Failed to save history: {e}")
+        return False
 
 def show_detection_guide():
     with st.expander("ℹ️ How Emotion Detection Works", expanded=False):
@@ -65,6 +86,29 @@ def show_detection_guide():
         - Avoid obstructed faces
         """)
 
+def debug_enabled():
+    return APP_DEBUG or st.query_params.get("debug") == "1"
+
+def show_diagnostics():
+    from importlib import metadata
+    with st.sidebar.expander("🛠 Diagnostics", expanded=False):
+        st.write("🚀 Root files:", os.listdir("."))
+        cv_pkgs = sorted(f"{d.metadata['Name']}=={d.version}" for d in metadata.distributions()
+                         if "opencv" in (d.metadata["Name"] or "").lower())
+        st.write("📦 OpenCV packages:", cv_pkgs)
+        st.write("✅ cv2 version:", cv2.__version__)
+        st.write(f"⏱ Script imports this run: {_IMPORT_SECONDS * 1000:.1f} ms")
+        st.write("🧠 Models:", registry.report())
+        st.write(f"🧠 Resident model memory: {registry.total_resident_bytes() / 2**20:.0f} MB")
+
+def show_stage_breakdown():
+    """Stage timings of this session's last upload (only recorded with METRICS=1)"""
+    rows = st.session_state.get("last_trace")
+    if not rows:
+        return
+    with st.sidebar.expander("⏱ Last request", expanded=False):
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+
 def sidebar_design(username):
     if username:
         st.sidebar.success(f"👤 Logged in as: {username}")
@@ -87,70 +131,38 @@ def main():
         if username:
             uploaded_file = st.file_uploader("Upload an image (JPG/PNG)", type=["jpg", "png"])
             if uploaded_file:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                    tmp_file.write(uploaded_file.read())
-                    temp_path = tmp_file.name
+                # Decoded once here and shared by every stage below; nothing touches disk
+                ctx = ImageContext.from_bytes(uploaded_file.getvalue(), uploaded_file.name)
+                trace = metrics.start_trace("upload")
                
+                detections, location, method, coords = [], "Unknown", "", None
+                rendered = None
                 try:
                     # 调试信息
-                    print(f"[MAIN] Processing image: {uploaded_file.name}")
-                    print(f"[MAIN] Image size: {uploaded_file.size} bytes")
+                    logger.info(f"[MAIN] Processing image: {uploaded_file.name} ({uploaded_file.size} bytes)")
                     
-                    image = Image.open(temp_path).convert("RGB")
-                    img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                    detections = detector.detect_emotions(img)
-                    detected_img = detector.draw_detections(img, detections)
-                        
-                    location = "Unknown"
-                    method = ""
-                    gps_info = extract_gps(temp_path)
-                
-                    if gps_info:
-                        print(f"[MAIN] GPS extraction successful: {list(gps_info.keys())}")
-                        coords = convert_gps(gps_info)
-   
-                        if coords:
-                            print(f"[MAIN] GPS coordinates: {coords}")
-                            location = get_address_from_coords(coords)
-                            method="GPS Metadata"
-                        else:
-                            print("[MAIN] No GPS data found in image")
-                                
-                    if location in ("Unknown", "Unknown location"):
-                        print("[MAIN] Trying landmark detection...")
-                        landmark = detect_landmark(temp_path, threshold=0.15, top_k=5)
-                        
-                        if landmark:
-                            print(f"[MAIN] CLIP predicted landmark: {landmark}")
-                            st.write(f"🔍 CLIP predicted landmark: **{landmark}**")
-                            
-                            coords_result, source = query_landmark_coords(landmark)
-                            
-                            if coords_result:
-                                lat, lon = coords_result
-                                print(f"[MAIN] Landmark coordinates: {lat}, {lon} (source: {source})")
-                                addr = get_address_from_coords((lat, lon))
-                                if addr and addr not in ("Unknown location", "Invalid coordinates", "Geocoding service unavailable"):
-                                    location = addr
-                                    method = f"Landmark ({source})"
-                                    print(f"[MAIN] Final location: {location}")
-                                else:
-                                    if landmark in LANDMARK_KEYWORDS:
-                                        landmark_info = LANDMARK_KEYWORDS[landmark]
-                                        location = f"{landmark_info[0]}, {landmark_info[1]}"
-                                    else:
-                                        location = f"{landmark.title()} ({lat:.4f}, {lon:.4f})"
-                                        method = f"Landmark ({source})"
-                                        print(f"[MAIN] Using landmark fallback: {location}")
-                            else:
-                                print(f"[MAIN] No coordinates found for landmark: {landmark}")
-                                st.write(f"⚠️ Landmark detected but no coordinates available")
-                        else:
-                            print("[MAIN] No landmark detected with sufficient confidence")
-                            st.write("🔍 No landmark detected with sufficient confidence")
+                    result = run_pipeline(ctx, detector)
+                    detections = result["detections"]
+                    # Display-sized, compressed previews; cached by content hash across reruns
+                    with metrics.span("render"):
+                        rendered = get_renderer().render(ctx, detections, detector.draw_detections)
+                    location, method, coords = result["location"], result["method"], result["coords"]
+
+                    if result["cached"]:
+                        st.caption("⚡ Served from the result cache")
+                    if result.get("failed_stages"):
+                        st.warning(f"⚠️ Some stages failed ({', '.join(result['failed_stages'])}); "
+                                   "results may be incomplete")
+                    landmark = result["landmark"]
+                    if landmark:
+                        st.write(f"🔍 CLIP predicted landmark: **{landmark}**")
+                    if result["landmark_status"] == "no_coords":
+                        st.write(f"⚠️ Landmark detected but no coordinates available")
+                    elif result["landmark_status"] == "not_detected":
+                        st.write("🔍 No landmark detected with sufficient confidence")
                 except Exception as e:
                     st.error(f"❌ Something went wrong during processing: {e}")
-                    print(f"[ERROR] {e}")
+                    logger.exception(f"[MAIN] Processing failed: {e}")
                                    
                 col1, col2 = st.columns([1, 2])
                 with col1:
@@ -163,42 +175,71 @@ def main():
                             st.write(f"- Face {i + 1}: {emo} ({conf}%)")
                         show_detection_guide()
                         st.write(f"📍 Estimated Location: **{location}** ({method})")
-                        save_history(username, emotions[0], confidences[0], location)
+                        # Widgets elsewhere on the page rerun this script; record each upload once
+                        upload_key = (username, getattr(uploaded_file, "file_id", None) or ctx.sha256)
+                        saved = st.session_state.setdefault("saved_uploads", set())
+                        if upload_key not in saved and save_history(
+                                username, emotions[0], confidences[0], location, coords, ctx.sha256):
+                            saved.add(upload_key)
                     else:
                         st.warning("No faces were detected in the uploaded image.")
                 with col2:
                     t1, t2 = st.tabs(["Original Image", "Processed Image"])
                     with t1:
-                         st.image(image, use_container_width=True)
+                        if rendered is not None:
+                            st.image(rendered.preview, use_container_width=True)
                     with t2:
-                        st.image(detected_img, channels="BGR", use_container_width=True,
-                                    caption=f"Detected {len(detections)} face(s)")
+                        if rendered is not None:
+                            st.image(rendered.annotated, use_container_width=True,
+                                     caption=f"Detected {len(detections)} face(s)")
+                st.session_state.last_trace = trace.finish().breakdown()
                
 
     with tabs[1]:
-        st.subheader("🗺️ Random Location Sample (Demo)")
-        st.map(pd.DataFrame({
-            'lat': [3.139 + random.uniform(-0.01, 0.01)],
-            'lon': [101.6869 + random.uniform(-0.01, 0.01)]
-        }))
-        st.caption("Note: This location map is a demo preview and not actual detected GPS data.")
+        st.subheader("🗺️ Upload Locations")
+        scope = st.radio("Show", ["My uploads", "All users"], horizontal=True,
+                         index=0 if username else 1, disabled=not username)
+        with st.expander("Viewport", expanded=False):
+            c1, c2, c3, c4 = st.columns(4)
+            bbox = (c1.number_input("South", -90.0, 90.0, -60.0), c2.number_input("West", -180.0, 180.0, -180.0),
+                    c3.number_input("North", -90.0, 90.0, 75.0), c4.number_input("East", -180.0, 180.0, 180.0))
+        try:
+            # Aggregated server-side: the browser gets at most MAX_MAP_POINTS clusters
+            clusters = history_store.clusters(username if scope == "My uploads" else None, bbox=bbox,
+                                              max_points=MAX_MAP_POINTS)
+            if clusters.empty:
+                st.info("No geotagged uploads in this area yet.")
+            else:
+                # Radius in metres: a fraction of the cluster's cell, growing with its count
+                cell_m = geohash_cell_size(len(clusters["cell"].iloc[0]))[0] * 111_000
+                clusters["size"] = cell_m * (0.1 + 0.4 * (clusters["count"] / clusters["count"].max()) ** 0.5)
+                st.map(clusters, latitude="lat", longitude="lon", size="size")
+                st.caption(f"{int(clusters['count'].sum())} uploads in {len(clusters)} clusters")
+        except Exception as e:
+            st.error(f"Error loading map: {e}")
 
     with tabs[2]:
         st.subheader("📜 Upload History")
         if username:
             try:
-                if os.path.exists("history.csv"):
-                    df = pd.read_csv("history.csv")
-                    if df.empty:
-                        st.info("No upload records found.")
-                    else:
-                        df_filtered = df[df["Username"].str.contains(username, case=False)]
-                        df_filtered = df_filtered.sort_values("timestamp", ascending=False).reset_index(drop=True)
-                        df_filtered.index = range(1, len(df_filtered)+1)
-                        st.dataframe(df_filtered)
-                        st.caption(f"Total records found for {username}: {len(df_filtered)}")
+                total = history_store.count(username)
+                if total == 0:
+                    st.info("No upload records found.")
                 else:
-                    st.info("No history file found.")
+                    c1, c2 = st.columns(2)
+                    page_size = c1.selectbox("Rows per page", HISTORY_PAGE_SIZES, index=1)
+                    pages = (total + page_size - 1) // page_size
+                    page = c2.number_input("Page", min_value=1, max_value=pages, value=1, step=1)
+                    df_page = history_store.page(username, limit=page_size, offset=(page - 1) * page_size)
+                    start = (page - 1) * page_size
+                    df_page.index = range(start + 1, start + len(df_page) + 1)
+                    column_config = None
+                    if "image_sha" in df_page.columns:
+                        # Annotated thumbnails come from the render cache; no image is decoded here
+                        df_page.insert(0, "thumbnail", [thumbnail_data_uri(sha) for sha in df_page.pop("image_sha")])
+                        column_config = {"thumbnail": st.column_config.ImageColumn("Thumbnail")}
+                    st.dataframe(df_page, column_config=column_config)
+                    st.caption(f"Total records found for {username}: {total} (page {page} of {pages})")
             except:
                 st.warning("Error loading history records.")
         else:
@@ -208,21 +249,40 @@ def main():
         st.subheader("📊 Emotion Analysis Chart")
         if username:
             try:
-                if os.path.exists("history.csv"):
-                    df = pd.read_csv("history.csv")
-                    df_filtered = df[df["Username"].str.contains(username, case=False)]
-                    if not df_filtered.empty:
-                        fig = px.pie(df_filtered, names="Emotion", title=f"Emotion Distribution for {username}")
-                        st.plotly_chart(fig)
-                        st.caption("Chart is based on your personal upload history.")
-                    else:
-                        st.info("No emotion records found for this username.")
+                # Both views read pre-aggregated rollups, never the raw upload rows
+                counts = history_store.emotion_counts(username)
+                if not counts.empty:
+                    fig = px.pie(counts, names="Emotion", values="count", title=f"Emotion Distribution for {username}",
+                                 hover_data={"mean_confidence": ":.1f"})
+                    st.plotly_chart(fig)
+                    st.caption("Chart is based on your personal upload history.")
+
+                    st.subheader("📈 Emotion Trend")
+                    c1, c2 = st.columns(2)
+                    bucket = c1.selectbox("Group by", TREND_BUCKETS, index=1, format_func=str.title)
+                    periods = c2.slider("Periods", min_value=5, max_value=90, value=30)
+                    trend = history_store.emotion_trend(username, bucket=bucket, periods=periods)
+                    if not trend.empty:
+                        st.plotly_chart(px.bar(trend, x="period", y="count", color="Emotion",
+                                               title=f"Uploads per {bucket}"))
+                        st.plotly_chart(px.line(trend, x="period", y="mean_confidence", color="Emotion",
+                                                markers=True, title="Mean confidence (%)"))
                 else:
-                    st.info("History file not found.")
+                    st.info("No emotion records found for this username.")
             except Exception as e:
                 st.error(f"Error generating chart: {e}")
         else:
             st.warning("Please enter your username to generate your emotion chart.")
 
+    if metrics.ENABLED:
+        show_stage_breakdown()
+    if debug_enabled():
+        show_diagnostics()
+    if MODEL_WARMUP:
+        # Page is already rendered; load the remaining models off the script thread
+        registry.warm_up()
+    # Evicts idle models when MODEL_IDLE_SECONDS is set; they reload on the next request
+    registry.start_janitor()
+
 if __name__ == "__main__":
     main()
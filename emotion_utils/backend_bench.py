@@ -0,0 +1,240 @@
+# emotion_utils/backend_bench.py
+"""
+Face-detector backend benchmark and auto-selection.
+
+    python -m emotion_utils.backend_bench faces/ --backends opencv ssd mtcnn retinaface
+    EMOTION_DETECTOR_BACKEND=auto streamlit run app.py
+
+`faces/labels.csv` has one row per image: `image,faces,emotion,boxes`.
+- `faces` is the number of faces in the image.
+- `emotion` (optional) is the expected dominant emotion.
+- `boxes` (optional) holds the labelled face boxes as "x,y,w,h;x,y,w,h". With
+  boxes, a face only counts as found when a detection overlaps it with
+  IoU >= MATCH_IOU. Without them, found faces are counted per image, capped at
+  the label.
+
+Only real detections count: the whole-frame placeholder that the app falls
+back to is excluded. Each backend runs in its own process, so peak memory
+(max RSS) and model load time are measured per backend. A backend that
+crashes or exceeds --timeout is recorded as failed.
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from queue import Empty
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DETECTOR_BACKENDS = ["opencv", "ssd", "mtcnn", "retinaface", "mediapipe", "yunet", "centerface", "yolov8", "dlib"]
+BENCH_RESULTS_PATH = os.environ.get("FACE_BACKEND_RESULTS", os.path.join(".cache", "face_backends.json"))
+# Minimum face recall a backend must reach on the labelled set to be picked by "auto"
+RECALL_FLOOR = float(os.environ.get("EMOTION_RECALL_FLOOR", "0.9"))
+FALLBACK_BACKEND = "opencv"
+# Minimum IoU between a detection and a labelled box to count it as found
+MATCH_IOU = 0.5
+# Seconds one backend may take over the whole labelled set (model download included)
+BACKEND_TIMEOUT = float(os.environ.get("FACE_BACKEND_TIMEOUT", "1800"))
+
+
+def load_labels(root: str) -> List[dict]:
+    """Rows of labels.csv with the image path resolved against `root`"""
+    labels = []
+    with open(os.path.join(root, "labels.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            labels.append({
+                "path": os.path.join(root, row["image"]),
+                "faces": int(row.get("faces") or 0),
+                "emotion": (row.get("emotion") or "").strip().lower() or None,
+                "boxes": _parse_boxes(row.get("boxes") or ""),
+            })
+    return labels
+
+
+def _parse_boxes(spec: str) -> Optional[List[dict]]:
+    """'x,y,w,h;x,y,w,h' -> regions; None when the row has no boxes"""
+    boxes = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        x, y, w, h = (int(float(v)) for v in part.split(","))
+        boxes.append({"x": x, "y": y, "w": w, "h": h})
+    return boxes or None
+
+
+def _matched_faces(regions: List[dict], item: dict) -> int:
+    """Labelled faces found: greedy IoU matching with boxes, else the count capped at the label"""
+    if item["boxes"] is None:
+        return min(len(regions), item["faces"])
+    from emotion_utils.resolution import iou
+
+    unmatched, matched = list(regions), 0
+    for box in item["boxes"]:
+        best = max(unmatched, key=lambda r: iou(r, box), default=None)
+        if best is not None and iou(best, box) >= MATCH_IOU:
+            unmatched.remove(best)
+            matched += 1
+    return matched
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def bench_backend(backend: str, labels: List[dict]) -> dict:
+    """Run one backend over the labelled set in this process"""
+    import cv2
+    from emotion_utils.detector import EmotionDetector
+
+    detector = EmotionDetector(detector_backend=backend)
+    images = [cv2.imread(item["path"]) for item in labels]
+
+    def detect(img) -> List[dict]:
+        # No whole-frame placeholder: a backend that misses a face must not get credit for it
+        faces = detector.find_faces(img, whole_frame_fallback=False)
+        probs = detector.classify_faces([crop for _, crop in faces])
+        return [EmotionDetector._to_detection(region, p) for (region, _), p in zip(faces, probs)]
+
+    start = time.perf_counter()
+    detect(images[0])
+    warmup_s = time.perf_counter() - start
+
+    latencies, found, expected, matched, agree, judged = [], 0, 0, 0, 0, 0
+    for item, img in zip(labels, images):
+        start = time.perf_counter()
+        detections = detect(img)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found += len(detections)
+        expected += item["faces"]
+        matched += _matched_faces(detections, item)
+        if item["emotion"] and detections:
+            judged += 1
+            top = max(detections, key=lambda d: d["confidence"])
+            agree += top["emotion"] == item["emotion"]
+
+    latencies = np.array(latencies)
+    return {
+        "backend": backend,
+        "ok": True,
+        "images": len(labels),
+        "warmup_s": round(warmup_s, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "faces_found": found,
+        "faces_labelled": expected,
+        # IoU-matched when the labels have boxes, count-based otherwise
+        "recall_method": "iou" if all(item["boxes"] is not None for item in labels) else "count",
+        "recall": round(matched / expected, 4) if expected else None,
+        "emotion_agreement": round(agree / judged, 4) if judged else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _bench_child(backend: str, labels: List[dict], queue):
+    try:
+        queue.put(bench_backend(backend, labels))
+    except Exception as e:
+        queue.put({"backend": backend, "ok": False, "error": f"{type(e).__name__}: {e}"})
+
+
+def _await_child(backend: str, proc, queue, timeout: float) -> dict:
+    """The child's result, or a failure record if it dies or runs past `timeout`"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Empty:
+            pass
+        if not proc.is_alive():
+            # It may have put its result just before exiting
+            try:
+                return queue.get(timeout=1.0)
+            except Empty:
+                return {"backend": backend, "ok": False,
+                        "error": f"benchmark process exited with code {proc.exitcode}"}
+        if time.monotonic() > deadline:
+            proc.terminate()
+            return {"backend": backend, "ok": False, "error": f"timed out after {timeout:.0f}s"}
+
+
+def run_benchmark(root: str, backends: List[str], limit: Optional[int] = None,
+                  timeout: float = BACKEND_TIMEOUT) -> dict:
+    labels = load_labels(root)[:limit]
+    if not labels:
+        raise ValueError(f"No labelled images in {root}")
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in backends:
+        logger.info(f"[BENCH] {backend} on {len(labels)} images...")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_bench_child, args=(backend, labels, queue))
+        proc.start()
+        try:
+            results[backend] = _await_child(backend, proc, queue, timeout)
+        finally:
+            proc.join(10)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+        logger.info(f"[BENCH] {backend}: {results[backend]}")
+    return {"dataset": os.path.abspath(root), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "backends": results}
+
+
+def select_backend(results_path: str = BENCH_RESULTS_PATH, recall_floor: float = RECALL_FLOOR) -> str:
+    """Fastest (p50) backend whose recall meets `recall_floor`; opencv if there is no usable result"""
+    try:
+        with open(results_path, "r", encoding="utf-8") as f:
+            results = json.load(f)["backends"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"[BENCH] No backend benchmark at {results_path} ({e}); using {FALLBACK_BACKEND}")
+        return FALLBACK_BACKEND
+
+    eligible = [r for r in results.values()
+                if r.get("ok") and r.get("recall") is not None and r["recall"] >= recall_floor]
+    if not eligible:
+        logger.warning(f"[BENCH] No backend reaches recall {recall_floor}; using {FALLBACK_BACKEND}")
+        return FALLBACK_BACKEND
+    best = min(eligible, key=lambda r: r["p50_ms"])
+    logger.info(f"[BENCH] Auto-selected detector backend {best['backend']} "
+                f"(recall {best['recall']}, p50 {best['p50_ms']} ms)")
+    return best["backend"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DeepFace face-detector backends")
+    parser.add_argument("source", help="Directory containing labels.csv and the images it lists")
+    parser.add_argument("--backends", nargs="+", default=DETECTOR_BACKENDS)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N labelled images")
+    parser.add_argument("-o", "--output", default=BENCH_RESULTS_PATH,
+                        help="Results JSON, read by EMOTION_DETECTOR_BACKEND=auto")
+    parser.add_argument("--recall-floor", type=float, default=RECALL_FLOOR)
+    parser.add_argument("--timeout", type=float, default=BACKEND_TIMEOUT,
+                        help="Seconds allowed per backend before it is recorded as failed")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.source, args.backends, args.limit, args.timeout)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'backend':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'recall':>8}{'agree':>8}{'rss MB':>9}")
+    for name, r in report["backends"].items():
+        if not r["ok"]:
+            print(f"{name:<12}  failed: {r['error']}")
+            continue
+        print(f"{name:<12}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+              f"{str(r['recall']):>8}{str(r['emotion_agreement']):>8}{r['peak_rss_mb']:>9}")
+    print(f"auto -> {select_backend(args.output, args.recall_floor)}")
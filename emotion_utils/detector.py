@@ -1,9 +1,80 @@
-from deepface import DeepFace
+import os
+
 import cv2
 import numpy as np
+from pipeline_utils.image_context import ImageContext
+from pipeline_utils.models import registry
+from emotion_utils.resolution import (EMOTION_INPUT_SIDE, ResolutionPolicy, crop_gray, letterbox_gray,
+                                      map_region, suppress_duplicates)
+
+# DeepFace face-detector backend; "auto" picks one from benchmark results
+EMOTION_DETECTOR_BACKEND = os.environ.get("EMOTION_DETECTOR_BACKEND", "opencv")
+
+# Output order of DeepFace's emotion classifier
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+# Faces per classifier forward pass; bounds memory for huge group shots / batches
+EMOTION_BATCH_SIZE = 64
+
+def _build_emotion_model():
+    """DeepFace's emotion classifier client (the signature changed across deepface releases)"""
+    from deepface.modules import modeling
+    try:
+        return modeling.build_model(task="facial_attribute", model_name="Emotion")
+    except TypeError:
+        return modeling.build_model("Emotion")
+
+def _release_emotion_model():
+    """DeepFace keeps its own cache of built models; drop ours so eviction frees the weights"""
+    from deepface.modules import modeling
+    cached = getattr(modeling, "cached_models", None)
+    if isinstance(cached, dict):
+        cached.get("facial_attribute", {}).pop("Emotion", None)
+    # Older releases cache by model name in `model_obj`
+    legacy = getattr(modeling, "model_obj", None)
+    if isinstance(legacy, dict):
+        legacy.pop("Emotion", None)
+
+def _load_deepface():
+    # Importing deepface pulls in TensorFlow, so it is deferred until first use
+    from deepface import DeepFace
+    return DeepFace
+
+# The module stays in sys.modules, so evicting it would free nothing
+registry.register("deepface", _load_deepface, evictable=False)
+registry.register("emotion_model", _build_emotion_model, on_evict=_release_emotion_model)
+
+def _to_rgb(img):
+    if isinstance(img, ImageContext):
+        return img.rgb
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def _face_to_gray(face):
+    crop = np.asarray(face["face"], dtype=np.float32)
+    if crop.ndim == 4:
+        crop = crop[0]
+    # extract_faces hands back RGB in [0, 1]; the classifier was trained on BGR-derived grayscale
+    gray = cv2.cvtColor(crop[:, :, ::-1], cv2.COLOR_BGR2GRAY)
+    return letterbox_gray(gray)
+
+def _is_placeholder(face, view_shape):
+    """enforce_detection=False returns the whole view as a zero-confidence 'face' when nothing is found"""
+    area = face["facial_area"]
+    h, w = view_shape[:2]
+    return face.get("confidence", 1) == 0 or (area["w"] >= w and area["h"] >= h)
 
 class EmotionDetector:
-    def __init__(self):
+    def __init__(self, detector_backend=None, resolution=None):
+        """
+        `detector_backend` is any DeepFace detector backend, or "auto" for the
+        fastest backend meeting the recall floor in the benchmark results
+        (see emotion_utils.backend_bench).
+        """
+        backend = detector_backend or EMOTION_DETECTOR_BACKEND
+        if backend == "auto":
+            from emotion_utils.backend_bench import select_backend
+            backend = select_backend()
+        self.detector_backend = backend
+        self.resolution = resolution or ResolutionPolicy()
         self.color_map = {
             "happy": (0, 255, 0),      # Green
             "neutral": (255, 255, 0),  # Yellow
@@ -14,32 +85,124 @@ class EmotionDetector:
             "disgust": (0, 128, 0)    # Dark Green
         }
 
+    @property
+    def emotion_model(self):
+        return registry.get("emotion_model")
+
     def detect_emotions(self, img):
-        """Detect emotions using DeepFace"""
+        """Detect emotions using DeepFace. `img` is a BGR array or an ImageContext"""
+        return self.detect_emotions_batch([img])[0]
+
+    def _extract(self, view):
+        return registry.get("deepface").extract_faces(
+            img_path=view,
+            detector_backend=self.detector_backend,
+            enforce_detection=False,
+            align=True
+        )
+
+    def find_faces(self, img, whole_frame_fallback=True):
+        """
+        Face boxes in original-image coordinates plus 48x48 classifier inputs.
+
+        Detection runs on a view bounded by the resolution policy (plus
+        native-resolution tiles when tiling applies). The aligned crop from
+        the detector is used when the face was large enough in its view;
+        smaller faces are re-cropped from the original frame.
+        """
+        if isinstance(img, ImageContext):
+            width, height = img.size
+            scale = self.resolution.scale_for(width, height)
+            view = img.downscaled(self.resolution.max_side) if scale < 1 else img.rgb
+        else:
+            view, scale = self.resolution.downscale(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+            height, width = img.shape[:2]
+
+        candidates, placeholder = [], None
+        for face in self._extract(view):
+            if _is_placeholder(face, view.shape):
+                placeholder = face
+                continue
+            candidates.append((map_region(face["facial_area"], scale), face.get("confidence", 1), (face, scale)))
+
+        if self.resolution.use_tiles(width, height):
+            full = _to_rgb(img)
+            for x0, y0, x1, y1 in self.resolution.tiles(width, height):
+                for face in self._extract(full[y0:y1, x0:x1]):
+                    if not _is_placeholder(face, (y1 - y0, x1 - x0)):
+                        candidates.append((map_region(face["facial_area"], 1.0, (x0, y0)),
+                                           face.get("confidence", 1), (face, 1.0)))
+            candidates = suppress_duplicates(candidates)
+
+        if not candidates:
+            if placeholder is None or not whole_frame_fallback:
+                return []
+            # Same as DeepFace.analyze: no face found -> whole frame is classified
+            return [({"x": 0, "y": 0, "w": width, "h": height}, _face_to_gray(placeholder))]
+
+        found, full = [], None
+        for region, _, (face, face_scale) in candidates:
+            area = face["facial_area"]
+            if min(area["w"], area["h"]) >= EMOTION_INPUT_SIDE or face_scale >= 1:
+                found.append((region, _face_to_gray(face)))
+            else:
+                if full is None:
+                    full = _to_rgb(img)
+                found.append((region, crop_gray(full, region)))
+        return found
+
+    def classify_faces(self, gray_faces):
+        """Emotion probabilities (in %) for a list of 48x48 grayscale faces, one forward pass per chunk"""
+        if not gray_faces:
+            return np.zeros((0, len(EMOTION_LABELS)), dtype=np.float32)
+        model = self.emotion_model.model
+        outputs = []
+        for start in range(0, len(gray_faces), EMOTION_BATCH_SIZE):
+            batch = np.stack(gray_faces[start:start + EMOTION_BATCH_SIZE])[..., np.newaxis]
+            outputs.append(np.asarray(model.predict(batch, verbose=0)))
+        probs = np.concatenate(outputs, axis=0)
+        return 100 * probs / probs.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def _to_detection(region, probs):
+        best = int(np.argmax(probs))
+        return {
+            "emotion": EMOTION_LABELS[best],
+            "confidence": round(float(probs[best]), 2),
+            "x": region['x'],
+            "y": region['y'],
+            "w": region['w'],
+            "h": region['h']
+        }
+
+    def detect_emotions_batch(self, images):
+        """
+        Detect emotions for many images (BGR arrays or ImageContexts).
+        Faces are found per image, then every crop in the batch is classified
+        together; the result is one detection list per input image.
+        """
+        per_image = []
+        crops = []
+        for img in images:
+            try:
+                faces = self.find_faces(img)
+            except Exception as e:
+                print(f"Detection error: {e}")
+                faces = []
+            per_image.append([region for region, _ in faces])
+            crops.extend(gray for _, gray in faces)
+
         try:
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            results = DeepFace.analyze(
-                img_path=img_rgb,
-                actions=['emotion'],
-                enforce_detection=False,
-                detector_backend='opencv',
-                silent=True
-            )
-            
-            detections = []
-            for result in results:
-                detections.append({
-                    "emotion": result['dominant_emotion'],
-                    "confidence": round(result['emotion'][result['dominant_emotion']], 2),
-                    "x": result['region']['x'],
-                    "y": result['region']['y'],
-                    "w": result['region']['w'],
-                    "h": result['region']['h']
-                })
-            return detections
+            probs = self.classify_faces(crops)
         except Exception as e:
             print(f"Detection error: {e}")
-            return []
+            return [[] for _ in images]
+
+        results, offset = [], 0
+        for regions in per_image:
+            results.append([self._to_detection(region, probs[offset + i]) for i, region in enumerate(regions)])
+            offset += len(regions)
+        return results
 
     def draw_detections(self, img, detections):
         """Draw detection boxes with labels"""
@@ -0,0 +1,120 @@
+import os
+
+import cv2
+import numpy as np
+
+# Smallest face side (in pixels of the view it was found in) that still gives the
+# 48x48 emotion classifier a full-resolution input; smaller faces are re-cropped
+# from the original frame.
+EMOTION_INPUT_SIDE = 48
+# DeepFace.analyze letterboxes each face to this square before the emotion model
+# shrinks it to 48x48
+DEEPFACE_TARGET_SIDE = 224
+
+
+class ResolutionPolicy:
+    """
+    Bounds the resolution faces are detected at, independent of camera megapixels.
+
+    - detection runs on a copy whose longest side is at most `max_side`
+    - boxes are mapped back to original-image coordinates
+    - optional tiling: frames whose longest side exceeds `tile_min_side` are
+      also scanned in overlapping `tile_size` tiles at native resolution, so
+      small faces in large group shots survive the downscale
+    """
+
+    def __init__(self, max_side=None, tiling=None, tile_size=None, tile_overlap=None, tile_min_side=None):
+        self.max_side = max_side or int(os.environ.get("EMOTION_MAX_SIDE", "1280"))
+        self.tiling = tiling if tiling is not None else os.environ.get("EMOTION_TILING", "0") == "1"
+        self.tile_size = tile_size or int(os.environ.get("EMOTION_TILE_SIZE", "1280"))
+        self.tile_overlap = tile_overlap if tile_overlap is not None else float(os.environ.get("EMOTION_TILE_OVERLAP", "0.25"))
+        self.tile_min_side = tile_min_side or int(os.environ.get("EMOTION_TILE_MIN_SIDE", "2500"))
+
+    def scale_for(self, width, height):
+        return min(1.0, self.max_side / max(width, height))
+
+    def downscale(self, img):
+        """(view, scale) where view = img resized by scale"""
+        h, w = img.shape[:2]
+        scale = self.scale_for(w, h)
+        if scale >= 1:
+            return img, 1.0
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+    def use_tiles(self, width, height):
+        return self.tiling and max(width, height) > self.tile_min_side
+
+    def tiles(self, width, height):
+        """Overlapping (x0, y0, x1, y1) windows covering the frame"""
+        size = min(self.tile_size, width, height)
+        step = max(1, int(size * (1 - self.tile_overlap)))
+        xs = list(range(0, max(1, width - size) + 1, step))
+        ys = list(range(0, max(1, height - size) + 1, step))
+        if xs[-1] + size < width:
+            xs.append(width - size)
+        if ys[-1] + size < height:
+            ys.append(height - size)
+        return [(x, y, x + size, y + size) for y in ys for x in xs]
+
+
+def map_region(region, scale=1.0, offset=(0, 0)):
+    """Box from a scaled/offset view back to original-image coordinates"""
+    inv = 1.0 / scale
+    return {
+        "x": int(round(region["x"] * inv)) + offset[0],
+        "y": int(round(region["y"] * inv)) + offset[1],
+        "w": int(round(region["w"] * inv)),
+        "h": int(round(region["h"] * inv)),
+    }
+
+
+def iou(a, b):
+    x0, y0 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x1 = min(a["x"] + a["w"], b["x"] + b["w"])
+    y1 = min(a["y"] + a["h"], b["y"] + b["h"])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a["w"] * a["h"] + b["w"] * b["h"] - inter
+    return inter / union if union else 0.0
+
+
+def suppress_duplicates(candidates, iou_threshold=0.4):
+    """
+    Greedy NMS over (region, score, payload) tuples, largest score first;
+    removes the same face found by the global pass and by overlapping tiles.
+    """
+    kept = []
+    for cand in sorted(candidates, key=lambda c: c[1], reverse=True):
+        if all(iou(cand[0], k[0]) < iou_threshold for k in kept):
+            kept.append(cand)
+    return kept
+
+
+def letterbox_gray(gray):
+    """
+    48x48 classifier input from a grayscale face in [0, 1], resized the way
+    DeepFace does it: scaled to fit DEEPFACE_TARGET_SIDE with the aspect ratio
+    kept, padded with black to a square, then resized to 48x48. Stretching the
+    crop straight to 48x48 shifts the scores on non-square faces.
+    """
+    h, w = gray.shape[:2]
+    factor = min(DEEPFACE_TARGET_SIDE / h, DEEPFACE_TARGET_SIDE / w)
+    gray = cv2.resize(gray, (int(w * factor), int(h * factor)))
+    pad_h, pad_w = DEEPFACE_TARGET_SIDE - gray.shape[0], DEEPFACE_TARGET_SIDE - gray.shape[1]
+    gray = np.pad(gray, ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2)), "constant")
+    if gray.shape[:2] != (DEEPFACE_TARGET_SIDE, DEEPFACE_TARGET_SIDE):
+        gray = cv2.resize(gray, (DEEPFACE_TARGET_SIDE, DEEPFACE_TARGET_SIDE))
+    return cv2.resize(gray, (EMOTION_INPUT_SIDE, EMOTION_INPUT_SIDE))
+
+
+def crop_gray(img_rgb, region):
+    """48x48 grayscale classifier input cropped from an RGB frame"""
+    h, w = img_rgb.shape[:2]
+    x0, y0 = max(0, region["x"]), max(0, region["y"])
+    x1, y1 = min(w, region["x"] + region["w"]), min(h, region["y"] + region["h"])
+    crop = img_rgb[y0:y1, x0:x1]
+    if crop.size == 0:
+        return np.zeros((EMOTION_INPUT_SIDE, EMOTION_INPUT_SIDE), dtype=np.float32)
+    # Same channel handling as DeepFace.analyze on an RGB array
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+    return letterbox_gray(gray)
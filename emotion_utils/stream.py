@@ -0,0 +1,241 @@
+# emotion_utils/stream.py
+"""
+Continuous emotion analysis for camera and video frames.
+
+    python -m emotion_utils.stream 0                      # webcam
+    python -m emotion_utils.stream clip.mp4 -o annotated.mp4
+
+Full face detection only runs every `detect_every` frames, or sooner when a
+track is lost. In between, each face is followed by normalized template
+matching in a small search window on a downscaled grayscale frame. Emotion
+classification runs on tracked crops every `classify_every` frames, batched
+across faces. Each track's class probabilities are smoothed with an
+exponential moving average so labels don't flicker.
+"""
+import argparse
+import itertools
+import os
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from emotion_utils.detector import EmotionDetector
+from emotion_utils.resolution import crop_gray, iou
+
+
+class StreamConfig:
+    """Streaming knobs; defaults come from STREAM_* environment variables"""
+
+    def __init__(self, detect_every=None, classify_every=None, smoothing=None,
+                 match_threshold=None, track_side=None, search_margin=None):
+        # Full detection cadence (frames)
+        self.detect_every = detect_every or int(os.environ.get("STREAM_DETECT_EVERY", "10"))
+        # Emotion classification cadence per track (frames)
+        self.classify_every = classify_every or int(os.environ.get("STREAM_CLASSIFY_EVERY", "3"))
+        # EMA weight of the newest probabilities (1.0 = no smoothing)
+        self.smoothing = smoothing if smoothing is not None else float(os.environ.get("STREAM_SMOOTHING", "0.4"))
+        # Minimum TM_CCOEFF_NORMED score to keep a track
+        self.match_threshold = match_threshold if match_threshold is not None else float(
+            os.environ.get("STREAM_MATCH_THRESHOLD", "0.5"))
+        # Longest side of the grayscale frame the tracker works on
+        self.track_side = track_side or int(os.environ.get("STREAM_TRACK_SIDE", "480"))
+        # Search window around the last box, as a fraction of the box size
+        self.search_margin = search_margin if search_margin is not None else 0.5
+
+
+class Track:
+    _ids = itertools.count(1)
+
+    def __init__(self, region: dict, probs: np.ndarray, frame_idx: int):
+        self.id = next(Track._ids)
+        self.region = dict(region)
+        self.probs = probs
+        self.template: Optional[np.ndarray] = None
+        self.last_classified = frame_idx
+
+    def smooth(self, probs: np.ndarray, alpha: float):
+        self.probs = alpha * probs + (1 - alpha) * self.probs
+
+
+class EmotionStream:
+    """
+    Wraps an EmotionDetector for frame sequences.
+    `process(frames)` yields (frame, detections) per input frame; the
+    detections carry a "track_id" and are ready for `draw_detections`.
+    """
+
+    def __init__(self, detector: Optional[EmotionDetector] = None, config: Optional[StreamConfig] = None):
+        self.detector = detector or EmotionDetector()
+        self.config = config or StreamConfig()
+        self.tracks: List[Track] = []
+        self.frame_idx = 0
+        self.detections_run = 0
+        self.classifications_run = 0
+
+    # --- tracking on a downscaled grayscale frame ---
+
+    def _track_view(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.config.track_side / max(h, w))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1:
+            gray = cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    @staticmethod
+    def _scaled_box(region: dict, scale: float, shape) -> Tuple[int, int, int, int]:
+        h, w = shape[:2]
+        x0 = int(np.clip(region["x"] * scale, 0, w - 1))
+        y0 = int(np.clip(region["y"] * scale, 0, h - 1))
+        x1 = int(np.clip((region["x"] + region["w"]) * scale, x0 + 1, w))
+        y1 = int(np.clip((region["y"] + region["h"]) * scale, y0 + 1, h))
+        return x0, y0, x1, y1
+
+    def _set_template(self, track: Track, gray: np.ndarray, scale: float):
+        x0, y0, x1, y1 = self._scaled_box(track.region, scale, gray.shape)
+        track.template = gray[y0:y1, x0:x1].copy()
+
+    def _follow(self, track: Track, gray: np.ndarray, scale: float) -> bool:
+        """Move the track to the best template match near its last box"""
+        template = track.template
+        if template is None or min(template.shape) < 4:
+            return False
+        th, tw = template.shape
+        x0, y0, x1, y1 = self._scaled_box(track.region, scale, gray.shape)
+        mx, my = int(tw * self.config.search_margin), int(th * self.config.search_margin)
+        sx0, sy0 = max(0, x0 - mx), max(0, y0 - my)
+        sx1, sy1 = min(gray.shape[1], x1 + mx), min(gray.shape[0], y1 + my)
+        window = gray[sy0:sy1, sx0:sx1]
+        if window.shape[0] < th or window.shape[1] < tw:
+            return False
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+        if best < self.config.match_threshold:
+            return False
+        track.region["x"] = int(round((sx0 + bx) / scale))
+        track.region["y"] = int(round((sy0 + by) / scale))
+        return True
+
+    # --- detection and classification ---
+
+    def _detect(self, frame: np.ndarray, gray: np.ndarray, scale: float):
+        """
+        Full detection; faces are matched to existing tracks by IoU (keeping
+        their ids and smoothed probabilities), unmatched tracks are dropped.
+        """
+        self.detections_run += 1
+        faces = self.detector.find_faces(frame, whole_frame_fallback=False)
+        probs = self.detector.classify_faces([crop for _, crop in faces])
+        self.classifications_run += len(faces)
+        alpha = self.config.smoothing
+        kept, unmatched = [], list(self.tracks)
+        for (region, _), face_probs in zip(faces, probs):
+            best = max(unmatched, key=lambda t: iou(t.region, region), default=None)
+            if best is not None and iou(best.region, region) > 0.3:
+                unmatched.remove(best)
+                best.region = dict(region)
+                best.smooth(face_probs, alpha)
+                best.last_classified = self.frame_idx
+                track = best
+            else:
+                track = Track(region, face_probs, self.frame_idx)
+            self._set_template(track, gray, scale)
+            kept.append(track)
+        self.tracks = kept
+
+    def _classify_due(self, frame: np.ndarray):
+        due = [t for t in self.tracks if self.frame_idx - t.last_classified >= self.config.classify_every]
+        if not due:
+            return
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        probs = self.detector.classify_faces([crop_gray(frame_rgb, t.region) for t in due])
+        self.classifications_run += len(due)
+        for track, track_probs in zip(due, probs):
+            track.smooth(track_probs, self.config.smoothing)
+            track.last_classified = self.frame_idx
+
+    def step(self, frame: np.ndarray) -> List[dict]:
+        """Detections for one BGR frame"""
+        gray, scale = self._track_view(frame)
+        followed = [t for t in self.tracks if self._follow(t, gray, scale)]
+        lost = len(followed) < len(self.tracks)
+
+        if self.frame_idx % self.config.detect_every == 0 or lost:
+            # Lost tracks still take part in IoU matching so a re-found face keeps its id
+            self._detect(frame, gray, scale)
+        else:
+            self.tracks = followed
+            self._classify_due(frame)
+        self.frame_idx += 1
+
+        detections = []
+        for track in self.tracks:
+            det = EmotionDetector._to_detection(track.region, track.probs)
+            det["track_id"] = track.id
+            detections.append(det)
+        return detections
+
+    def process(self, frames: Iterable[np.ndarray]) -> Iterator[Tuple[np.ndarray, List[dict]]]:
+        for frame in frames:
+            yield frame, self.step(frame)
+
+    def stats(self) -> dict:
+        return {"frames": self.frame_idx, "detections_run": self.detections_run,
+                "classifications_run": self.classifications_run, "tracks": len(self.tracks)}
+
+
+def video_frames(source: Union[int, str], max_frames: Optional[int] = None) -> Iterator[np.ndarray]:
+    """BGR frames from a camera index or a video file/URL"""
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video source {source!r}")
+    try:
+        count = 0
+        while max_frames is None or count < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            count += 1
+            yield frame
+    finally:
+        capture.release()
+
+
+def annotated_frames(stream: EmotionStream, frames: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+    """Frames with the tracked detections drawn on them"""
+    for frame, detections in stream.process(frames):
+        yield stream.detector.draw_detections(frame, detections)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming emotion detection on a camera or video file")
+    parser.add_argument("source", help="Camera index (e.g. 0) or video path/URL")
+    parser.add_argument("-o", "--output", help="Write an annotated video here")
+    parser.add_argument("--show", action="store_true", help="Display frames in a window")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--detect-every", type=int, default=None)
+    parser.add_argument("--classify-every", type=int, default=None)
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    stream = EmotionStream(config=StreamConfig(detect_every=args.detect_every, classify_every=args.classify_every))
+    writer = None
+    start = time.perf_counter()
+    for frame in annotated_frames(stream, video_frames(source, args.max_frames)):
+        if args.output and writer is None:
+            h, w = frame.shape[:2]
+            writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), 25, (w, h))
+        if writer is not None:
+            writer.write(frame)
+        if args.show:
+            cv2.imshow("emotions", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+    elapsed = time.perf_counter() - start
+    if writer is not None:
+        writer.release()
+    stats = stream.stats()
+    print(f"{stats['frames']} frames in {elapsed:.1f}s ({stats['frames'] / max(elapsed, 1e-9):.1f} fps), "
+          f"{stats['detections_run']} detections, {stats['classifications_run']} face classifications")
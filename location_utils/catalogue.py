@@ -0,0 +1,116 @@
+# location_utils/catalogue.py
+import csv
+import hashlib
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOGUE = os.path.join(os.path.dirname(__file__), "data", "landmarks.csv")
+CATALOGUE_PATH = os.environ.get("LANDMARK_CATALOGUE", DEFAULT_CATALOGUE)
+
+# Bounding box as (min_lat, min_lon, max_lat, max_lon)
+BBox = Tuple[float, float, float, float]
+
+
+class LandmarkCatalogue:
+    """
+    Landmark metadata loaded from a CSV data file.
+
+    Columns: key, name, city, country, lat, lon, prompts
+    `prompts` is an optional "|"-separated list of CLIP prompt variants;
+    when empty the key itself is used as the only prompt.
+    """
+
+    def __init__(self, keys: List[str], names: List[str], cities: List[str], countries: List[str],
+                 lat: np.ndarray, lon: np.ndarray, prompts: List[List[str]], digest: str = ""):
+        self.keys = keys
+        self.names = names
+        self.cities = cities
+        self.countries = countries
+        self.lat = lat
+        self.lon = lon
+        self.prompts = prompts
+        # Hash of the data file's bytes, so caches of derived results notice in-place edits
+        self.digest = digest
+        self._rows: Dict[str, int] = {key: i for i, key in enumerate(keys)}
+        self._country_codes = np.array([c.lower() for c in countries])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key: str):
+        return key.lower() in self._rows
+
+    @classmethod
+    def load(cls, path: str = CATALOGUE_PATH) -> "LandmarkCatalogue":
+        keys, names, cities, countries, lats, lons, prompts = [], [], [], [], [], [], []
+        seen = set()
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()[:16]
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    key = row["key"].strip().lower()
+                    lat, lon = float(row["lat"]), float(row["lon"])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"[CATALOGUE] Skipping line {line_no}: {e}")
+                    continue
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                variants = [p.strip() for p in (row.get("prompts") or "").split("|") if p.strip()]
+                keys.append(key)
+                names.append(row.get("name") or key)
+                cities.append(row.get("city") or "")
+                countries.append(row.get("country") or "")
+                lats.append(lat)
+                lons.append(lon)
+                prompts.append(variants or [key])
+        logger.info(f"[CATALOGUE] Loaded {len(keys)} landmarks from {path}")
+        return cls(keys, names, cities, countries,
+                   np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), prompts, digest)
+
+    def row(self, key: str) -> Optional[int]:
+        return self._rows.get(key.lower())
+
+    def get(self, key: str) -> Optional[dict]:
+        """O(1) lookup of a landmark record by key"""
+        idx = self.row(key)
+        if idx is None:
+            return None
+        return self.record(idx)
+
+    def record(self, idx: int) -> dict:
+        return {
+            "key": self.keys[idx],
+            "name": self.names[idx],
+            "city": self.cities[idx],
+            "country": self.countries[idx],
+            "lat": float(self.lat[idx]),
+            "lon": float(self.lon[idx]),
+        }
+
+    def candidates(self, country: Optional[str] = None, bbox: Optional[BBox] = None) -> Optional[np.ndarray]:
+        """
+        Row indices matching a region hint, or None when no hint is given
+        (meaning "search everything").
+        """
+        if not country and not bbox:
+            return None
+        mask = np.ones(len(self.keys), dtype=bool)
+        if country:
+            mask &= self._country_codes == country.lower()
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            mask &= (self.lat >= min_lat) & (self.lat <= max_lat)
+            if min_lon <= max_lon:
+                mask &= (self.lon >= min_lon) & (self.lon <= max_lon)
+            else:  # Box crosses the antimeridian
+                mask &= (self.lon >= min_lon) | (self.lon <= max_lon)
+        return np.flatnonzero(mask)
@@ -0,0 +1,258 @@
+# location_utils/clip_onnx.py
+"""
+Selectable inference engines for the CLIP image encoder.
+
+    CLIP_ENGINE=onnx-int8 streamlit run app.py
+    python -m location_utils.clip_onnx photos/ --engines torch onnx onnx-int8
+
+The text side is already precomputed in the landmark index, so only the
+image encoder changes engine. The vision tower plus its projection is
+exported once to ONNX, optionally quantized to int8 weights, and run with
+ONNX Runtime on CPU with configurable intra-op/inter-op thread counts.
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENGINES = ("torch", "onnx", "onnx-int8")
+CLIP_ENGINE = os.environ.get("CLIP_ENGINE", "torch")
+ONNX_DIR = os.environ.get("CLIP_ONNX_DIR", os.path.join(".cache", "clip_onnx"))
+ONNX_OPSET = 17
+
+
+def onnx_paths(model_name: str, onnx_dir: str = ONNX_DIR):
+    """(fp32 path, int8 path) of the exported vision encoder"""
+    stem = os.path.join(onnx_dir, model_name.replace("/", "__") + "-vision")
+    return stem + ".onnx", stem + ".int8.onnx"
+
+
+def _write_atomically(path: str, write: Callable[[str], None]):
+    """
+    Run `write(tmp_path)` on a private temp file next to `path`, then rename it
+    into place. Batch workers warm the encoder at the same time; each writes
+    its own file and the last complete one to be renamed wins.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".onnx",
+                                    dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        # mkstemp files are owner-only; the exported graph is a shared read-only cache
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_vision(model, path: str, opset: int = ONNX_OPSET):
+    """Export vision tower + projection + L2 normalization with a dynamic batch axis"""
+    import torch
+
+    class _VisionEncoder(torch.nn.Module):
+        def __init__(self, clip_model):
+            super().__init__()
+            self.vision_model = clip_model.vision_model
+            self.visual_projection = clip_model.visual_projection
+
+        def forward(self, pixel_values):
+            pooled = self.vision_model(pixel_values=pixel_values).pooler_output
+            features = self.visual_projection(pooled)
+            return features / features.norm(dim=-1, keepdim=True)
+
+    if os.path.exists(path):
+        # Another worker finished the export while this one was loading the model
+        return
+    side = model.config.vision_config.image_size
+    dummy = torch.zeros(1, 3, side, side)
+
+    def write(tmp_path):
+        with torch.no_grad():
+            torch.onnx.export(
+                _VisionEncoder(model).eval(), (dummy,), tmp_path,
+                input_names=["pixel_values"], output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=opset,
+            )
+
+    logger.info(f"[CLIP ONNX] Exporting vision encoder to {path}...")
+    _write_atomically(path, write)
+
+
+def quantize(fp32_path: str, int8_path: str):
+    """Dynamic int8 quantization: int8 weights, activations quantized on the fly"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    if os.path.exists(int8_path):
+        return
+    logger.info(f"[CLIP ONNX] Quantizing {fp32_path} -> {int8_path}...")
+    _write_atomically(int8_path, lambda tmp_path: quantize_dynamic(fp32_path, tmp_path,
+                                                                   weight_type=QuantType.QInt8))
+
+
+def session_options(intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+    """
+    ONNX Runtime session options. Thread counts default to ORT_INTRA_OP_THREADS /
+    ORT_INTER_OP_THREADS (read at session creation so batch workers can pin them);
+    0 lets ONNX Runtime pick.
+    """
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    if intra_op_threads is None:
+        intra_op_threads = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+    if inter_op_threads is None:
+        inter_op_threads = int(os.environ.get("ORT_INTER_OP_THREADS", "0"))
+    opts.intra_op_num_threads = intra_op_threads
+    opts.inter_op_num_threads = inter_op_threads
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return opts
+
+
+class TorchImageEncoder:
+    """The transformers CLIP model run through torch (the reference engine)"""
+
+    engine = "torch"
+
+    def __init__(self, processor, model):
+        self.processor = processor
+        self.model = model
+
+    def encode(self, images: Sequence[Image.Image]) -> np.ndarray:
+        """Normalized embeddings, one row per image"""
+        import torch
+        inputs = self.processor(images=list(images), return_tensors="pt")
+        # The model may hold half-precision weights (CLIP_DTYPE)
+        pixels = inputs["pixel_values"].to(self.model.dtype)
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=pixels).float()
+            features = features / features.norm(dim=-1, keepdim=True)
+        return features.cpu().numpy().astype(np.float32)
+
+
+class OnnxImageEncoder:
+    """The exported vision encoder run through an ONNX Runtime CPU session"""
+
+    def __init__(self, path: str, image_processor, engine: str = "onnx",
+                 intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+        import onnxruntime as ort
+
+        self.engine = engine
+        self.path = path
+        self.image_processor = image_processor
+        self.session = ort.InferenceSession(
+            path, sess_options=session_options(intra_op_threads, inter_op_threads),
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def encode(self, images: Sequence[Image.Image]) -> np.ndarray:
+        """Normalized embeddings, one row per image"""
+        pixels = self.image_processor(images=list(images), return_tensors="np")["pixel_values"]
+        outputs = self.session.run(None, {self.input_name: pixels.astype(np.float32)})
+        return np.asarray(outputs[0], dtype=np.float32)
+
+
+def load_image_encoder(engine: str, model_name: str, load_clip: Callable, onnx_dir: str = ONNX_DIR,
+                       intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+    """
+    Image encoder for `engine`. `load_clip` returns (processor, model) and is
+    only called for the torch engine or when the ONNX graph must be exported.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown CLIP engine '{engine}', expected one of {ENGINES}")
+    if engine == "torch":
+        return TorchImageEncoder(*load_clip())
+
+    fp32_path, int8_path = onnx_paths(model_name, onnx_dir)
+    if not os.path.exists(fp32_path):
+        _, model = load_clip()
+        export_vision(model, fp32_path)
+    path = fp32_path
+    if engine == "onnx-int8":
+        if not os.path.exists(int8_path):
+            quantize(fp32_path, int8_path)
+        path = int8_path
+
+    from transformers import CLIPImageProcessor
+    logger.info(f"[CLIP ONNX] Loading {engine} encoder from {path}")
+    return OnnxImageEncoder(path, CLIPImageProcessor.from_pretrained(model_name), engine,
+                            intra_op_threads, inter_op_threads)
+
+
+def compare_engines(images: List[Image.Image], encoders: Dict[str, object], top1: Callable[[np.ndarray], int],
+                    baseline: str = "torch") -> dict:
+    """
+    Per-engine latency (one image per call, after one warm-up call) and
+    parity against `baseline`: top-1 landmark agreement and mean cosine
+    similarity of the embeddings.
+    """
+    report, features, predictions = {}, {}, {}
+    for name, encoder in encoders.items():
+        encoder.encode(images[:1])
+        latencies, rows = [], []
+        for image in images:
+            start = time.perf_counter()
+            rows.append(encoder.encode([image])[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        features[name] = np.stack(rows)
+        predictions[name] = np.array([top1(vec) for vec in features[name]])
+        latencies = np.array(latencies)
+        report[name] = {
+            "mean_ms": round(float(latencies.mean()), 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "images_per_s": round(1000.0 / float(latencies.mean()), 2),
+        }
+
+    if baseline in encoders:
+        for name in encoders:
+            report[name]["top1_agreement"] = round(float(np.mean(predictions[name] == predictions[baseline])), 4)
+            cosine = np.sum(features[name] * features[baseline], axis=1)
+            report[name]["mean_cosine"] = round(float(cosine.mean()), 5)
+            report[name]["speedup"] = round(report[baseline]["mean_ms"] / report[name]["mean_ms"], 2)
+    return report
+
+
+if __name__ == "__main__":
+    from location_utils.exif_fast import iter_image_paths
+    from location_utils.landmark import CLIP_MODEL_NAME, get_clip, get_landmark_index
+
+    parser = argparse.ArgumentParser(description="Compare CLIP image-encoder engines")
+    parser.add_argument("source", help="Directory of sample images")
+    parser.add_argument("--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of sample images")
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    parser.add_argument("-o", "--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    paths = list(iter_image_paths(args.source))[:args.limit]
+    if not paths:
+        parser.error(f"No images found under {args.source}")
+    samples = [Image.open(p).convert("RGB") for p in paths]
+    index = get_landmark_index()
+    engines = {name: load_image_encoder(name, CLIP_MODEL_NAME, get_clip,
+                                        intra_op_threads=args.intra_op_threads,
+                                        inter_op_threads=args.inter_op_threads)
+               for name in args.engines}
+    result = {"images": len(samples),
+              "engines": compare_engines(samples, engines, lambda vec: index.search(vec, top_k=1)[0][0])}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,221 @@
+# location_utils/exif_fast.py
+import logging
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".tif", ".tiff")
+
+_GPS_IFD_POINTER = 0x8825
+_GPS_TAGS = {1: "GPSLatitudeRef", 2: "GPSLatitude", 3: "GPSLongitudeRef", 4: "GPSLongitude"}
+# TIFF field type -> (struct code, size in bytes)
+_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("L", 4), 5: ("LL", 8), 7: ("B", 1),
+          9: ("l", 4), 10: ("ll", 8), 12: ("d", 8)}
+
+Source = Union[str, bytes, bytearray, memoryview, mmap.mmap]
+
+
+class ExifFormatError(ValueError):
+    """The data is not a JPEG/TIFF container this parser understands"""
+
+
+class _BufferReader:
+    def __init__(self, buf):
+        self.buf = buf
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        return bytes(self.buf[offset:offset + size])
+
+
+class _FileReader:
+    """Reads only the requested byte ranges, so a scan never pulls in pixel data"""
+
+    def __init__(self, f):
+        self.f = f
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        self.f.seek(offset)
+        return self.f.read(size)
+
+
+def _find_tiff_block(reader) -> Optional[bytes]:
+    """TIFF block holding the EXIF IFDs: the APP1 payload of a JPEG, or the whole head of a TIFF"""
+    head = reader.read_at(0, 4)
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        # Plain TIFF: IFD offsets are absolute, so hand back a reader-backed view
+        return _TiffFile(reader)
+    if head[:2] != b"\xff\xd8":
+        raise ExifFormatError("not a JPEG or TIFF file")
+
+    offset = 2
+    while True:
+        marker = reader.read_at(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if code in (0xD9, 0xDA):  # End of image / start of scan: no EXIF before pixel data
+            return None
+        if 0xD0 <= code <= 0xD7 or code == 0x01:  # Markers without a length field
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", marker[2:4])
+        if code == 0xE1:
+            payload = reader.read_at(offset + 4, length - 2)
+            if payload.startswith(b"Exif\x00\x00"):
+                return payload[6:]
+        offset += 2 + length
+
+
+class _TiffFile:
+    """Adapter so a bare TIFF file can be parsed like an in-memory APP1 block"""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __getitem__(self, item):
+        start = item.start or 0
+        return self.reader.read_at(start, item.stop - start)
+
+
+def _parse_gps_ifd(tiff) -> Optional[dict]:
+    byte_order = bytes(tiff[0:2])
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        raise ExifFormatError("bad TIFF byte order")
+
+    def unpack(fmt, offset, size):
+        data = bytes(tiff[offset:offset + size])
+        if len(data) < size:
+            raise ExifFormatError("truncated EXIF block")
+        return struct.unpack(endian + fmt, data)
+
+    def entries(ifd_offset):
+        (count,) = unpack("H", ifd_offset, 2)
+        for i in range(count):
+            yield unpack("HHL4s", ifd_offset + 2 + 12 * i, 12)
+
+    def value(field_type, count, raw):
+        code, size = _TYPES.get(field_type, (None, 0))
+        if code is None:
+            return None
+        total = size * count
+        if total <= 4:
+            data = raw[:total]
+        else:
+            (offset,) = struct.unpack(endian + "L", raw)
+            data = bytes(tiff[offset:offset + total])
+        if field_type == 2:
+            return data.split(b"\x00", 1)[0].decode("ascii", "replace")
+        if field_type in (5, 10):
+            nums = struct.unpack(endian + code[0] * (2 * count), data)
+            return tuple(nums[i] / nums[i + 1] if nums[i + 1] else 0.0 for i in range(0, len(nums), 2))
+        return struct.unpack(endian + code * count, data)
+
+    (ifd0,) = unpack("L", 4, 4)
+    gps_offset = None
+    for tag, _, _, raw in entries(ifd0):
+        if tag == _GPS_IFD_POINTER:
+            (gps_offset,) = struct.unpack(endian + "L", raw)
+            break
+    if gps_offset is None:
+        return None
+
+    gps_info = {}
+    for tag, field_type, count, raw in entries(gps_offset):
+        if tag in _GPS_TAGS:
+            gps_info[_GPS_TAGS[tag]] = value(field_type, count, raw)
+    return gps_info or None
+
+
+def read_gps_info(source: Source) -> Optional[dict]:
+    """
+    GPS tags decoded straight from the JPEG APP1 / TIFF header of a path,
+    bytes buffer or mmap, in the same dict shape extract_gps returns.
+    Returns None when the image carries no GPS block and raises
+    ExifFormatError for containers the fast path does not handle.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            tiff = _find_tiff_block(_FileReader(f))
+            return _parse_gps_ifd(tiff) if tiff is not None else None
+    tiff = _find_tiff_block(_BufferReader(source))
+    return _parse_gps_ifd(tiff) if tiff is not None else None
+
+
+def _dms_to_degrees(dms, ref) -> Optional[float]:
+    if not dms:
+        return None
+    parts = list(dms) + [0.0] * (3 - len(dms))
+    degrees = parts[0] + parts[1] / 60 + parts[2] / 3600
+    return -degrees if ref in ("S", "W") else degrees
+
+
+def read_gps(source: Source) -> Optional[Tuple[float, float]]:
+    """(lat, lon) rounded like convert_gps, or None if missing, invalid or unreadable"""
+    try:
+        info = read_gps_info(source)
+    except (ExifFormatError, OSError, struct.error) as e:
+        logger.debug(f"[EXIF FAST] {e}")
+        return None
+    if not info:
+        return None
+    lat = _dms_to_degrees(info.get("GPSLatitude"), info.get("GPSLatitudeRef"))
+    lon = _dms_to_degrees(info.get("GPSLongitude"), info.get("GPSLongitudeRef"))
+    if lat is None or lon is None or not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return None
+    return round(lat, 6), round(lon, 6)
+
+
+def iter_image_paths(root: str, extensions=IMAGE_EXTENSIONS) -> Iterator[str]:
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(dirpath, filename)
+
+
+def scan_gps(paths: Union[str, Iterable[str]], workers: int = 8,
+             max_in_flight: int = 256) -> Iterator[Tuple[str, Optional[float], Optional[float]]]:
+    """
+    Stream (path, lat, lon) for a directory (walked recursively) or an
+    iterable of paths, reading headers on a thread pool. Results arrive in
+    completion order; lat/lon are None for files without usable GPS.
+    """
+    if isinstance(paths, str):
+        paths = iter_image_paths(paths)
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for path in paths:
+            pending[pool.submit(read_gps, path)] = path
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _scan_result(pending.pop(future), future)
+        for future in list(pending):
+            yield _scan_result(pending.pop(future), future)
+
+
+def _scan_result(path, future):
+    coords = future.result()
+    return (path, coords[0], coords[1]) if coords else (path, None, None)
+
+
+if __name__ == "__main__":
+    # python -m location_utils.exif_fast <dir-or-files...>  ->  TSV of path, lat, lon
+    targets = sys.argv[1:] or ["."]
+    sources = targets[0] if len(targets) == 1 and os.path.isdir(targets[0]) else targets
+    for path, lat, lon in scan_gps(sources):
+        print(f"{path}\t{'' if lat is None else lat}\t{'' if lon is None else lon}")
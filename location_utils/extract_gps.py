@@ -1,17 +1,52 @@
 # location_utils/extract_gps.py
 import logging
+import struct
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
+from location_utils.exif_fast import ExifFormatError, read_gps_info
+from pipeline_utils.image_context import ImageContext
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_gps(image_path):
-    """Extract GPS information from image EXIF data"""
+def extract_gps(image_source):
+    """
+    Extract GPS information from image EXIF data.
+    Accepts a file path or an ImageContext (whose parsed EXIF is reused).
+    """
+    if isinstance(image_source, ImageContext):
+        return image_source.gps_info
+    fast = gps_from_header(image_source)
+    if fast is not False:
+        return fast
+    try:
+        image = Image.open(image_source)
+    except Exception as e:
+        logger.error(f"[EXIF ERROR] {e}")
+        return None
+    return gps_from_image(image)
+
+def gps_from_header(source):
+    """
+    GPS block read straight from the JPEG/TIFF header of a path or buffer.
+    Returns False when the fast path cannot handle the file (e.g. PNG), so
+    the caller can fall back to PIL.
+    """
+    try:
+        gps_info = read_gps_info(source)
+    except (ExifFormatError, struct.error, OSError) as e:
+        logger.debug(f"[EXIF] Header fast path unavailable: {e}")
+        return False
+    if gps_info:
+        logger.info(f"[EXIF] GPS data keys: {list(gps_info.keys())}")
+    else:
+        logger.info("[EXIF] No GPSInfo field in EXIF data")
+    return gps_info
+
+def gps_from_image(image):
+    """GPS block of an opened (not necessarily decoded) PIL image"""
     try:
-       
-        image = Image.open(image_path)
         exif = image._getexif() or {}
         if not exif:
             logger.info("[EXIF] No EXIF data found")
@@ -0,0 +1,205 @@
+# location_utils/geo_client.py
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+from pipeline_utils import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+OVERPASS_URL = os.environ.get("OVERPASS_URL", "http://overpass-api.de/api/interpreter")
+USER_AGENT = os.environ.get("GEO_USER_AGENT", "geoai_app_v2")
+# Nominatim's usage policy allows at most one request per second per application
+NOMINATIM_RATE = float(os.environ.get("NOMINATIM_RATE", "1.0"))
+OVERPASS_RATE = float(os.environ.get("OVERPASS_RATE", "1.0"))
+MAX_CONCURRENCY = int(os.environ.get("GEO_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.environ.get("GEO_MAX_RETRIES", "3"))
+REQUEST_TIMEOUT = float(os.environ.get("GEO_REQUEST_TIMEOUT", "15"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeoServiceError(Exception):
+    """The remote geo service failed after all retries"""
+
+
+class TokenBucket:
+    """Async token bucket; waiting happens on the event loop, never by blocking a thread"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GeoClient:
+    """
+    Shared client for Nominatim reverse geocoding and Overpass queries.
+
+    - one pooled keep-alive aiohttp session
+    - one token bucket per service, shared by every caller in the process
+    - single-flight: concurrent identical lookups await the same request
+    - a semaphore bounding in-flight requests
+    - exponential backoff with jitter via asyncio.sleep
+    """
+
+    def __init__(self, nominatim_url: str = NOMINATIM_URL, overpass_url: str = OVERPASS_URL,
+                 user_agent: str = USER_AGENT, nominatim_rate: float = NOMINATIM_RATE,
+                 overpass_rate: float = OVERPASS_RATE, max_concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES, timeout: float = REQUEST_TIMEOUT):
+        self.nominatim_url = nominatim_url.rstrip("/")
+        self.overpass_url = overpass_url
+        self.user_agent = user_agent
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._rates = {"nominatim": nominatim_rate, "overpass": overpass_rate}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"User-Agent": self.user_agent},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._buckets = {name: TokenBucket(rate) for name, rate in self._rates.items()}
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _request(self, service: str, method: str, url: str, **kwargs) -> dict:
+        session = await self._get_session()
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            await self._buckets[service].acquire()
+            try:
+                async with self._semaphore:
+                    self.requests += 1
+                    async with session.request(method, url, **kwargs) as response:
+                        if response.status in RETRY_STATUSES:
+                            retry_after = response.headers.get("Retry-After", "")
+                            if retry_after.isdigit():
+                                delay = max(delay, float(retry_after))
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history,
+                                status=response.status, message=response.reason or "")
+                        if response.status >= 400:
+                            # Other client/server errors (bad query, forbidden, ...) won't succeed on retry
+                            raise GeoServiceError(f"{service} returned HTTP {response.status} {response.reason or ''}")
+                        return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # ValueError: a garbled or non-JSON body (e.g. an HTML error page from a proxy)
+                logger.warning(f"[GEO CLIENT] {service} attempt {attempt} failed: {e}")
+                if attempt == self.max_retries:
+                    raise GeoServiceError(f"{service} unavailable: {e}") from e
+                self.retries += 1
+                metrics.inc("geo_retries_total", service=service)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                delay *= 2
+
+    async def _single_flight(self, key: tuple, factory: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            metrics.inc("geo_coalesced_total", service=key[0])
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def reverse(self, lat: float, lon: float, language: str = "en") -> Optional[str]:
+        """Nominatim reverse lookup; None when the service has no address for the point"""
+        async def _fetch():
+            data = await self._request("nominatim", "GET", f"{self.nominatim_url}/reverse", params={
+                "format": "jsonv2", "lat": f"{lat}", "lon": f"{lon}", "accept-language": language,
+            })
+            return data.get("display_name") if isinstance(data, dict) else None
+
+        return await self._single_flight(("reverse", round(lat, 7), round(lon, 7), language), _fetch)
+
+    async def overpass(self, query: str) -> dict:
+        async def _fetch():
+            data = await self._request("overpass", "POST", self.overpass_url, data={"data": query})
+            if not isinstance(data, dict):
+                raise GeoServiceError(f"overpass returned {type(data).__name__} instead of an object")
+            return data
+
+        return await self._single_flight(("overpass", query), _fetch)
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "retries": self.retries, "coalesced": self.coalesced}
+
+
+class _LoopThread:
+    """One event loop on a daemon thread; Streamlit script threads submit coroutines to it"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="geo-client-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout: Optional[float] = None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+_loop: Optional[_LoopThread] = None
+_client: Optional[GeoClient] = None
+_lock = threading.Lock()
+
+
+def get_geo_client() -> GeoClient:
+    global _loop, _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _loop = _LoopThread()
+                _client = GeoClient()
+    return _client
+
+
+def run_sync(coro_factory: Callable[[GeoClient], Awaitable], timeout: Optional[float] = None):
+    """Run `coro_factory(client)` on the shared loop and wait for its result"""
+    client = get_geo_client()
+    return _loop.run(coro_factory(client), timeout)
+
+
+def reverse_sync(lat: float, lon: float, language: str = "en") -> Optional[str]:
+    return run_sync(lambda client: client.reverse(lat, lon, language))
+
+
+def overpass_sync(query: str) -> dict:
+    return run_sync(lambda client: client.overpass(query))
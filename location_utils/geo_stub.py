@@ -0,0 +1,85 @@
+# location_utils/geo_stub.py
+"""
+Local stand-in for Nominatim and Overpass, for tests and benchmarks.
+
+    python -m location_utils.geo_stub --port 8089 --latency 0.05
+    NOMINATIM_URL=http://127.0.0.1:8089 OVERPASS_URL=http://127.0.0.1:8089/api/interpreter streamlit run app.py
+
+Reverse lookups answer with the nearest gazetteer place; Overpass queries
+answer with the catalogue landmark whose name matches the query regex.
+"""
+import argparse
+import asyncio
+import logging
+import re
+
+from aiohttp import web
+
+from location_utils.catalogue import LandmarkCatalogue
+from location_utils.offline_geocoder import OfflineGeocoder
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_NAME_PATTERN = re.compile(r'\["name"~"(.+?)",i\]')
+
+
+def make_app(latency: float = 0.0, fail_every: int = 0) -> web.Application:
+    """
+    `latency` adds a fixed delay per request; `fail_every` > 0 makes every
+    n-th request return HTTP 503 so retry paths can be exercised.
+    """
+    geocoder = OfflineGeocoder.load()
+    catalogue = LandmarkCatalogue.load()
+    state = {"requests": 0}
+
+    async def _preamble():
+        state["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if fail_every and state["requests"] % fail_every == 0:
+            raise web.HTTPServiceUnavailable()
+
+    async def reverse(request: web.Request):
+        await _preamble()
+        lat, lon = float(request.query["lat"]), float(request.query["lon"])
+        name = geocoder.reverse(lat, lon)
+        if name is None:
+            return web.json_response({"error": "Unable to geocode"})
+        return web.json_response({"lat": str(lat), "lon": str(lon), "display_name": name})
+
+    async def interpreter(request: web.Request):
+        await _preamble()
+        form = await request.post()
+        query = form.get("data") or await request.text()
+        match = _NAME_PATTERN.search(query)
+        elements = []
+        if match:
+            # Undo the QL string and regex escaping applied by overpass_name_regex
+            needle = re.sub(r"\\+(.)", r"\1", match.group(1)).lower()
+            for i, name in enumerate(catalogue.names):
+                if needle in name.lower() or needle in catalogue.keys[i]:
+                    elements.append({"type": "node", "id": i, "lat": float(catalogue.lat[i]),
+                                     "lon": float(catalogue.lon[i]), "tags": {"name": name}})
+                    break
+        return web.json_response({"elements": elements})
+
+    async def stats(_request: web.Request):
+        return web.json_response(state)
+
+    app = web.Application()
+    app.router.add_get("/reverse", reverse)
+    app.router.add_post("/api/interpreter", interpreter)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Nominatim/Overpass stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of delay added per request")
+    parser.add_argument("--fail-every", type=int, default=0, help="Return 503 on every n-th request")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.fail_every), host=args.host, port=args.port)
@@ -0,0 +1,198 @@
+# location_utils/geocache.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", os.path.join(".cache", "geocode.sqlite"))
+# Geohash precision 7 is a ~150m x 150m cell, roughly "same venue"
+CACHE_PRECISION = int(os.environ.get("GEOCODE_CACHE_PRECISION", "7"))
+CACHE_TTL = float(os.environ.get("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+NEGATIVE_TTL = float(os.environ.get("GEOCODE_CACHE_NEGATIVE_TTL", str(24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_MAX_ENTRIES", "100000"))
+# Seconds a connection waits on another process's write lock before giving up
+CACHE_BUSY_TIMEOUT = float(os.environ.get("GEOCODE_CACHE_BUSY_TIMEOUT", "30"))
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Sentinel returned for cached "no address at this location" results
+NEGATIVE = object()
+
+
+def geohash(lat: float, lon: float, precision: int = CACHE_PRECISION) -> str:
+    """Standard base32 geohash of a coordinate"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+class GeocodeCache:
+    """
+    SQLite-backed reverse-geocoding cache keyed by geohash cell.
+    Entries expire after a TTL (shorter for negative results) and the least
+    recently used rows are evicted once the table exceeds `max_entries`.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, precision: int = CACHE_PRECISION,
+                 ttl: float = CACHE_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.precision = precision
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocode_cache (
+                   cell TEXT PRIMARY KEY,
+                   address TEXT,
+                   created REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_last_access ON geocode_cache(last_access)")
+
+    def key(self, lat: float, lon: float) -> str:
+        return geohash(lat, lon, self.precision)
+
+    def get(self, lat: float, lon: float):
+        """
+        Cached address string, NEGATIVE for a cached "nothing here" result,
+        or None on a miss / expired entry.
+        """
+        cell = self.key(lat, lon)
+        now = time.time()
+        with self._lock:
+            # The cache is an optimization: a locked or broken database is a miss, not an error
+            try:
+                row = self._conn.execute(
+                    "SELECT address, created FROM geocode_cache WHERE cell = ?", (cell,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"[GEOCACHE] Lookup failed, treating as a miss: {e}")
+                self.misses += 1
+                return None
+            if row is None:
+                self.misses += 1
+                return None
+            address, created = row
+            ttl = self.ttl if address is not None else self.negative_ttl
+            if now - created > ttl:
+                self._execute_quietly("DELETE FROM geocode_cache WHERE cell = ?", (cell,))
+                self.misses += 1
+                return None
+            self._execute_quietly("UPDATE geocode_cache SET last_access = ? WHERE cell = ?", (now, cell))
+            if address is None:
+                self.negative_hits += 1
+                return NEGATIVE
+            self.hits += 1
+            return address
+
+    def put(self, lat: float, lon: float, address: Optional[str]):
+        """Store an address; pass None to cache a negative result"""
+        cell = self.key(lat, lon)
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO geocode_cache (cell, address, created, last_access) VALUES (?, ?, ?, ?)",
+                    (cell, address, now, now),
+                )
+                self._writes_since_evict += 1
+                # Evict in batches so the COUNT(*) is not paid on every insert
+                if self._writes_since_evict >= max(1, self.max_entries // 100):
+                    self._writes_since_evict = 0
+                    self._evict()
+            except sqlite3.Error as e:
+                logger.warning(f"[GEOCACHE] Write failed, result not cached: {e}")
+
+    def _execute_quietly(self, sql: str, params: tuple):
+        """Bookkeeping writes on the read path; losing one only affects expiry / LRU order"""
+        try:
+            self._conn.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.warning(f"[GEOCACHE] Cache maintenance failed: {e}")
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM geocode_cache WHERE cell IN "
+                "(SELECT cell FROM geocode_cache ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+            logger.info(f"[GEOCACHE] Evicted {overflow} least recently used entries")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+_cache: Optional[GeocodeCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_geocode_cache() -> Optional[GeocodeCache]:
+    """Process-wide cache instance; None when disabled with GEOCODE_CACHE_PATH=''"""
+    global _cache
+    if not CACHE_PATH:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = GeocodeCache()
+                except Exception as e:
+                    logger.warning(f"[GEOCACHE] Cache disabled, failed to open {CACHE_PATH}: {e}")
+                    return None
+    return _cache
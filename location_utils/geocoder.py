@@ -1,20 +1,31 @@
 # location_utils/geocoder.py
 import logging
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-import time
+import os
+from location_utils.geocache import NEGATIVE, get_geocode_cache
+from location_utils.geo_client import GeoServiceError, reverse_sync
+from location_utils.offline_geocoder import get_offline_geocoder
+from pipeline_utils import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize geocoder
-geolocator = Nominatim(
-    user_agent="geoai_app_v2",
-    timeout=10
-)
-reverse_geocode = RateLimiter(geolocator.reverse, min_delay_seconds=1)
+# remote:   Nominatim only
+# offline:  local gazetteer only, no network access
+# first:    local gazetteer first, Nominatim when no place is near enough
+# fallback: Nominatim first, local gazetteer when the service is unavailable
+GEOCODER_MODE = os.environ.get("GEOCODER_MODE", "fallback").lower()
 
+def _offline_lookup(lat, lon):
+    offline = get_offline_geocoder()
+    if offline is None:
+        return None
+    address = offline.reverse(lat, lon)
+    if address:
+        logger.info(f"[GEOCODER] Offline match: {address}")
+    return address
+
+@metrics.timed("geocode")
 def get_address_from_coords(coords):
     if not coords or not isinstance(coords, (list, tuple)) or len(coords) != 2:
         logger.info("[GEOCODER] Invalid coordinates input: %s", coords)
@@ -26,23 +37,67 @@ def get_address_from_coords(coords):
     if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
         logger.info(f"[GEOCODER] Coordinates out of range: lat={lat}, lon={lon}")
         return "Invalid coordinate range"
+
+    if GEOCODER_MODE in ("offline", "first"):
+        address = _offline_lookup(lat, lon)
+        if address:
+            return address
+        if GEOCODER_MODE == "offline":
+            return "Unknown location"
+
+    cache = get_geocode_cache()
+    if cache is not None:
+        cached = cache.get(lat, lon)
+        metrics.inc("geocode_cache_requests_total", outcome="miss" if cached is None else "hit")
+        if cached is NEGATIVE:
+            logger.info(f"[GEOCODER] Cache hit (negative) for {lat}, {lon}")
+            return "Unknown location"
+        if cached is not None:
+            logger.info(f"[GEOCODER] Cache hit: {cached}")
+            return cached
     
-    for attempt in range(3):  # Retry logic
-        try:
-            logger.info(f"[GEOCODER] Attempt {attempt + 1}: Reverse geocoding {lat}, {lon}")
-            location = reverse_geocode(f"{lat}, {lon}", language='en', exactly_one=True, timeout=15)
-            
-            if location and location.address:
-                logger.info(f"[GEOCODER] Success: {location.address}")
-                return location.address
-            else:
-                logger.info("[GEOCODER] No location found")
-                return "Unknown location"
-                
-        except Exception as e:
-            logger.warning(f"[GEOCODER] Attempt {attempt+1} failed: {e}")
-            if attempt < 3:  # Don't sleep on last attempt
-                time.sleep(2)
-                
-    logger.error("[GEOCODER] All geocoding attempts failed for %s", coords)
+    # Rate limiting, retries with backoff and coalescing of identical lookups
+    # all happen inside the shared async geo client
+    try:
+        logger.info(f"[GEOCODER] Reverse geocoding {lat}, {lon}")
+        address = reverse_sync(lat, lon, language='en')
+        if address:
+            logger.info(f"[GEOCODER] Success: {address}")
+            if cache is not None:
+                cache.put(lat, lon, address)
+            return address
+        else:
+            logger.info("[GEOCODER] No location found")
+            if cache is not None:
+                cache.put(lat, lon, None)
+            return "Unknown location"
+    except GeoServiceError as e:
+        logger.error("[GEOCODER] All geocoding attempts failed for %s: %s", coords, e)
+
+    if GEOCODER_MODE == "fallback":
+        address = _offline_lookup(lat, lon)
+        if address:
+            metrics.inc("pipeline_fallbacks_total", kind="offline_geocoder")
+            return address
     return "Geocoding service unavailable"
+
+def get_addresses_from_coords(coords_list):
+    """
+    Reverse geocode many coordinates. In offline mode the whole batch is
+    answered with one vectorized k-d tree query; other modes go one by one.
+    """
+    offline = get_offline_geocoder() if GEOCODER_MODE == "offline" else None
+    if offline is None:
+        return [get_address_from_coords(coords) for coords in coords_list]
+    results = [None] * len(coords_list)
+    valid = []
+    for i, coords in enumerate(coords_list):
+        if not coords or not isinstance(coords, (list, tuple)) or len(coords) != 2:
+            results[i] = "Invalid coordinates"
+        elif not (-90 <= coords[0] <= 90) or not (-180 <= coords[1] <= 180):
+            results[i] = "Invalid coordinate range"
+        else:
+            valid.append(i)
+    for i, address in zip(valid, offline.reverse_batch([coords_list[i] for i in valid])):
+        results[i] = address or "Unknown location"
+    return results
@@ -1,153 +1,226 @@
 # location_utils/landmark.py
 import logging
-from typing import Optional  
-import streamlit as st
-import requests
-from transformers import CLIPProcessor, CLIPModel
+import math
+import os
+from functools import lru_cache
+from typing import List, Optional  
 from PIL import Image
-import torch
+import numpy as np
+from location_utils.clip_onnx import CLIP_ENGINE, load_image_encoder
+from location_utils.landmark_index import LandmarkIndex
+from location_utils.catalogue import CATALOGUE_PATH, BBox, LandmarkCatalogue
+from pipeline_utils.image_context import ImageContext
+from pipeline_utils import metrics
+from pipeline_utils.models import registry
+from location_utils.geo_client import GeoServiceError, overpass_sync
+from location_utils.geocache import NEGATIVE
+from location_utils.poi_index import best_element, element_coords, get_poi_index, overpass_name_regex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@st.cache_resource  
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# Short side the CLIP processor resizes to before center-cropping
+CLIP_INPUT_SIDE = 224
+# Weight dtype of the torch CLIP model: float32, bfloat16 or float16. Half precision halves
+# its resident size (~600 MB -> ~300 MB); CPUs without native bf16/fp16 kernels run it slower.
+# ONNX engines export from float32, so this only applies with CLIP_ENGINE=torch.
+CLIP_DTYPE = os.environ.get("CLIP_DTYPE", "float32")
+CLIP_DTYPES = ("float32", "bfloat16", "float16")
+
 def load_models():
     logger.info("Loading CLIP processor and model...")  
-    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-    model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
+    from transformers import CLIPProcessor, CLIPModel
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    if CLIP_DTYPE not in CLIP_DTYPES:
+        raise ValueError(f"Unknown CLIP_DTYPE '{CLIP_DTYPE}', expected one of {CLIP_DTYPES}")
+    if CLIP_ENGINE == "torch" and CLIP_DTYPE != "float32":
+        import torch
+        # Loaded straight into the target dtype so the fp32 copy never becomes resident
+        model = CLIPModel.from_pretrained(CLIP_MODEL_NAME, torch_dtype=getattr(torch, CLIP_DTYPE))
+    else:
+        model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+    model.eval()
     return processor, model
 
+@lru_cache(maxsize=1)
+def get_catalogue() -> LandmarkCatalogue:
+    """Landmark records (name, city, country, lat, lon, prompts) from the catalogue data file"""
+    return LandmarkCatalogue.load(CATALOGUE_PATH)
+
+def _load_landmark_index() -> LandmarkIndex:
+    return LandmarkIndex.load_or_build(lambda: registry.get("clip"), CLIP_MODEL_NAME,
+                                       get_catalogue().prompts)
+
+def _load_image_encoder():
+    encoder = load_image_encoder(CLIP_ENGINE, CLIP_MODEL_NAME, lambda: registry.get("clip"))
+    if CLIP_ENGINE != "torch":
+        # The torch model was only needed to export the graph (or build the index)
+        registry.unload("clip")
+    return encoder
+
+# Nothing is loaded at import time; the registry builds these on first use or warm-up.
+# With an ONNX engine the torch model is only loaded if an export/index build needs it.
+registry.register("clip", load_models, warm=CLIP_ENGINE == "torch")
+registry.register("landmark_index", _load_landmark_index)
+registry.register("clip_image_encoder", _load_image_encoder)
+
+def get_clip():
+    """(processor, model), loaded on first use"""
+    return registry.get("clip")
+
+def get_landmark_index() -> LandmarkIndex:
+    """Text embeddings for the catalogue, computed once and memory-mapped from disk"""
+    return registry.get("landmark_index")
+
+def encode_image(image: Image.Image) -> np.ndarray:
+    """Normalized CLIP image embedding from the engine selected by CLIP_ENGINE"""
+    return registry.get("clip_image_encoder").encode([image])[0]
+
+def _match_features(features: np.ndarray, top_k: int, country: Optional[str],
+                    bbox: Optional[BBox]) -> List[dict]:
+    catalogue = get_catalogue()
+    rows = catalogue.candidates(country=country, bbox=bbox)
+    if rows is not None and len(rows) == 0:
+        logger.info(f"[CLIP] No catalogue landmarks inside region country={country} bbox={bbox}")
+        return []
+    matches = []
+    for row, score in get_landmark_index().search(features, top_k=top_k, rows=rows):
+        record = catalogue.record(row)
+        record["score"] = score
+        matches.append(record)
+    return matches
+
+def search_landmarks(image: Image.Image, top_k: int = 5, country: Optional[str] = None,
+                     bbox: Optional[BBox] = None) -> List[dict]:
+    """
+    Top-k catalogue matches for an image as records with a "score" field.
+    `country` / `bbox` narrow the candidate rows before any scoring happens.
+    """
+    return _match_features(encode_image(image), top_k, country, bbox)
+
+def _clip_image(image_source) -> Image.Image:
+    if isinstance(image_source, ImageContext):
+        # CLIP resizes to 224 on the short side anyway; hand it a small view
+        # instead of the full-resolution frame
+        width, height = image_source.size
+        long_side = math.ceil(CLIP_INPUT_SIDE * max(width, height) / max(1, min(width, height)))
+        return Image.fromarray(image_source.downscaled(long_side))
+    return Image.open(image_source).convert("RGB")
+
+def _best_match(matches: List[dict], threshold: float) -> Optional[str]:
+    if not matches:
+        return None
+
+    # Get top-k results for debugging
+    for rank, match in enumerate(matches, start=1):
+        logger.info(f"CLIP rank {rank}: {match['key']} -> {match['score']:.4f}")
 
-clip_processor, clip_model = load_models() 
-
-# Predefined landmarks with name, city, latitude, longitude
-LANDMARK_KEYWORDS = {
-    #Malaysia landmarks
-    "petronas towers": ["Petronas Twin Towers", "Kuala Lumpur", 3.1579, 101.7116],
-    "klcc": ["Kuala Lumpur City Centre", "Kuala Lumpur", 3.1586, 101.7145],
-    "kl tower": ["KL Tower", "Kuala Lumpur", 3.1528, 101.7039],
-    "batu caves": ["Batu Caves", "Selangor", 3.2379, 101.6831],
-    "putrajaya pink mosque": ["Putra Mosque", "Putrajaya", 2.9360, 101.6895],
-    "kuala lumpur blue mosque": ["Sultan Salahuddin Abdul Aziz Mosque", "Kuala Lumpur", 3.0788, 101.5031],
-    "masjid putra": ["Putra Mosque", "Putrajaya", 2.9360, 101.6895],
-    "iron mosque": ["Tuanku Mizan Zainal Abidin Mosque", "Putrajaya", 2.9266, 101.6804],
-    "sultan abdul samad building": ["Sultan Abdul Samad Building", "Kuala Lumpur", 3.1466, 101.6945],
-    "istana negara": ["Istana Negara", "Kuala Lumpur", 3.1339, 101.6842],
-    "malacca straits mosque": ["Masjid Selat Melaka", "Malacca", 2.1885, 102.2497],
-    "george town street art": ["George Town Street Art", "Penang", 5.4141, 100.3288],
-    "komtar": ["Komtar Tower", "Penang", 5.4143, 100.3288],
-    "kek lok si": ["Kek Lok Si Temple", "Penang", 5.3991, 100.2736],
-    "penang hill": ["Penang Hill", "Penang", 5.4163, 100.2766],
-    "langkawi sky bridge": ["Langkawi Sky Bridge", "Langkawi", 6.3847, 99.6636],
-    "gunung mat cincang": ["Gunung Mat Cincang", "Langkawi", 6.3790, 99.6652],
-    "genting highlands": ["Genting Highlands", "Pahang", 3.4221, 101.7934],
-    "legoland malaysia": ["Legoland Malaysia", "Johor", 1.4274, 103.6315],
-    "mount kinabalu": ["Mount Kinabalu", "Sabah", 6.0755, 116.5583],
-    "kinabalu park": ["Kinabalu Park", "Sabah", 6.0456, 116.6864],
-    "menara alor setar": ["Alor Setar Tower", "Kedah", 6.1219, 100.3716],
-    "penang bridge": ["Penang Bridge", "Penang", 5.3364, 100.3606],
-    "a famosa": ["A Famosa", "Melaka", 2.1912, 102.2501],
-    "sabah state mosque": ["Sabah State Mosque", "Kota Kinabalu", 5.9576, 116.0654],
-    "gunung kinabalu": ["Mount Kinabalu", "Sabah", 6.0754, 116.5584],
-
-    # Asia
-    "Great Wall": ["Great Wall of China", "China", 40.4319, 116.5704],
-    "burj khalifa": ["Burj Khalifa", "Dubai", 25.1972, 55.2744],
-    "taipei 101": ["Taipei 101", "Taipei", 25.0330, 121.5654],
-    "marina bay sands": ["Marina Bay Sands", "Singapore", 1.2834, 103.8607],
-
-    # Europe
-    "big ben": ["Big Ben", "London", 51.5007, -0.1246],
-    "louvre": ["Louvre Museum", "Paris", 48.8606, 2.3376],
-    "sagrada familia": ["Sagrada Família", "Barcelona", 41.4036, 2.1744],
-
-    # America
-    "golden gate bridge": ["Golden Gate Bridge", "San Francisco", 37.8199, -122.4783],
-    "times square": ["Times Square", "New York", 40.7580, -73.9855],
-    "hollywood sign": ["Hollywood Sign", "Los Angeles", 34.1341, -118.3215],
-    "Statue of Liberty": ["Statue of Liberty", "New York", 40.6892, -74.0445],
-
-    # Others
-    "machu picchu": ["Machu Picchu", "Peru", -13.1631, -72.5450],
-    "christ the redeemer": ["Christ the Redeemer", "Rio de Janeiro", -22.9519, -43.2105],
-    "opera house": ["Sydney Opera House", "Sydney", -33.8568, 151.2153],
-    "sydney opera house": ["Sydney Opera House", "Sydney", -33.8568, 151.2153],
-    "Eiffel Tower": ["Eiffel Tower", "Paris", 48.8584, 2.2945],
-    "taj mahal": ["Taj Mahal", "Agra", 27.1751, 78.0421]
-}
-
-OVERPASS_URL = "http://overpass-api.de/api/interpreter"
-
-def detect_landmark(image_path: str, threshold: float = 0.15, top_k: int = 5) -> Optional[str]:
+    best_score = matches[0]["score"]
+    best_name = matches[0]["key"]
+
+    if best_score >= threshold:
+        logger.info(f"[CLIP MATCH] {best_name} ({best_score:.3f})\n")
+        return best_name.lower()
+    else:
+        logger.info(f"[CLIP LOW CONFIDENCE] best={best_name} ({best_score:.3f}), threshold={threshold}\n")
+        return None
+
+@metrics.timed("clip")
+def detect_landmark(image_source, threshold: float = 0.15, top_k: int = 5,
+                    country: Optional[str] = None, bbox: Optional[BBox] = None) -> Optional[str]:
     """
-    Use CLIP model to match the image with a predefined list of landmarks.
+    Use CLIP model to match the image with the landmark catalogue.
+    `image_source` is a file path or an ImageContext.
     Returns the best matched keyword if confidence > threshold, else None.
     """
     try:
-        image = Image.open(image_path).convert("RGB")
-        keywords = list(LANDMARK_KEYWORDS.keys())
-
-        inputs = clip_processor(text=keywords, images=image, return_tensors="pt", padding=True)
-        with torch.no_grad():
-            outputs = clip_model(**inputs)
-            probs = outputs.logits_per_image.softmax(dim=1).cpu().numpy().flatten()
-        
-        # Get top-k results for debugging
-        top_idxs = probs.argsort()[::-1][:top_k]
-        for rank, idx in enumerate(top_idxs, start=1):
-            logger.info(f"CLIP rank {rank}: {keywords[idx]} -> {probs[idx]:.4f}")
-           
-        best_idx = int(idxs[0])
-        best_score = float(probs[best_idx])
-        best_name = keywords[best_idx]
-        
-
-        if best_score >= threshold:
-            logger.info(f"[CLIP MATCH] {best_name} ({best_score:.3f})\n")
-            return best_name.lower()
-        else:
-            logger.info(f"[CLIP LOW CONFIDENCE] best={best_name} ({best_score:.3f}), threshold={threshold}\n")
-            return None
-            
+        # Only the image goes through CLIP; text features come from the cached index
+        matches = search_landmarks(_clip_image(image_source), top_k=top_k, country=country, bbox=bbox)
+        return _best_match(matches, threshold)
     except Exception as e:
         logger.info(f"[CLIP ERROR] {e}")
         return None
-        
+
+@metrics.timed("clip")
+def detect_landmarks_batch(image_sources, threshold: float = 0.15, top_k: int = 5,
+                           country: Optional[str] = None, bbox: Optional[BBox] = None) -> List[Optional[str]]:
+    """
+    detect_landmark for many images with one image-encoder forward pass.
+    Inputs that fail to load get None, like a failed detect_landmark call.
+    """
+    results: List[Optional[str]] = [None] * len(image_sources)
+    images, slots = [], []
+    for i, source in enumerate(image_sources):
+        try:
+            images.append(_clip_image(source))
+            slots.append(i)
+        except Exception as e:
+            logger.info(f"[CLIP ERROR] {e}")
+    if not images:
+        return results
+    try:
+        features = registry.get("clip_image_encoder").encode(images)
+        for i, vec in zip(slots, features):
+            results[i] = _best_match(_match_features(vec, top_k, country, bbox), threshold)
+    except Exception as e:
+        logger.info(f"[CLIP ERROR] {e}")
+    return results
+
 def query_landmark_coords(landmark_name: str) -> tuple:
     """
-    Return ((lat, lon), source) if landmark name is found in predefined list or Overpass API.
+    Return ((lat, lon), source) if landmark name is found in the catalogue, the
+    lookup cache, the local POI index or the Overpass API.
     Returns (None, error_message) if not found.
     """
-    # Check predefined landmarks first
-    key=landmark_name.lower()
-    if key in LANDMARK_KEYWORDS:
-        _, _, lat, lon = LANDMARK_KEYWORDS[key]
-        return (lat, lon), "Predefined"
-
-    # Try Overpass API as fallback
+    # Check the landmark catalogue first
+    record = get_catalogue().get(landmark_name)
+    if record:
+        return (record["lat"], record["lon"]), "Predefined"
+
+    # Then earlier lookups and the imported POI extracts, neither of which leaves the process
+    index = get_poi_index()
+    if index is not None:
+        cached = index.cached(landmark_name)
+        if cached is NEGATIVE:
+            metrics.inc("landmark_lookup_total", result="negative_cache")
+            return None, "No coordinates available"
+        if cached is not None:
+            metrics.inc("landmark_lookup_total", result="cache")
+            return cached
+        match = index.find(landmark_name)
+        if match is not None:
+            metrics.inc("landmark_lookup_total", result="index")
+            logger.info(f"[POI] {landmark_name} -> {match['name']} ({match['match']} match)")
+            index.remember(landmark_name, (match["lat"], match["lon"]), "POI index")
+            return (match["lat"], match["lon"]), "POI index"
+
+    # Try Overpass API as a last resort
+    name_regex = overpass_name_regex(landmark_name)
     query = f"""
     [out:json][timeout:25];
     (
-      node["name"~"{landmark_name}",i];
-      way["name"~"{landmark_name}",i];
+      node["name"~"{name_regex}",i];
+      way["name"~"{name_regex}",i];
     );
-    out center;
+    out center tags 50;
     """
 
     try:
-        response = requests.post(OVERPASS_URL, data=query, timeout=15)
-        response.raise_for_status() 
-        data = response.json()
-        elements = data.get("elements", [])
-        if elements:
-            elem = elements[0]
-            if "center" in elem:
-                return (elem["center"]["lat"], elem["center"]["lon"]), "Overpass"
-            elif "lat" in elem and "lon" in elem:
-                return (elem["lat"], elem["lon"]), "Overpass"
-
-    except Exception as e:
-        logger,error(f"[OVERPASS ERROR] {e}")
+        # Pooled, rate-limited and coalesced through the shared geo client
+        with metrics.span("overpass"):
+            data = overpass_sync(query)
+        metrics.inc("landmark_lookup_total", result="overpass")
+        elem = best_element(data.get("elements", []), landmark_name)
+        coords = element_coords(elem) if elem is not None else None
+        if index is not None:
+            # A successful empty answer is cached too; errors are not
+            index.remember(landmark_name, coords, "Overpass")
+        if coords is not None:
+            return coords, "Overpass"
+
+    except (GeoServiceError, KeyError, TypeError) as e:
+        logger.error(f"[OVERPASS ERROR] {e}")
 
     return None, "No coordinates available"
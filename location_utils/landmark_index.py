@@ -0,0 +1,171 @@
+# location_utils/landmark_index.py
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.environ.get("LANDMARK_INDEX_DIR", os.path.join(".cache", "landmark_index"))
+
+# Prompts encoded per text-tower forward pass while building, and rows scored per
+# chunk while searching; both keep peak RAM flat regardless of catalogue size.
+ENCODE_BATCH = 256
+SEARCH_CHUNK = 65536
+
+
+def prompts_hash(model_name: str, prompts: Sequence[List[str]]) -> str:
+    """Stable hash of the model name and the ordered per-landmark prompt lists"""
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for variants in prompts:
+        digest.update(b"\x1e" + "\x1f".join(variants).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class LandmarkIndex:
+    """
+    Normalized CLIP text embeddings, one row per catalogue landmark.
+    Stored as a float16 .npy matrix that is memory-mapped on load, so the
+    catalogue can grow without the embeddings having to fit in RAM.
+    """
+
+    def __init__(self, embeddings: np.ndarray, logit_scale: float):
+        self.embeddings = embeddings
+        self.logit_scale = float(logit_scale)
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @staticmethod
+    def _paths(model_name: str, digest: str, index_dir: str):
+        safe_model = model_name.replace("/", "__")
+        stem = os.path.join(index_dir, f"{safe_model}-{digest}")
+        return stem + ".npy", stem + ".json"
+
+    @classmethod
+    def load(cls, model_name: str, prompts: Sequence[List[str]], index_dir: str = INDEX_DIR) -> Optional["LandmarkIndex"]:
+        emb_path, meta_path = cls._paths(model_name, prompts_hash(model_name, prompts), index_dir)
+        if not (os.path.exists(emb_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            embeddings = np.load(emb_path, mmap_mode="r")
+            if embeddings.shape[0] != len(prompts):
+                logger.info("[INDEX] Stale landmark index at %s, rebuilding", emb_path)
+                return None
+            logger.info(f"[INDEX] Memory-mapped landmark index {emb_path} ({embeddings.shape[0]} rows)")
+            return cls(embeddings, meta["logit_scale"])
+        except Exception as e:
+            logger.warning(f"[INDEX] Failed to load landmark index: {e}")
+            return None
+
+    @classmethod
+    def build(cls, processor, model, model_name: str, prompts: Sequence[List[str]],
+              index_dir: str = INDEX_DIR) -> "LandmarkIndex":
+        """
+        Encode every prompt variant, average the variants of each landmark and
+        stream the normalized rows straight into a float16 memmap on disk.
+        """
+        emb_path, meta_path = cls._paths(model_name, prompts_hash(model_name, prompts), index_dir)
+        os.makedirs(index_dir, exist_ok=True)
+        dim = model.config.projection_dim
+        # A private temp file per builder: batch workers or app replicas may build concurrently,
+        # and the last complete file to be renamed into place wins
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(emb_path) + ".", suffix=".tmp.npy", dir=index_dir)
+        os.close(fd)
+        try:
+            cls._encode_into(tmp_path, processor, model, prompts, dim)
+            # mkstemp files are owner-only; the index is a shared read-only cache
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, emb_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        logit_scale = model.logit_scale.exp().item()
+        fd, tmp_meta = tempfile.mkstemp(prefix=os.path.basename(meta_path) + ".", suffix=".tmp", dir=index_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "rows": len(prompts), "dim": dim,
+                       "logit_scale": logit_scale}, f)
+        os.chmod(tmp_meta, 0o644)
+        os.replace(tmp_meta, meta_path)
+        logger.info(f"[INDEX] Saved landmark index to {emb_path}")
+        return cls(np.load(emb_path, mmap_mode="r"), logit_scale)
+
+    @staticmethod
+    def _encode_into(path: str, processor, model, prompts: Sequence[List[str]], dim: int):
+        import torch
+
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float16, shape=(len(prompts), dim))
+
+        logger.info(f"[INDEX] Encoding {sum(len(p) for p in prompts)} prompts for {len(prompts)} landmarks...")
+        flat, owners = [], []
+        for row, variants in enumerate(prompts):
+            flat.extend(variants)
+            owners.extend([row] * len(variants))
+
+        sums = {}
+        for start in range(0, len(flat), ENCODE_BATCH):
+            batch = flat[start:start + ENCODE_BATCH]
+            inputs = processor(text=batch, return_tensors="pt", padding=True, truncation=True)
+            with torch.no_grad():
+                feats = model.get_text_features(**inputs).float()
+                feats = feats / feats.norm(dim=-1, keepdim=True)
+            for owner, vec in zip(owners[start:start + ENCODE_BATCH], feats.cpu().numpy()):
+                sums[owner] = sums.get(owner, 0) + vec
+            # Rows whose variants are all encoded can be flushed to disk now
+            done_below = owners[start + len(batch)] if start + len(batch) < len(flat) else len(prompts)
+            for row in [r for r in sums if r < done_below]:
+                vec = sums.pop(row)
+                out[row] = vec / np.linalg.norm(vec)
+        out.flush()
+        del out
+
+    @classmethod
+    def load_or_build(cls, load_clip: Callable, model_name: str, prompts: Sequence[List[str]],
+                      index_dir: str = INDEX_DIR) -> "LandmarkIndex":
+        """`load_clip` returns (processor, model) and is only called when the index must be built"""
+        index = cls.load(model_name, prompts, index_dir)
+        if index is None:
+            processor, model = load_clip()
+            index = cls.build(processor, model, model_name, prompts, index_dir)
+        return index
+
+    def logits(self, image_features: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scaled cosine similarities for all rows (or just `rows`), scored chunk by chunk"""
+        query = image_features.astype(np.float32)
+        total = len(self) if rows is None else len(rows)
+        out = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SEARCH_CHUNK):
+            stop = min(start + SEARCH_CHUNK, total)
+            if rows is None:
+                block = self.embeddings[start:stop]
+            else:
+                block = self.embeddings[rows[start:stop]]
+            out[start:stop] = block.astype(np.float32) @ query
+        return out * self.logit_scale
+
+    def search(self, image_features: np.ndarray, top_k: int = 5,
+               rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Top-k (row, probability) pairs. Probabilities are a softmax over the
+        searched rows, matching CLIP's logits_per_image.softmax().
+        """
+        logits = self.logits(image_features, rows)
+        if logits.size == 0:
+            return []
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        k = min(top_k, probs.size)
+        top = np.argpartition(-probs, k - 1)[:k]
+        top = top[np.argsort(-probs[top])]
+        row_ids = top if rows is None else rows[top]
+        return [(int(r), float(probs[i])) for r, i in zip(row_ids, top)]
@@ -0,0 +1,115 @@
+# location_utils/offline_geocoder.py
+import csv
+import logging
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(__file__), "data", "gazetteer.csv")
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", DEFAULT_GAZETTEER)
+# Nearest places further away than this are not reported as the location
+MAX_DISTANCE_KM = float(os.environ.get("GAZETTEER_MAX_DISTANCE_KM", "50"))
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _to_unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Project lat/lon onto the unit sphere so Euclidean (chord) distance in the
+    tree is monotonic with great-circle distance.
+    """
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat_r)
+    return np.column_stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)))
+
+
+def _chord_to_km(chord: np.ndarray) -> np.ndarray:
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _read_csv(path: str):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["name"], row.get("admin1") or "", row.get("country") or "", row["lat"], row["lon"]
+
+
+def _read_geonames(path: str):
+    """GeoNames dump format (cities500.txt, cities1000.txt, ...), tab-separated without header"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 11:
+                continue
+            # name, admin1 code, country code, lat, lon
+            yield cols[1], cols[10], cols[8], cols[4], cols[5]
+
+
+class OfflineGeocoder:
+    """Nearest-place reverse geocoder over a local gazetteer, backed by a k-d tree"""
+
+    def __init__(self, names: List[str], lat: np.ndarray, lon: np.ndarray,
+                 max_distance_km: float = MAX_DISTANCE_KM):
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+        self.max_distance_km = max_distance_km
+        self.tree = cKDTree(_to_unit_vectors(lat, lon))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH, max_distance_km: float = MAX_DISTANCE_KM) -> "OfflineGeocoder":
+        reader = _read_geonames if path.endswith(".txt") else _read_csv
+        names, lats, lons = [], [], []
+        for name, admin1, country, lat, lon in reader(path):
+            try:
+                lats.append(float(lat))
+                lons.append(float(lon))
+            except ValueError:
+                continue
+            names.append(", ".join(part for part in (name, admin1, country) if part))
+        logger.info(f"[OFFLINE GEOCODER] Loaded {len(names)} places from {path}")
+        return cls(names, np.asarray(lats), np.asarray(lons), max_distance_km)
+
+    def reverse_batch(self, coords: Sequence[Tuple[float, float]]) -> List[Optional[str]]:
+        """
+        Vectorized nearest-place lookup for many (lat, lon) pairs at once.
+        Entries with no place within `max_distance_km` come back as None.
+        """
+        points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return []
+        chord, idx = self.tree.query(_to_unit_vectors(points[:, 0], points[:, 1]), k=1)
+        dist_km = _chord_to_km(np.asarray(chord))
+        return [self.names[i] if d <= self.max_distance_km else None
+                for i, d in zip(np.atleast_1d(idx), np.atleast_1d(dist_km))]
+
+    def reverse(self, lat: float, lon: float) -> Optional[str]:
+        return self.reverse_batch([(lat, lon)])[0]
+
+
+_geocoder: Optional[OfflineGeocoder] = None
+_geocoder_lock = threading.Lock()
+_load_failed = False
+
+
+def get_offline_geocoder() -> Optional[OfflineGeocoder]:
+    """Process-wide offline geocoder; None if the gazetteer is missing or unreadable"""
+    global _geocoder, _load_failed
+    if _geocoder is None and not _load_failed:
+        with _geocoder_lock:
+            if _geocoder is None and not _load_failed:
+                try:
+                    _geocoder = OfflineGeocoder.load(GAZETTEER_PATH)
+                except Exception as e:
+                    _load_failed = True
+                    logger.warning(f"[OFFLINE GEOCODER] Disabled, failed to load {GAZETTEER_PATH}: {e}")
+    return _geocoder
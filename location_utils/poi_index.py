@@ -0,0 +1,421 @@
+# location_utils/poi_index.py
+"""
+Local landmark name -> coordinates lookup.
+
+    python -m location_utils.poi_index build --region paris=48.80,2.22,48.92,2.47
+    python -m location_utils.poi_index build --file rome-overpass.json
+    python -m location_utils.poi_index lookup "Sagrada Familia"
+
+Two tables in one SQLite file (POI_INDEX_PATH):
+
+- a lookup cache of landmark names already resolved. It also stores
+  negative results, which expire sooner.
+- a name index of named OSM features imported from Overpass for the
+  configured regions (POI_REGIONS or --region), or from saved Overpass JSON
+  extracts. Names are normalized (accents stripped, case-folded,
+  punctuation collapsed). They are searched by exact match, then prefix,
+  then trigram similarity.
+
+query_landmark_coords consults both before falling back to a live Overpass
+query, and caches whatever that query returns.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from location_utils.geocache import NEGATIVE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POI_INDEX_PATH = os.environ.get("POI_INDEX_PATH", os.path.join(".cache", "poi_index.sqlite"))
+LOOKUP_TTL = float(os.environ.get("LANDMARK_CACHE_TTL", str(90 * 24 * 3600)))
+NEGATIVE_TTL = float(os.environ.get("LANDMARK_CACHE_NEGATIVE_TTL", str(7 * 24 * 3600)))
+# Minimum trigram Jaccard similarity for a fuzzy name match
+MIN_SIMILARITY = float(os.environ.get("POI_MIN_SIMILARITY", "0.6"))
+# Seconds a connection waits on another process's write lock (e.g. a running `build`)
+POI_BUSY_TIMEOUT = float(os.environ.get("POI_BUSY_TIMEOUT", "30"))
+# "name=min_lat,min_lon,max_lat,max_lon;..." imported by `build` when no --region is given
+POI_REGIONS = os.environ.get("POI_REGIONS", "")
+
+# Name tags indexed per feature, besides `name`
+NAME_TAGS = ("name", "name:en", "int_name", "official_name", "alt_name")
+# Named features worth resolving a landmark to
+EXTRACT_FILTERS = (
+    '["tourism"~"attraction|museum|viewpoint|artwork|gallery|zoo|theme_park"]',
+    '["historic"]',
+    '["heritage"]',
+    '["man_made"~"tower|bridge|lighthouse|obelisk"]',
+    '["amenity"="place_of_worship"]["wikidata"]',
+    '["leisure"~"park|garden|stadium"]["wikidata"]',
+)
+
+BBox = Tuple[float, float, float, float]
+
+
+def normalize_name(name: str) -> str:
+    """'  Cathédrale Notre-Dame de Paris ' -> 'cathedrale notre dame de paris'"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w]+", " ", stripped.casefold()).split())
+
+
+def trigrams(norm: str) -> Set[str]:
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def feature_rank(tags: Dict[str, str]) -> int:
+    """Prefer well-known features when several share a name"""
+    rank = 0
+    rank += 4 if "wikidata" in tags else 0
+    rank += 2 if "wikipedia" in tags else 0
+    rank += 2 if tags.get("tourism") == "attraction" or "heritage" in tags else 0
+    rank += 1 if "historic" in tags else 0
+    return rank
+
+
+def _feature_kind(tags: Dict[str, str]) -> str:
+    for key in ("tourism", "historic", "man_made", "amenity", "leisure", "heritage"):
+        if key in tags:
+            return f"{key}={tags[key]}"
+    return ""
+
+
+def element_coords(elem: dict) -> Optional[Tuple[float, float]]:
+    """Coordinates of an Overpass node, or the center of a way/relation (`out center`)"""
+    if "center" in elem:
+        return elem["center"]["lat"], elem["center"]["lon"]
+    if "lat" in elem and "lon" in elem:
+        return elem["lat"], elem["lon"]
+    return None
+
+
+def best_element(elements: Sequence[dict], name: str) -> Optional[dict]:
+    """Among Overpass results, the exact (normalized) name match with the highest rank"""
+    norm = normalize_name(name)
+    candidates = [e for e in elements if element_coords(e) is not None]
+    if not candidates:
+        return None
+
+    def score(elem):
+        tags = elem.get("tags", {})
+        exact = any(normalize_name(tags.get(tag, "")) == norm for tag in NAME_TAGS)
+        return exact, feature_rank(tags)
+
+    return max(candidates, key=score)
+
+
+def overpass_name_regex(name: str) -> str:
+    """`name` as a literal Overpass regex inside a double-quoted QL string"""
+    regex = re.sub(r"([.^$*+?()\[\]{}|\\])", r"\\\1", name)
+    return regex.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def extract_query(bbox: BBox, timeout: int = 180) -> str:
+    """Overpass QL for the named landmark-like features inside `bbox` (south, west, north, east)"""
+    area = ",".join(f"{v:.6f}" for v in bbox)
+    clauses = "\n".join(f'  nwr["name"]{flt}({area});' for flt in EXTRACT_FILTERS)
+    return f"[out:json][timeout:{timeout}];\n(\n{clauses}\n);\nout center tags;"
+
+
+def parse_regions(spec: str) -> Dict[str, BBox]:
+    """'paris=48.80,2.22,48.92,2.47;rome=...' -> {name: bbox}"""
+    regions = {}
+    for i, part in enumerate(p.strip() for p in spec.split(";")):
+        if not part:
+            continue
+        label, sep, coords = part.rpartition("=")
+        values = tuple(float(v) for v in coords.split(","))
+        if len(values) != 4:
+            raise ValueError(f"Region '{part}' needs min_lat,min_lon,max_lat,max_lon")
+        regions[label if sep else f"region{i + 1}"] = values
+    return regions
+
+
+class PoiIndex:
+    """SQLite name index of imported OSM features plus the landmark lookup cache"""
+
+    def __init__(self, path: str = POI_INDEX_PATH, ttl: float = LOOKUP_TTL,
+                 negative_ttl: float = NEGATIVE_TTL, min_similarity: float = MIN_SIMILARITY):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.negative_hits = 0
+        self.index_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=POI_BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS poi (
+                id INTEGER PRIMARY KEY,
+                osm_type TEXT NOT NULL,
+                osm_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                kind TEXT,
+                rank INTEGER NOT NULL DEFAULT 0,
+                region TEXT,
+                UNIQUE (osm_type, osm_id)
+            );
+            CREATE TABLE IF NOT EXISTS poi_name (
+                norm TEXT NOT NULL,
+                poi_id INTEGER NOT NULL,
+                PRIMARY KEY (norm, poi_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS poi_trigram (
+                tri TEXT NOT NULL,
+                norm TEXT NOT NULL,
+                PRIMARY KEY (tri, norm)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS landmark_lookup (
+                query TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                source TEXT,
+                created REAL NOT NULL
+            );
+            """
+        )
+
+    # --- lookup cache ---
+
+    def cached(self, name: str):
+        """
+        ((lat, lon), source) for a cached lookup, NEGATIVE for a cached
+        "no coordinates" result, or None on a miss / expired entry.
+        """
+        query = normalize_name(name)
+        with self._lock:
+            # Lookups fall through to the next source on a locked or broken database
+            try:
+                row = self._conn.execute(
+                    "SELECT lat, lon, source, created FROM landmark_lookup WHERE query = ?", (query,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"[POI] Cache lookup failed, treating as a miss: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            lat, lon, source, created = row
+            ttl = self.ttl if lat is not None else self.negative_ttl
+            if time.time() - created > ttl:
+                try:
+                    self._conn.execute("DELETE FROM landmark_lookup WHERE query = ?", (query,))
+                except sqlite3.Error as e:
+                    # The stale row is simply overwritten by the next remember()
+                    logger.warning(f"[POI] Failed to drop expired lookup: {e}")
+                self.misses += 1
+                return None
+            if lat is None:
+                self.negative_hits += 1
+                return NEGATIVE
+            self.hits += 1
+            return (lat, lon), source
+
+    def remember(self, name: str, coords: Optional[Tuple[float, float]], source: str = ""):
+        """Cache a lookup result; pass coords=None to cache a negative result"""
+        lat, lon = coords if coords else (None, None)
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO landmark_lookup (query, lat, lon, source, created) VALUES (?, ?, ?, ?, ?)",
+                    (normalize_name(name), lat, lon, source, time.time()),
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"[POI] Cache write failed, lookup not cached: {e}")
+
+    def clear_negative(self) -> int:
+        """Drop cached misses, e.g. after importing a new region"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM landmark_lookup WHERE lat IS NULL").rowcount
+
+    # --- name index ---
+
+    def import_elements(self, elements: Iterable[dict], region: str = "") -> int:
+        """Upsert named Overpass elements (with `out center tags`); returns the number imported"""
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for elem in elements:
+                    tags = elem.get("tags") or {}
+                    coords = element_coords(elem)
+                    if not tags.get("name") or coords is None:
+                        continue
+                    key = (elem.get("type", "node"), elem["id"])
+                    self._conn.execute(
+                        "INSERT INTO poi (osm_type, osm_id, name, lat, lon, kind, rank, region) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (osm_type, osm_id) DO UPDATE SET name = excluded.name, lat = excluded.lat, "
+                        "lon = excluded.lon, kind = excluded.kind, rank = excluded.rank, region = excluded.region",
+                        key + (tags["name"], coords[0], coords[1], _feature_kind(tags), feature_rank(tags), region),
+                    )
+                    (poi_id,) = self._conn.execute(
+                        "SELECT id FROM poi WHERE osm_type = ? AND osm_id = ?", key).fetchone()
+                    # Names may have changed since the last import of this feature
+                    self._conn.execute("DELETE FROM poi_name WHERE poi_id = ?", (poi_id,))
+                    norms = {normalize_name(v) for tag in NAME_TAGS
+                             for v in (tags.get(tag) or "").split(";")} - {""}
+                    self._conn.executemany("INSERT OR IGNORE INTO poi_name (norm, poi_id) VALUES (?, ?)",
+                                           [(norm, poi_id) for norm in norms])
+                    self._conn.executemany("INSERT OR IGNORE INTO poi_trigram (tri, norm) VALUES (?, ?)",
+                                           [(tri, norm) for norm in norms for tri in trigrams(norm)])
+                    count += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def _best_poi(self, norms: Sequence[str]) -> Optional[dict]:
+        if not norms:
+            return None
+        marks = ",".join("?" * len(norms))
+        row = self._conn.execute(
+            f"SELECT p.name, p.lat, p.lon, p.kind, p.rank, n.norm FROM poi_name n JOIN poi p ON p.id = n.poi_id "
+            f"WHERE n.norm IN ({marks}) ORDER BY p.rank DESC, length(n.norm) ASC LIMIT 1",
+            list(norms),
+        ).fetchone()
+        if row is None:
+            return None
+        name, lat, lon, kind, rank, norm = row
+        return {"name": name, "lat": lat, "lon": lon, "kind": kind, "rank": rank, "norm": norm}
+
+    def prefix(self, norm: str, limit: int = 20) -> List[str]:
+        """Indexed names starting with `norm` (a range scan on the name key)"""
+        rows = self._conn.execute(
+            "SELECT DISTINCT norm FROM poi_name WHERE norm >= ? AND norm < ? ORDER BY length(norm) LIMIT ?",
+            (norm, norm + "\uffff", limit),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def similar(self, norm: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Indexed names by trigram Jaccard similarity to `norm`, best first"""
+        query_tris = trigrams(norm)
+        marks = ",".join("?" * len(query_tris))
+        rows = self._conn.execute(
+            f"SELECT norm, COUNT(*) AS shared FROM poi_trigram WHERE tri IN ({marks}) "
+            f"GROUP BY norm ORDER BY shared DESC LIMIT ?",
+            list(query_tris) + [limit * 5],
+        ).fetchall()
+        scored = [(cand, shared / (len(query_tris) + len(trigrams(cand)) - shared)) for cand, shared in rows]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+    def find(self, name: str) -> Optional[dict]:
+        """Best indexed feature for `name`: exact normalized match, then prefix, then trigram similarity"""
+        norm = normalize_name(name)
+        if not norm:
+            return None
+        with self._lock:
+            try:
+                match = self._best_poi([norm])
+                if match is not None:
+                    match["match"] = "exact"
+                else:
+                    match = self._best_poi(self.prefix(norm, limit=5))
+                    if match is not None:
+                        match["match"] = "prefix"
+                    else:
+                        close = [cand for cand, sim in self.similar(norm, limit=5) if sim >= self.min_similarity]
+                        match = self._best_poi(close)
+                        if match is not None:
+                            match["match"] = "trigram"
+            except sqlite3.Error as e:
+                logger.warning(f"[POI] Index lookup failed, treating as a miss: {e}")
+                return None
+            if match is not None:
+                self.index_hits += 1
+        return match
+
+    def stats(self) -> dict:
+        with self._lock:
+            (pois,) = self._conn.execute("SELECT COUNT(*) FROM poi").fetchone()
+            (cached,) = self._conn.execute("SELECT COUNT(*) FROM landmark_lookup").fetchone()
+        return {"pois": pois, "cached_lookups": cached, "hits": self.hits, "negative_hits": self.negative_hits,
+                "index_hits": self.index_hits, "misses": self.misses}
+
+
+def fetch_region(bbox: BBox) -> List[dict]:
+    """Named landmark-like features in `bbox`, fetched through the shared geo client"""
+    from location_utils.geo_client import overpass_sync
+    return overpass_sync(extract_query(bbox)).get("elements", [])
+
+
+def build(index: PoiIndex, regions: Dict[str, BBox], files: Sequence[str] = ()) -> dict:
+    """Import Overpass extracts for `regions` and saved Overpass JSON `files`; returns counts per source"""
+    counts = {}
+    for label, bbox in regions.items():
+        logger.info(f"[POI] Fetching region {label} {bbox}...")
+        counts[label] = index.import_elements(fetch_region(bbox), region=label)
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            counts[path] = index.import_elements(json.load(f).get("elements", []),
+                                                 region=os.path.splitext(os.path.basename(path))[0])
+    # Names that used to miss may resolve locally now
+    cleared = index.clear_negative()
+    logger.info(f"[POI] Imported {sum(counts.values())} features; cleared {cleared} cached misses")
+    return counts
+
+
+_index: Optional[PoiIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_poi_index() -> Optional[PoiIndex]:
+    """Process-wide index; None when disabled with POI_INDEX_PATH=''"""
+    global _index
+    if not POI_INDEX_PATH:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = PoiIndex()
+                except Exception as e:
+                    logger.warning(f"[POI] Index disabled, failed to open {POI_INDEX_PATH}: {e}")
+                    return None
+    return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local landmark name index and lookup cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Import OSM features for regions or saved Overpass JSON files")
+    build_cmd.add_argument("--region", action="append", default=[],
+                           help="name=min_lat,min_lon,max_lat,max_lon (repeatable; default: POI_REGIONS)")
+    build_cmd.add_argument("--file", action="append", default=[], help="Saved Overpass JSON output (repeatable)")
+    lookup_cmd = sub.add_parser("lookup", help="Resolve a name against the local index")
+    lookup_cmd.add_argument("name")
+    args = parser.parse_args()
+
+    # Region extracts are far larger than interactive queries
+    os.environ.setdefault("GEO_REQUEST_TIMEOUT", "300")
+    index = get_poi_index() or PoiIndex()
+    if args.command == "build":
+        regions = parse_regions(";".join(args.region) if args.region else POI_REGIONS)
+        if not regions and not args.file:
+            parser.error("no regions given (--region or POI_REGIONS) and no --file")
+        print(json.dumps(build(index, regions, args.file), indent=2))
+    else:
+        print(json.dumps(index.find(args.name), indent=2, ensure_ascii=False))
@@ -0,0 +1,312 @@
+# pipeline_utils/batch.py
+"""
+Headless batch processing over a directory or manifest.
+
+    python -m pipeline_utils.batch photos/ -o results.jsonl --workers 8
+    python -m pipeline_utils.batch manifest.txt -o results.parquet --resume
+
+Each worker process loads the models once in its initializer and then runs
+the same stages as the Streamlit app (pipeline.run_pipeline) per image,
+one stage after another so a worker stays within its --threads-per-worker.
+With --preload the parent loads them instead and forks the workers, which
+then share the weights copy-on-write rather than holding a copy each.
+Successfully processed paths are appended to <output>.checkpoint so an
+interrupted run can be resumed with --resume; failed images are retried.
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List
+
+from location_utils.exif_fast import iter_image_paths
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PARQUET_ROWS_PER_PART = 1000
+
+# Per-process state set up by _init_worker
+_detector = None
+_run_pipeline = None
+_image_context = None
+
+
+def iter_inputs(source: str) -> Iterator[str]:
+    """Image paths from a directory (recursive), a .txt manifest or a .csv manifest with a `path` column"""
+    if os.path.isdir(source):
+        yield from iter_image_paths(source, IMAGE_EXTENSIONS)
+    elif source.endswith(".csv"):
+        with open(source, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("path"):
+                    yield row["path"]
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+
+
+def _configure_threads(threads: int):
+    """
+    Pin the torch, TensorFlow and ONNX Runtime thread pools to `threads`.
+
+    The environment variables only take effect in libraries imported after
+    this call, so torch and TensorFlow are also set through their APIs.
+    TensorFlow refuses once its runtime has started, and an ONNX Runtime
+    session keeps the counts it was created with. With --preload the parent
+    therefore calls this before loading any model, so the forked workers
+    inherit pools that are already the right size.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS", "ORT_INTRA_OP_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["ORT_INTER_OP_THREADS"] = "1"
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before torch's first parallel work in this process
+            pass
+    except ImportError:
+        # Emotion-only / ONNX-only installs have no torch
+        pass
+
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except ImportError:
+        pass
+    except RuntimeError as e:
+        logger.warning(f"[BATCH] TensorFlow threads already fixed in this process: {e}")
+
+
+def _init_worker(threads: int, geocoder_mode: str):
+    """Runs once per worker process: pin thread pools, then load models"""
+    global _detector, _run_pipeline, _image_context
+    _configure_threads(threads)
+
+    from emotion_utils.detector import EmotionDetector
+    from location_utils import geocoder
+    from pipeline_utils.image_context import ImageContext
+    from pipeline_utils.models import registry
+    from pipeline_utils import pipeline
+    from pipeline_utils.pipeline import run_pipeline
+
+    # Parallelism here comes from the worker processes; the per-upload thread pool
+    # would multiply every worker's pinned threads by PIPELINE_THREADS
+    pipeline.PIPELINE_CONCURRENT = False
+    if geocoder_mode:
+        geocoder.GEOCODER_MODE = geocoder_mode
+    # Models are lazy by default; a batch worker wants them all up front
+    # (already loaded when the parent preloaded them before forking)
+    for name in registry.warm_names():
+        registry.get(name)
+    _detector = EmotionDetector()
+    _run_pipeline = run_pipeline
+    _image_context = ImageContext
+
+
+def _process(path: str) -> dict:
+    start = time.perf_counter()
+    record = {"path": path}
+    try:
+        ctx = _image_context.from_path(path)
+        result = _run_pipeline(ctx, _detector)
+        record.update({
+            "sha256": ctx.sha256,
+            "faces": len(result["detections"]),
+            "detections": result["detections"],
+            "emotion": result["detections"][0]["emotion"] if result["detections"] else None,
+            "location": result["location"],
+            "method": result["method"],
+            "lat": result["coords"][0] if result["coords"] else None,
+            "lon": result["coords"][1] if result["coords"] else None,
+            "landmark": result["landmark"],
+            "error": None,
+        })
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        self.f = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> List[dict]:
+        self.f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.f.flush()
+        return [record]
+
+    def close(self) -> List[dict]:
+        self.f.close()
+        return []
+
+
+class ParquetWriter:
+    """Buffers rows and writes numbered part files into the <output> directory"""
+
+    def __init__(self, path: str):
+        import pandas as pd
+        try:
+            # Checked up front so a missing engine fails before the batch runs, not at the first flush
+            pd.io.parquet.get_engine("auto")
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow) or fastparquet")
+        self.pd = pd
+        self.dir = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = []
+        self.part = len([n for n in os.listdir(path) if n.endswith(".parquet")])
+
+    def write(self, record: dict) -> List[dict]:
+        row = dict(record)
+        row["detections"] = json.dumps(row.get("detections") or [], default=str)
+        self.rows.append(row)
+        return self._flush() if len(self.rows) >= PARQUET_ROWS_PER_PART else []
+
+    def _flush(self) -> List[dict]:
+        if not self.rows:
+            return []
+        out = os.path.join(self.dir, f"part-{self.part:05d}.parquet")
+        self.pd.DataFrame(self.rows).to_parquet(out, index=False)
+        self.part += 1
+        done = self.rows
+        self.rows = []
+        return done
+
+    def close(self) -> List[dict]:
+        return self._flush()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _preload_models(threads: int):
+    """Load every model in the parent so forked workers share the pages"""
+    # Thread pools and ONNX sessions are sized now; forked workers inherit them
+    _configure_threads(threads)
+    from pipeline_utils.models import registry
+    registry.preload()
+    logger.info(f"[BATCH] Preloaded models ({registry.total_resident_bytes() / 2**20:.0f} MB) before forking")
+
+
+def run_batch(source: str, output: str, workers: int, threads: int, resume: bool,
+              geocoder_mode: str, start_method: str, preload: bool = False) -> dict:
+    checkpoint_path = output.rstrip("/\\") + ".checkpoint"
+    done = set()
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            done = {line.rstrip("\n") for line in f if line.strip()}
+        logger.info(f"[BATCH] Resuming, {len(done)} images already processed")
+    elif not resume and (os.path.exists(output) or os.path.exists(checkpoint_path)):
+        raise SystemExit(f"{output} already exists; pass --resume to continue it or remove it first")
+
+    writer = ParquetWriter(output) if output.endswith(".parquet") else JsonlWriter(output)
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+
+    stats = {"processed": 0, "failed": 0, "skipped": 0, "faces": 0, "located": 0}
+    latencies = []
+    started = time.perf_counter()
+    if preload:
+        _preload_models(threads)
+        start_method = "fork"
+    ctx = multiprocessing.get_context(start_method)
+    max_in_flight = workers * 4
+
+    def write_checkpoint(records):
+        # Failed images stay out of the checkpoint so --resume retries them
+        for record in records:
+            if record["error"] is None:
+                checkpoint.write(record["path"] + "\n")
+        checkpoint.flush()
+
+    def handle(record):
+        stats["processed"] += 1
+        if record["error"]:
+            stats["failed"] += 1
+        else:
+            stats["faces"] += record["faces"]
+            stats["located"] += record["lat"] is not None
+        latencies.append(record["seconds"])
+        write_checkpoint(writer.write(record))
+        if stats["processed"] % 100 == 0:
+            rate = stats["processed"] / (time.perf_counter() - started)
+            logger.info(f"[BATCH] {stats['processed']} images, {rate:.2f} img/s")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(threads, geocoder_mode)) as pool:
+            pending = set()
+            for path in iter_inputs(source):
+                if path in done:
+                    stats["skipped"] += 1
+                    continue
+                pending.add(pool.submit(_process, path))
+                if len(pending) >= max_in_flight:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        handle(future.result())
+            for future in pending:
+                handle(future.result())
+    finally:
+        write_checkpoint(writer.close())
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - started
+    stats.update({
+        "elapsed_s": round(elapsed, 2),
+        "images_per_s": round(stats["processed"] / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(statistics.median(latencies), 4) if latencies else 0.0,
+        "latency_p95_s": round(_percentile(latencies, 95), 4),
+        "workers": workers,
+        "threads_per_worker": threads,
+    })
+    return stats
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Batch emotion + location detection over an image archive")
+    parser.add_argument("source", help="Image directory, .txt manifest (one path per line) or .csv manifest with a path column")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="Output .jsonl file or .parquet directory")
+    parser.add_argument("-w", "--workers", type=int, default=cpus, help="Worker processes (default: CPU count)")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="Intra-op threads per worker (default: CPU count / workers)")
+    parser.add_argument("--resume", action="store_true", help="Skip images listed in <output>.checkpoint")
+    parser.add_argument("--geocoder-mode", default="",
+                        help="Override GEOCODER_MODE in workers (offline is recommended for large archives)")
+    parser.add_argument("--start-method", default="spawn", choices=["spawn", "fork", "forkserver"])
+    parser.add_argument("--preload", action="store_true",
+                        help="Load models once in the parent and fork workers that share them (implies fork)")
+    args = parser.parse_args(argv)
+
+    threads = args.threads_per_worker or max(1, cpus // max(1, args.workers))
+    summary = run_batch(args.source, args.output, args.workers, threads, args.resume,
+                        args.geocoder_mode, args.start_method, args.preload)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
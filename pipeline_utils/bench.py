@@ -0,0 +1,368 @@
+# pipeline_utils/bench.py
+"""
+End-to-end benchmark of the stages behind app.py::main.
+
+    python -m pipeline_utils.bench -o bench.json
+    python -m pipeline_utils.bench --images fixtures/ --face fixtures/face.jpg -o bench.json
+    python -m pipeline_utils.bench -o new.json --compare bench.json
+
+Every stage runs for real. Network lookups go to an in-process
+location_utils.geo_stub, and history rows go to a throwaway SQLite file, so
+runs are reproducible offline. The report holds per-stage throughput and
+p50/p95/p99 latency, plus scaling curves against image size and face count.
+Memory is measured separately for each point, in one extra untimed pass:
+- the tracemalloc peak of Python and numpy allocations;
+- the RSS growth over the point's baseline, which also covers native
+  buffers (OpenCV, TensorFlow).
+The process-wide high-water mark is reported once. --compare flags stages whose p50 got
+slower than a baseline report by more than --tolerance.
+"""
+import argparse
+import asyncio
+import gc
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ["decode", "detect_emotions", "draw_detections", "extract_gps", "detect_landmark",
+          "query_landmark_coords", "get_address_from_coords", "save_history"]
+SIZES = [640, 1280, 2560, 4096]
+FACE_COUNTS = [0, 1, 4, 16]
+STUB_PORT = 8099
+# Petronas Towers, the location embedded in synthetic images
+BENCH_COORDS = (3.1579, 101.7116)
+BENCH_LANDMARK = "petronas towers"
+
+
+def _peak_rss_mb() -> float:
+    """Process high-water mark; it never goes down, so it is only meaningful for the whole run"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RssSampler:
+    """Highest current RSS seen while the block runs, sampled on a background thread"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = _current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss_bytes() or 0)
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.peak is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss_bytes() or 0)
+
+
+def _dms(value: float):
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return (IFDRational(degrees), IFDRational(minutes), IFDRational(seconds))
+
+
+def gps_exif(lat: float, lon: float) -> bytes:
+    exif = Image.Exif()
+    exif[0x8825] = {1: "N" if lat >= 0 else "S", 2: _dms(abs(lat)),
+                    3: "E" if lon >= 0 else "W", 4: _dms(abs(lon))}
+    return exif.tobytes()
+
+
+def synthetic_image(long_side: int, faces: int = 0, face: Optional[Image.Image] = None,
+                    coords=BENCH_COORDS, seed: int = 0) -> bytes:
+    """
+    4:3 JPEG with GPS EXIF. The background is smoothed noise, so it is
+    neither trivially compressible nor face-like. `faces` copies of the
+    `face` fixture are pasted on a grid.
+    """
+    rng = np.random.default_rng(seed)
+    w, h = long_side, long_side * 3 // 4
+    coarse = rng.integers(0, 255, (max(2, h // 16), max(2, w // 16), 3), dtype=np.uint8)
+    canvas = Image.fromarray(coarse).resize((w, h), Image.BILINEAR)
+    if faces and face is not None:
+        cols = int(np.ceil(np.sqrt(faces)))
+        rows = int(np.ceil(faces / cols))
+        cell = min(w // cols, h // rows)
+        tile = face.resize((int(cell * 0.8), int(cell * 0.8)))
+        for i in range(faces):
+            r, c = divmod(i, cols)
+            canvas.paste(tile, (c * cell + cell // 10, r * cell + cell // 10))
+    buf = io.BytesIO()
+    canvas.save(buf, "JPEG", quality=90, exif=gps_exif(*coords) if coords else b"")
+    return buf.getvalue()
+
+
+def start_geo_stub(port: int = STUB_PORT, latency: float = 0.0):
+    """Serve location_utils.geo_stub on a daemon thread; returns the base URL"""
+    from aiohttp import web
+    from location_utils.geo_stub import make_app
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def _serve():
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(make_app(latency))
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=_serve, name="geo-stub", daemon=True).start()
+    if not ready.wait(30):
+        raise RuntimeError("Geocoder stub did not start")
+    return f"http://127.0.0.1:{port}"
+
+
+def configure_environment(workdir: str, stub_url: Optional[str]):
+    """Must run before the pipeline modules are imported; they read these at import time"""
+    os.environ["HISTORY_BACKEND"] = "sqlite"
+    os.environ["HISTORY_DB_PATH"] = os.path.join(workdir, "history.sqlite")
+    os.environ["GEOCODE_CACHE_PATH"] = ""
+    os.environ["RESULT_CACHE_PATH"] = ""
+    os.environ["POI_INDEX_PATH"] = ""
+    if stub_url:
+        os.environ["NOMINATIM_URL"] = stub_url
+        os.environ["OVERPASS_URL"] = stub_url + "/api/interpreter"
+        os.environ["NOMINATIM_RATE"] = os.environ["OVERPASS_RATE"] = "100000"
+        os.environ.setdefault("GEOCODER_MODE", "remote")
+
+
+class StageRunner:
+    """Runs each app.py stage on one encoded image and records wall-clock time per stage"""
+
+    def __init__(self, skip=()):
+        from emotion_utils.detector import EmotionDetector
+        from location_utils.extract_gps import convert_gps, extract_gps
+        from location_utils.geocoder import get_address_from_coords
+        from location_utils.landmark import detect_landmark, query_landmark_coords
+        from pipeline_utils.history import get_history_store
+        from pipeline_utils.image_context import ImageContext
+
+        self.skip = set(skip)
+        self.detector = EmotionDetector()
+        self.history = get_history_store()
+        self._fns = {
+            "context": ImageContext.from_bytes,
+            "extract_gps": extract_gps, "convert_gps": convert_gps,
+            "detect_landmark": detect_landmark, "query_landmark_coords": query_landmark_coords,
+            "get_address_from_coords": get_address_from_coords,
+        }
+        self.n = 0
+
+    def run(self, data: bytes) -> Dict[str, float]:
+        f, timings = self._fns, {}
+
+        def timed(stage, call):
+            if stage in self.skip:
+                return None
+            start = time.perf_counter()
+            value = call()
+            timings[stage] = (time.perf_counter() - start) * 1000
+            return value
+
+        self.n += 1
+        ctx = f["context"](data, f"bench-{self.n}.jpg")
+        timed("decode", lambda: ctx.bgr)
+        detections = timed("detect_emotions", lambda: self.detector.detect_emotions(ctx)) or []
+        timed("draw_detections", lambda: self.detector.draw_detections(ctx.bgr, detections))
+        coords = timed("extract_gps", lambda: f["convert_gps"](f["extract_gps"](ctx))) or BENCH_COORDS
+        landmark = timed("detect_landmark", lambda: f["detect_landmark"](ctx)) or BENCH_LANDMARK
+        timed("query_landmark_coords", lambda: f["query_landmark_coords"](landmark))
+        # Jitter keeps every lookup a distinct request
+        jittered = (coords[0] + self.n * 1e-5, coords[1])
+        location = timed("get_address_from_coords", lambda: f["get_address_from_coords"](jittered))
+        top = max(detections, key=lambda d: d["confidence"]) if detections else {"emotion": "none", "confidence": 0}
+        timed("save_history", lambda: self.history.append(
+            "bench", top["emotion"], top["confidence"], location or "Unknown",
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        timings["total"] = sum(timings.values())
+        return timings
+
+
+def summarize(samples: List[Dict[str, float]]) -> Dict[str, dict]:
+    stats = {}
+    for stage in STAGES + ["total"]:
+        values = np.array([s[stage] for s in samples if stage in s])
+        if values.size == 0:
+            continue
+        stats[stage] = {
+            "n": int(values.size),
+            "mean_ms": round(float(values.mean()), 3),
+            "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3),
+            "p99_ms": round(float(np.percentile(values, 99)), 3),
+            "throughput_per_s": round(1000.0 / float(values.mean()), 2) if values.mean() else None,
+        }
+    return stats
+
+
+def _memory_point(runner: StageRunner, images: List[bytes]) -> dict:
+    """
+    Memory of one untimed pass over `images`, relative to a baseline taken
+    just before it; tracemalloc slows everything down, so it stays out of
+    the latency samples.
+    """
+    gc.collect()
+    baseline = _current_rss_bytes()
+    tracemalloc.start()
+    try:
+        with _RssSampler() as sampler:
+            for data in images:
+                runner.run(data)
+        _, alloc_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    mb = 1024 * 1024
+    return {
+        "peak_alloc_mb": round(alloc_peak / mb, 2),
+        "rss_growth_mb": round((sampler.peak - baseline) / mb, 2) if baseline is not None else None,
+    }
+
+
+def _measure(runner: StageRunner, images: List[bytes], repeats: int) -> dict:
+    samples = [runner.run(data) for _ in range(repeats) for data in images]
+    return dict({"stages": summarize(samples)}, **_memory_point(runner, images))
+
+
+def _run_meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    keys = ("CLIP_ENGINE", "EMOTION_DETECTOR_BACKEND", "EMOTION_MAX_SIDE", "EMOTION_TILING",
+            "GEOCODER_MODE", "PIPELINE_THREADS")
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "env": {k: os.environ.get(k) for k in keys if os.environ.get(k) is not None},
+        "repeats": args.repeats,
+        "skip": args.skip,
+    }
+
+
+def run_benchmark(args) -> dict:
+    face = Image.open(args.face).convert("RGB") if args.face else None
+    runner = StageRunner(skip=args.skip)
+
+    # Models load on first use; keep that out of the steady-state numbers
+    start = time.perf_counter()
+    runner.run(synthetic_image(640, 1 if face else 0, face))
+    report = {"meta": _run_meta(args), "warmup_s": round(time.perf_counter() - start, 3)}
+
+    if args.images:
+        from location_utils.exif_fast import iter_image_paths
+        fixtures = []
+        for path in list(iter_image_paths(args.images))[:args.limit]:
+            with open(path, "rb") as f:
+                fixtures.append(f.read())
+        report["fixtures"] = dict(_measure(runner, fixtures, args.repeats), images=len(fixtures))
+
+    base = [synthetic_image(1280, 1 if face else 0, face, seed=i) for i in range(args.synthetic)]
+    report["synthetic"] = dict(_measure(runner, base, args.repeats), images=len(base))
+
+    report["scaling"] = {"image_size": [], "face_count": []}
+    for side in args.sizes:
+        point = _measure(runner, [synthetic_image(side, 1 if face else 0, face)], args.repeats)
+        report["scaling"]["image_size"].append(dict(point, long_side=side))
+    if face is not None:
+        for count in args.faces:
+            point = _measure(runner, [synthetic_image(1280, count, face)], args.repeats)
+            report["scaling"]["face_count"].append(dict(point, faces=count))
+    else:
+        logger.info("[BENCH] No --face fixture; skipping the face-count sweep")
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Stages whose p50 regressed by more than `tolerance` (fraction) against `baseline`"""
+    regressions = []
+    for section in ("synthetic", "fixtures"):
+        new, old = report.get(section, {}).get("stages", {}), baseline.get(section, {}).get("stages", {})
+        for stage, stats in new.items():
+            if stage in old and old[stage]["p50_ms"] > 0:
+                change = stats["p50_ms"] / old[stage]["p50_ms"] - 1
+                if change > tolerance:
+                    regressions.append(f"{section}/{stage}: p50 {old[stage]['p50_ms']} -> "
+                                       f"{stats['p50_ms']} ms (+{change:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of the upload pipeline")
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("--images", help="Directory of fixture images (run in addition to synthetic ones)")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of fixture images")
+    parser.add_argument("--face", help="Face fixture pasted into synthetic images for the face-count sweep")
+    parser.add_argument("--synthetic", type=int, default=10, help="Number of synthetic base images")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--faces", type=int, nargs="+", default=FACE_COUNTS)
+    parser.add_argument("--skip", nargs="*", default=[], choices=STAGES, help="Stages to leave out")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Seconds added per stub request")
+    parser.add_argument("--no-stub", action="store_true", help="Use the configured geo services instead")
+    parser.add_argument("--compare", help="Baseline report to check for p50 regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    stub_url = None if args.no_stub else start_geo_stub(latency=args.stub_latency)
+    configure_environment(workdir, stub_url)
+
+    result = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    for stage, stats in result["synthetic"]["stages"].items():
+        print(f"{stage:<26}p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+              f"p99 {stats['p99_ms']:>9.2f} ms  {stats['throughput_per_s']}/s")
+    print(f"peak RSS {result['peak_rss_mb']} MB -> {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,474 @@
+# pipeline_utils/history.py
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from location_utils.catalogue import BBox
+from location_utils.geocache import geohash
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HISTORY_BACKEND = os.environ.get("HISTORY_BACKEND", "sqlite").lower()
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", "history.sqlite")
+LEGACY_CSV_PATH = os.environ.get("HISTORY_CSV_PATH", "history.csv")
+
+COLUMNS = ["Username", "Emotion", "Confidence", "Location", "timestamp"]
+# SQLite pages also carry the upload's content hash, the key of its cached thumbnail
+PAGE_COLUMNS = COLUMNS + ["image_sha"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Rollup granularities; "all" is the per-user lifetime total
+ROLLUP_BUCKETS = ("all", "hour", "day", "week")
+TREND_COLUMNS = ["period", "Emotion", "count", "mean_confidence"]
+
+# Geohash precisions kept in geo_rollup (1 is ~5000 km cells, 7 is ~150 m)
+GEO_PRECISIONS = range(1, 8)
+CLUSTER_COLUMNS = ["lat", "lon", "count", "cell"]
+MAX_MAP_POINTS = 500
+WORLD: BBox = (-90.0, -180.0, 90.0, 180.0)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """(lat degrees, lon degrees) covered by one geohash cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def cluster_precision(bbox: BBox, max_cells: int = MAX_MAP_POINTS) -> int:
+    """Finest rollup precision at which the viewport spans at most ~`max_cells` cells"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lat_span = max(max_lat - min_lat, 1e-6)
+    lon_span = max_lon - min_lon if min_lon <= max_lon else max_lon + 360 - min_lon
+    lon_span = max(lon_span, 1e-6)
+    best = GEO_PRECISIONS[0]
+    for precision in GEO_PRECISIONS:
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        if (lat_span / cell_lat + 1) * (lon_span / cell_lon + 1) > max_cells:
+            break
+        best = precision
+    return best
+
+
+def bucket_starts(timestamp: str) -> List[Tuple[str, str]]:
+    """(bucket, bucket_start) pairs a record counts towards; weeks start on Monday"""
+    try:
+        ts = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return [("all", "")]
+    return [
+        ("all", ""),
+        ("hour", ts.strftime("%Y-%m-%d %H:00:00")),
+        ("day", ts.strftime("%Y-%m-%d")),
+        ("week", (ts.date() - timedelta(days=ts.weekday())).isoformat()),
+    ]
+
+
+class HistoryStore(ABC):
+    """Interface every history backend implements"""
+
+    @abstractmethod
+    def append(self, username: str, emotion: str, confidence: float, location: str,
+               timestamp: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+               image_sha: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def count(self, username: str) -> int:
+        ...
+
+    @abstractmethod
+    def page(self, username: str, limit: int = 50, offset: int = 0) -> pd.DataFrame:
+        """Newest-first slice of one user's records"""
+        ...
+
+    @abstractmethod
+    def emotion_counts(self, username: str) -> pd.DataFrame:
+        """Columns: Emotion, count, mean_confidence"""
+        ...
+
+    @abstractmethod
+    def emotion_trend(self, username: str, bucket: str = "day", periods: int = 30) -> pd.DataFrame:
+        """Columns: period, Emotion, count, mean_confidence for the last `periods` buckets, oldest first"""
+        ...
+
+    @abstractmethod
+    def clusters(self, username: Optional[str] = None, bbox: Optional[BBox] = None,
+                 max_points: int = MAX_MAP_POINTS) -> pd.DataFrame:
+        """
+        Geotagged uploads of one user (or everyone when `username` is None)
+        inside `bbox` = (min_lat, min_lon, max_lat, max_lon), aggregated to
+        at most `max_points` clusters. Columns: lat, lon, count, cell.
+        """
+        ...
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Append-only history table with (username, timestamp) indexes, plus an
+    emotion_rollup table of per-user counts and confidence sums by emotion
+    and time bucket. Rollups are upserted in the same transaction as each
+    append, so the chart never has to aggregate raw rows.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL COLLATE NOCASE,
+                emotion TEXT,
+                confidence REAL,
+                location TEXT,
+                timestamp TEXT NOT NULL,
+                lat REAL,
+                lon REAL,
+                image_sha TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_user_time ON history(username, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_history_time ON history(timestamp);
+            CREATE TABLE IF NOT EXISTS history_meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS emotion_rollup (
+                username TEXT NOT NULL COLLATE NOCASE,
+                bucket TEXT NOT NULL,
+                bucket_start TEXT NOT NULL,
+                emotion TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (username, bucket, bucket_start, emotion)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS geo_rollup (
+                scope TEXT NOT NULL,
+                precision INTEGER NOT NULL,
+                cell TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                lat_sum REAL NOT NULL,
+                lon_sum REAL NOT NULL,
+                PRIMARY KEY (scope, precision, cell)
+            ) WITHOUT ROWID;
+            -- Cell centroid latitude, so clusters() range-scans the viewport instead of every cell
+            CREATE INDEX IF NOT EXISTS idx_geo_rollup_lat ON geo_rollup(scope, precision, lat_sum / n);
+            """
+        )
+        self._migrate()
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM history_meta WHERE key = 'rollups'").fetchone():
+                # IMMEDIATE takes the write lock up front; another process opening the same fresh
+                # database may have built the rollups while this one waited, hence the re-check
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if not self._conn.execute("SELECT 1 FROM history_meta WHERE key = 'rollups'").fetchone():
+                        self._rebuild_rollups()
+                        self._conn.execute("INSERT OR IGNORE INTO history_meta (key, value) VALUES ('rollups', '1')")
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+    def _migrate(self):
+        """Databases created by earlier versions get the lat/lon and image_sha columns added"""
+        with self._lock:
+            # Column check, ALTERs and the geo rollup build all run under the write lock, so a
+            # second process starting against the same database waits and then finds them done
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in self._conn.execute("PRAGMA table_info(history)")}
+                for column, sql_type in (("lat", "REAL"), ("lon", "REAL"), ("image_sha", "TEXT")):
+                    if column not in columns:
+                        try:
+                            self._conn.execute(f"ALTER TABLE history ADD COLUMN {column} {sql_type}")
+                            logger.info(f"[HISTORY] Added history.{column} column")
+                        except sqlite3.OperationalError as e:
+                            if "duplicate column name" not in str(e):
+                                raise
+                if not self._conn.execute("SELECT 1 FROM history_meta WHERE key = 'geo_rollups'").fetchone():
+                    self._rebuild_geo_rollups()
+                    self._conn.execute("INSERT OR IGNORE INTO history_meta (key, value) VALUES ('geo_rollups', '1')")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _geo_rows(username, lat, lon):
+        """geo_rollup upsert parameters for one point: every precision, per user and deployment-wide"""
+        full = geohash(lat, lon, GEO_PRECISIONS[-1])
+        return [(scope, p, full[:p], lat, lon)
+                for scope in (username.lower(), "") for p in GEO_PRECISIONS]
+
+    def _upsert_geo(self, rows):
+        self._conn.executemany(
+            "INSERT INTO geo_rollup (scope, precision, cell, n, lat_sum, lon_sum) VALUES (?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (scope, precision, cell) DO UPDATE SET "
+            "n = n + 1, lat_sum = lat_sum + excluded.lat_sum, lon_sum = lon_sum + excluded.lon_sum",
+            rows,
+        )
+
+    def _rebuild_geo_rollups(self):
+        self._conn.execute("DELETE FROM geo_rollup")
+        cursor = self._conn.execute("SELECT username, lat, lon FROM history WHERE lat IS NOT NULL AND lon IS NOT NULL")
+        while True:
+            chunk = cursor.fetchmany(10000)
+            if not chunk:
+                break
+            self._upsert_geo([row for u, lat, lon in chunk for row in self._geo_rows(u, lat, lon)])
+
+    def append(self, username, emotion, confidence, location, timestamp=None, lat=None, lon=None,
+               image_sha=None):
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        has_coords = lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+        if not has_coords:
+            lat = lon = None
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO history (username, emotion, confidence, location, timestamp, lat, lon, image_sha) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (username, emotion, confidence, location, timestamp, lat, lon, image_sha),
+                )
+                if has_coords:
+                    self._upsert_geo(self._geo_rows(username, lat, lon))
+                self._conn.executemany(
+                    "INSERT INTO emotion_rollup (username, bucket, bucket_start, emotion, n, confidence_sum) "
+                    "VALUES (?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (username, bucket, bucket_start, emotion) DO UPDATE SET "
+                    "n = n + 1, confidence_sum = confidence_sum + excluded.confidence_sum",
+                    [(username, bucket, start, emotion or "", float(confidence or 0))
+                     for bucket, start in bucket_starts(timestamp)],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _rebuild_rollups(self):
+        """Recompute every rollup from the raw table; runs inside the caller's transaction"""
+        self._conn.execute("DELETE FROM emotion_rollup")
+        bucket_exprs = {
+            "all": "''",
+            "hour": "strftime('%Y-%m-%d %H:00:00', timestamp)",
+            "day": "date(timestamp)",
+            "week": "date(timestamp, 'weekday 0', '-6 days')",
+        }
+        for bucket, expr in bucket_exprs.items():
+            self._conn.execute(
+                f"INSERT INTO emotion_rollup (username, bucket, bucket_start, emotion, n, confidence_sum) "
+                f"SELECT username, ?, {expr} AS start, COALESCE(emotion, ''), COUNT(*), "
+                f"COALESCE(SUM(confidence), 0) FROM history WHERE {expr} IS NOT NULL "
+                f"GROUP BY username COLLATE NOCASE, start, COALESCE(emotion, '')",
+                (bucket,),
+            )
+
+    def count(self, username):
+        with self._lock:
+            (n,) = self._conn.execute(
+                "SELECT COALESCE(SUM(n), 0) FROM emotion_rollup WHERE username = ? AND bucket = 'all'",
+                (username,),
+            ).fetchone()
+        return n
+
+    def page(self, username, limit=50, offset=0):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT username, emotion, confidence, location, timestamp, image_sha FROM history "
+                "WHERE username = ? ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+                (username, limit, offset),
+            ).fetchall()
+        return pd.DataFrame(rows, columns=PAGE_COLUMNS)
+
+    def emotion_counts(self, username):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT emotion, n, confidence_sum / n FROM emotion_rollup "
+                "WHERE username = ? AND bucket = 'all' ORDER BY emotion",
+                (username,),
+            ).fetchall()
+        return pd.DataFrame(rows, columns=["Emotion", "count", "mean_confidence"])
+
+    def emotion_trend(self, username, bucket="day", periods=30):
+        if bucket not in ROLLUP_BUCKETS[1:]:
+            raise ValueError(f"Unknown rollup bucket '{bucket}'")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bucket_start, emotion, n, confidence_sum / n FROM emotion_rollup "
+                "WHERE username = ? AND bucket = ? AND bucket_start IN ("
+                "  SELECT DISTINCT bucket_start FROM emotion_rollup WHERE username = ? AND bucket = ? "
+                "  ORDER BY bucket_start DESC LIMIT ?"
+                ") ORDER BY bucket_start, emotion",
+                (username, bucket, username, bucket, periods),
+            ).fetchall()
+        return pd.DataFrame(rows, columns=TREND_COLUMNS)
+
+    def clusters(self, username=None, bbox=None, max_points=MAX_MAP_POINTS):
+        bbox = bbox or WORLD
+        min_lat, min_lon, max_lat, max_lon = bbox
+        precision = cluster_precision(bbox, max_points)
+        if min_lon <= max_lon:
+            lon_clause = "lon_sum / n BETWEEN ? AND ?"
+        else:  # Viewport crosses the antimeridian
+            lon_clause = "(lon_sum / n >= ? OR lon_sum / n <= ?)"
+        with self._lock:
+            # `lat_sum / n` must match the idx_geo_rollup_lat expression for the index to be used
+            rows = self._conn.execute(
+                f"SELECT lat_sum / n, lon_sum / n, n, cell FROM geo_rollup "
+                f"WHERE scope = ? AND precision = ? AND lat_sum / n BETWEEN ? AND ? AND {lon_clause} "
+                f"ORDER BY n DESC LIMIT ?",
+                ((username or "").lower(), precision, min_lat, max_lat, min_lon, max_lon, max_points),
+            ).fetchall()
+        return pd.DataFrame(rows, columns=CLUSTER_COLUMNS)
+
+    def import_csv(self, csv_path: str = LEGACY_CSV_PATH, batch_size: int = 10000) -> int:
+        """
+        One-time import of a legacy history.csv. Records the import in
+        history_meta so restarting the app never duplicates rows.
+        """
+        marker = f"imported:{os.path.abspath(csv_path)}"
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM history_meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+        if not os.path.exists(csv_path):
+            return 0
+
+        imported = 0
+        with open(csv_path, "r", encoding="utf-8", newline="") as f, self._lock:
+            reader = csv.DictReader(f)
+            self._conn.execute("BEGIN")
+            try:
+                batch = []
+                for row in reader:
+                    batch.append((row.get("Username"), row.get("Emotion"), row.get("Confidence") or None,
+                                  row.get("Location"), row.get("timestamp")))
+                    if len(batch) >= batch_size:
+                        imported += self._insert_many(batch)
+                        batch = []
+                imported += self._insert_many(batch)
+                self._rebuild_rollups()
+                self._conn.execute("INSERT INTO history_meta (key, value) VALUES (?, ?)",
+                                   (marker, datetime.now().isoformat()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"[HISTORY] Imported {imported} rows from {csv_path}")
+        return imported
+
+    def _insert_many(self, rows):
+        rows = [r for r in rows if r[0] and r[4]]
+        self._conn.executemany(
+            "INSERT INTO history (username, emotion, confidence, location, timestamp) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+
+class CsvHistoryStore(HistoryStore):
+    """
+    Legacy history.csv layout. Writes append a single line instead of
+    rewriting the file; reads still scan it, so prefer the SQLite backend.
+    """
+
+    def __init__(self, path: str = LEGACY_CSV_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, username, emotion, confidence, location, timestamp=None, lat=None, lon=None,
+               image_sha=None):
+        # The legacy layout has no coordinate or thumbnail columns; those are dropped
+        timestamp = timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        with self._lock:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(COLUMNS)
+                writer.writerow([username, emotion, confidence, location, timestamp])
+
+    def _user_rows(self, username):
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=COLUMNS)
+        # Without the dtype, all-digit usernames make pandas read the column as numbers
+        df = pd.read_csv(self.path, dtype={"Username": str})
+        return df[df["Username"].str.lower() == username.lower()]
+
+    def count(self, username):
+        return len(self._user_rows(username))
+
+    def page(self, username, limit=50, offset=0):
+        df = self._user_rows(username).sort_values("timestamp", ascending=False)
+        return df.iloc[offset:offset + limit].reset_index(drop=True)
+
+    def emotion_counts(self, username):
+        grouped = self._user_rows(username).groupby("Emotion")["Confidence"]
+        return grouped.agg(count="size", mean_confidence="mean").reset_index()
+
+    def emotion_trend(self, username, bucket="day", periods=30):
+        df = self._user_rows(username)
+        ts = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+        df = df.assign(ts=ts).dropna(subset=["ts"])
+        if bucket == "hour":
+            period = df["ts"].dt.strftime("%Y-%m-%d %H:00:00")
+        elif bucket == "day":
+            period = df["ts"].dt.strftime("%Y-%m-%d")
+        elif bucket == "week":
+            period = (df["ts"].dt.normalize() - pd.to_timedelta(df["ts"].dt.weekday, unit="D")).dt.strftime("%Y-%m-%d")
+        else:
+            raise ValueError(f"Unknown rollup bucket '{bucket}'")
+        trend = (df.assign(period=period).groupby(["period", "Emotion"])["Confidence"]
+                 .agg(count="size", mean_confidence="mean").reset_index())
+        keep = sorted(trend["period"].unique())[-periods:]
+        return trend[trend["period"].isin(keep)][TREND_COLUMNS].reset_index(drop=True)
+
+    def clusters(self, username=None, bbox=None, max_points=MAX_MAP_POINTS):
+        # history.csv never stored coordinates
+        return pd.DataFrame(columns=CLUSTER_COLUMNS)
+
+
+BACKENDS = {
+    "sqlite": lambda: SQLiteHistoryStore(HISTORY_DB_PATH),
+    "csv": lambda: CsvHistoryStore(LEGACY_CSV_PATH),
+}
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Process-wide store for the configured HISTORY_BACKEND"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = BACKENDS[HISTORY_BACKEND]()
+                if isinstance(store, SQLiteHistoryStore):
+                    try:
+                        store.import_csv(LEGACY_CSV_PATH)
+                    except Exception as e:
+                        logger.error(f"[HISTORY] CSV import failed: {e}")
+                _store = store
+    return _store
+
+
+if __name__ == "__main__":
+    # python -m pipeline_utils.history import [history.csv]
+    if len(sys.argv) >= 2 and sys.argv[1] == "import":
+        count = SQLiteHistoryStore(HISTORY_DB_PATH).import_csv(sys.argv[2] if len(sys.argv) > 2 else LEGACY_CSV_PATH)
+        print(f"Imported {count} rows into {HISTORY_DB_PATH}")
+    else:
+        print("usage: python -m pipeline_utils.history import [history.csv]")
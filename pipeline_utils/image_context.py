@@ -0,0 +1,130 @@
+# pipeline_utils/image_context.py
+import hashlib
+import io
+import logging
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _locked_property:
+    """
+    Lazily computed attribute, computed under the instance's own lock so
+    stages running in parallel threads don't decode the same image twice or
+    share a PIL image mid-load. Unlike functools.cached_property (which on
+    Python < 3.12 also holds one lock per property for every instance),
+    contexts of different uploads never wait on each other. Once cached,
+    reads go straight to the instance dict.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with instance._lock:
+            cache = instance.__dict__
+            if self.name not in cache:
+                cache[self.name] = self.func(instance)
+            return cache[self.name]
+
+
+class ImageContext:
+    """
+    One uploaded image, decoded once and shared by every pipeline stage.
+
+    Holds the raw bytes and lazily derives the decoded RGB array, the BGR
+    view cv2 wants, downscaled copies and the parsed EXIF GPS block, each
+    computed at most once per upload.
+    """
+
+    def __init__(self, data: bytes, name: str = ""):
+        self.data = data
+        self.name = name
+        self._downscaled = {}
+        # Reentrant: derivations build on each other (bgr -> rgb -> pil -> source)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = "") -> "ImageContext":
+        return cls(bytes(data), name)
+
+    @classmethod
+    def from_path(cls, path: str) -> "ImageContext":
+        with open(path, "rb") as f:
+            return cls(f.read(), path)
+
+    @_locked_property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    @_locked_property
+    def source(self) -> Image.Image:
+        """The undecoded PIL image; only the header has been parsed at this point"""
+        return Image.open(io.BytesIO(self.data))
+
+    @_locked_property
+    def pil(self) -> Image.Image:
+        return self.source.convert("RGB")
+
+    @_locked_property
+    def rgb(self) -> np.ndarray:
+        return np.asarray(self.pil)
+
+    @_locked_property
+    def bgr(self) -> np.ndarray:
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+
+    @property
+    def size(self):
+        """(width, height) without forcing a full decode"""
+        return self.source.size
+
+    def downscaled(self, max_side: int, color: str = "rgb") -> np.ndarray:
+        """
+        Copy whose longest side is at most `max_side`; the full-size array
+        itself is returned when the image is already small enough.
+        """
+        key = (max_side, color)
+        with self._lock:
+            if key in self._downscaled:
+                return self._downscaled[key]
+            w, h = self.size
+            scale = max_side / max(h, w)
+            if scale >= 1:
+                self._downscaled[key] = self.rgb if color == "rgb" else self.bgr
+            else:
+                size = (max(1, round(w * scale)), max(1, round(h * scale)))
+                small = cv2.resize(self._reduced(size), size, interpolation=cv2.INTER_AREA)
+                self._downscaled[key] = small if color == "rgb" else cv2.cvtColor(small, cv2.COLOR_RGB2BGR)
+            return self._downscaled[key]
+
+    def _reduced(self, size) -> np.ndarray:
+        """
+        RGB array at least `size` large. Until something needs the full-size
+        pixels, JPEGs are decoded at a reduced DCT scale (1/2, 1/4, 1/8), which
+        skips most of the decode work for camera-sized photos.
+        """
+        if "rgb" in self.__dict__ or self.source.format != "JPEG":
+            return self.rgb
+        image = Image.open(io.BytesIO(self.data))
+        image.draft("RGB", size)
+        return np.asarray(image.convert("RGB"))
+
+    @_locked_property
+    def gps_info(self) -> Optional[dict]:
+        from location_utils.extract_gps import gps_from_header, gps_from_image
+        gps_info = gps_from_header(self.data)
+        return gps_from_image(self.source) if gps_info is False else gps_info
@@ -0,0 +1,368 @@
+# pipeline_utils/inference_worker.py
+"""
+Model-serving worker process shared by several UI processes.
+
+    python -m pipeline_utils.inference_worker --address /tmp/geoai-inference.sock
+    INFERENCE_WORKER=/tmp/geoai-inference.sock streamlit run app.py --server.port 8501
+    INFERENCE_WORKER=/tmp/geoai-inference.sock streamlit run app.py --server.port 8502
+
+The worker owns the emotion and CLIP models. Requests arrive over a
+multiprocessing.connection socket (a Unix socket path or host:port). A
+micro-batcher per request type collects whatever arrives within a short
+window (INFERENCE_BATCH_WINDOW_MS, up to INFERENCE_MAX_BATCH requests) and
+runs it as a single batched call: detect_emotions_batch or
+detect_landmarks_batch. Images travel as their encoded bytes, and the
+worker decodes them.
+
+The connection carries pickles, so whoever can connect can run code in the
+worker. A host:port address therefore requires INFERENCE_AUTHKEY, and the
+worker refuses to start without it. A Unix socket is created readable and
+writable by its owner only. It also uses the key when one is set.
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from emotion_utils.detector import EmotionDetector
+from emotion_utils.resolution import ResolutionPolicy
+from pipeline_utils.image_context import ImageContext
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Unset: every UI process runs its own models in-process
+INFERENCE_WORKER = os.environ.get("INFERENCE_WORKER", "")
+# Shared secret for the connection handshake; mandatory for TCP addresses
+INFERENCE_AUTHKEY = os.environ.get("INFERENCE_AUTHKEY", "").encode("utf-8") or None
+BATCH_WINDOW_MS = float(os.environ.get("INFERENCE_BATCH_WINDOW_MS", "10"))
+MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", "16"))
+REQUEST_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "120"))
+
+
+class InferenceWorkerError(Exception):
+    """The inference worker is unreachable or failed the request"""
+
+
+def parse_address(address: str):
+    """'host:port' -> (host, port); anything else is a Unix socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def _checked_address(address: str, authkey: Optional[bytes]):
+    """Parsed address; TCP without an authkey would expose unpickling to the network"""
+    parsed = parse_address(address)
+    if not isinstance(parsed, str) and not authkey:
+        raise InferenceWorkerError(
+            f"INFERENCE_AUTHKEY must be set to use a TCP inference address ({address}); "
+            "use a Unix socket path for an unauthenticated local worker")
+    return parsed
+
+
+class MicroBatcher:
+    """
+    Collects submitted items for up to `window` seconds (or `max_batch`
+    items) after the first one arrives, then calls `handler(items)` once;
+    `handler` returns one result per item.
+    """
+
+    def __init__(self, name: str, handler: Callable[[list], list], window: float, max_batch: int):
+        self.name = name
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._queue: queue.Queue = queue.Queue()
+        threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True).start()
+
+    def submit(self, item, reply: Callable):
+        self._queue.put((item, reply))
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.handler([item for item, _ in batch])
+                outcomes = [(True, result) for result in results]
+            except Exception as e:
+                logger.exception(f"[WORKER] {self.name} batch of {len(batch)} failed")
+                outcomes = [(False, f"{type(e).__name__}: {e}")] * len(batch)
+            for (_, reply), outcome in zip(batch, outcomes):
+                reply(*outcome)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0}
+
+
+def _as_input(image):
+    """Encoded bytes become an ImageContext; arrays (BGR) pass through"""
+    if isinstance(image, (bytes, bytearray)):
+        return ImageContext.from_bytes(image)
+    return image
+
+
+class InferenceServer:
+    def __init__(self, address: str, window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+        from location_utils.landmark import detect_landmarks_batch
+
+        self.address = _checked_address(address, INFERENCE_AUTHKEY)
+        self.detector = EmotionDetector()
+        self._detect_landmarks_batch = detect_landmarks_batch
+        window = window_ms / 1000.0
+        self.batchers = {
+            "emotions": MicroBatcher("emotions", self._emotions, window, max_batch),
+            "landmark": MicroBatcher("landmark", self._landmarks, window, max_batch),
+        }
+
+    def _emotions(self, images: list) -> list:
+        return self.detector.detect_emotions_batch([_as_input(img) for img in images])
+
+    def _landmarks(self, items: list) -> list:
+        # Requests with different settings are batched separately
+        results = [None] * len(items)
+        groups: Dict[tuple, List[int]] = {}
+        for i, (_, threshold, top_k) in enumerate(items):
+            groups.setdefault((threshold, top_k), []).append(i)
+        for (threshold, top_k), idxs in groups.items():
+            found = self._detect_landmarks_batch([_as_input(items[i][0]) for i in idxs],
+                                                 threshold=threshold, top_k=top_k)
+            for i, landmark in zip(idxs, found):
+                results[i] = landmark
+        return results
+
+    def info(self) -> dict:
+        return {"pid": os.getpid(), "detector_backend": self.detector.detector_backend,
+                "resolution": dict(vars(self.detector.resolution))}
+
+    def stats(self) -> dict:
+        return dict(self.info(), **{name: b.stats() for name, b in self.batchers.items()})
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply_to(req_id):
+            def _reply(ok, value):
+                with send_lock:
+                    try:
+                        conn.send((req_id, ok, value))
+                    except (OSError, EOFError):
+                        pass
+            return _reply
+
+        try:
+            while True:
+                req_id, op, args = conn.recv()
+                if op in self.batchers:
+                    self.batchers[op].submit(args[0] if op == "emotions" else args, reply_to(req_id))
+                elif op == "info":
+                    reply_to(req_id)(True, self.info())
+                elif op == "stats":
+                    reply_to(req_id)(True, self.stats())
+                else:
+                    reply_to(req_id)(False, f"Unknown operation '{op}'")
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        from pipeline_utils.models import registry
+
+        for name in registry.warm_names():
+            registry.get(name)
+        registry.start_janitor()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        # The socket is created owner-only (no window in which others could connect)
+        old_umask = os.umask(0o077)
+        try:
+            listener = Listener(self.address, authkey=INFERENCE_AUTHKEY)
+        finally:
+            os.umask(old_umask)
+        with listener:
+            logger.info(f"[WORKER] Serving models on {self.address} (pid {os.getpid()})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # A client that fails the authkey handshake must not stop the worker
+                    logger.warning(f"[WORKER] Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+class InferenceClient:
+    """
+    Thread-safe client; one connection per UI process, many requests in
+    flight. A reader thread matches responses to waiting callers.
+    """
+
+    def __init__(self, address: str = INFERENCE_WORKER, timeout: float = REQUEST_TIMEOUT):
+        try:
+            self._conn = Client(_checked_address(address, INFERENCE_AUTHKEY), authkey=INFERENCE_AUTHKEY)
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+            raise InferenceWorkerError(f"Cannot reach inference worker at {address}: {e}") from e
+        self.address = address
+        self.timeout = timeout
+        self.closed = False
+        self._ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read, name="inference-client", daemon=True).start()
+        self.info = self.call("info")
+
+    def _read(self):
+        try:
+            while True:
+                req_id, ok, value = self._conn.recv()
+                future = self._pending.pop(req_id, None)
+                if future is None:
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(InferenceWorkerError(value))
+        except (EOFError, OSError) as e:
+            self.closed = True
+            for future in list(self._pending.values()):
+                future.set_exception(InferenceWorkerError(f"Inference worker connection lost: {e}"))
+            self._pending.clear()
+
+    def submit(self, op: str, *args) -> Future:
+        if self.closed:
+            raise InferenceWorkerError("Inference worker connection is closed")
+        future: Future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = future
+            try:
+                self._conn.send((req_id, op, args))
+            except (OSError, EOFError) as e:
+                self._pending.pop(req_id, None)
+                self.closed = True
+                raise InferenceWorkerError(f"Inference worker connection lost: {e}") from e
+        return future
+
+    def _result(self, future: Future):
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError as e:
+            raise InferenceWorkerError(f"Inference worker did not answer within {self.timeout}s") from e
+
+    def call(self, op: str, *args):
+        return self._result(self.submit(op, *args))
+
+    @staticmethod
+    def _payload(image):
+        if isinstance(image, ImageContext):
+            return image.data
+        return np.ascontiguousarray(image)
+
+    def detect_emotions(self, image) -> list:
+        return self.call("emotions", self._payload(image))
+
+    def detect_emotions_batch(self, images) -> list:
+        # Submitted together so the worker can batch them with other callers' requests
+        futures = [self.submit("emotions", self._payload(img)) for img in images]
+        return [self._result(future) for future in futures]
+
+    def detect_landmark(self, image, threshold: float, top_k: int) -> Optional[str]:
+        return self.call("landmark", self._payload(image), threshold, top_k)
+
+    def stats(self) -> dict:
+        return self.call("stats")
+
+
+_client: Optional[InferenceClient] = None
+_client_lock = threading.Lock()
+
+
+def get_inference_client() -> Optional[InferenceClient]:
+    """Shared client when INFERENCE_WORKER is set (reconnecting after a lost connection), else None"""
+    global _client
+    if not INFERENCE_WORKER:
+        return None
+    if _client is None or _client.closed:
+        with _client_lock:
+            if _client is None or _client.closed:
+                _client = InferenceClient(INFERENCE_WORKER)
+    return _client
+
+
+def remote_available() -> bool:
+    """Whether INFERENCE_WORKER is set and reachable; callers run models locally otherwise"""
+    if not INFERENCE_WORKER:
+        return False
+    try:
+        get_inference_client()
+        return True
+    except InferenceWorkerError as e:
+        logger.warning(f"[WORKER] {e}; running models in-process")
+        return False
+
+
+class RemoteEmotionDetector(EmotionDetector):
+    """
+    EmotionDetector whose inference runs in the shared worker; drawing stays
+    local. Backend and resolution mirror the worker's so result-cache keys
+    describe what actually ran. Worker failures raise InferenceWorkerError,
+    not an empty result, so they are not mistaken for "no faces".
+    """
+
+    def __init__(self):
+        info = get_inference_client().info
+        super().__init__(detector_backend=info["detector_backend"],
+                         resolution=ResolutionPolicy(**info["resolution"]))
+
+    def detect_emotions_batch(self, images):
+        return get_inference_client().detect_emotions_batch(images)
+
+
+def detect_landmark_remote(image, threshold: float, top_k: int) -> Optional[str]:
+    """detect_landmark through the worker; raises InferenceWorkerError when the worker fails"""
+    return get_inference_client().detect_landmark(image, threshold, top_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve emotion and landmark models to app processes")
+    parser.add_argument("--address", default=INFERENCE_WORKER or "/tmp/geoai-inference.sock",
+                        help="Unix socket path or host:port")
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+    try:
+        server = InferenceServer(args.address, args.window_ms, args.max_batch)
+    except InferenceWorkerError as e:
+        parser.error(str(e))
+    server.serve_forever()
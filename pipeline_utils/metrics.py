@@ -0,0 +1,263 @@
+# pipeline_utils/metrics.py
+"""
+Stage timing spans and counters for the detection pipeline.
+
+    METRICS=1 METRICS_PORT=9464 streamlit run app.py      # scrape http://host:9464/metrics
+    METRICS=1 METRICS_FILE=metrics.prom streamlit run app.py   # node_exporter textfile collector
+
+With METRICS unset, `span()` returns a shared no-op context manager and
+`inc()` returns immediately, so instrumented code pays one global lookup.
+
+Spans are recorded into a per-stage latency histogram and, when a trace is
+active in the current context, into that trace's stage breakdown (shown
+in the app sidebar). Work handed to a thread pool keeps the caller's trace
+when submitted through `submit()`.
+"""
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("METRICS", "0") == "1"
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Minimum seconds between rewrites of METRICS_FILE
+FILE_INTERVAL = float(os.environ.get("METRICS_FILE_INTERVAL", "5"))
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_HISTOGRAM = "pipeline_stage_seconds"
+REQUEST_HISTOGRAM = "pipeline_request_seconds"
+
+_NOOP = nullcontext()
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("pipeline_trace", default=None)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Trace:
+    """Stage breakdown of one request; spans from pool threads append here too"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None
+        self.spans: List[Tuple[str, float]] = []
+        self._token = None
+
+    def add(self, stage: str, seconds: float):
+        self.spans.append((stage, seconds))
+
+    def finish(self) -> "Trace":
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+            if self._token is not None:
+                _current_trace.reset(self._token)
+                self._token = None
+            _registry.observe(REQUEST_HISTOGRAM, self.total, (("trace", self.name),))
+            _registry.maybe_write_file()
+        return self
+
+    def breakdown(self) -> List[dict]:
+        """One row per stage (summed when a stage ran more than once), in first-seen order"""
+        totals: Dict[str, List[float]] = {}
+        for stage, seconds in self.spans:
+            totals.setdefault(stage, []).append(seconds)
+        rows = [{"stage": stage, "ms": round(sum(v) * 1000, 2), "calls": len(v)} for stage, v in totals.items()]
+        if self.total is not None:
+            rows.append({"stage": "total (wall)", "ms": round(self.total * 1000, 2), "calls": 1})
+        return rows
+
+
+class _NoopTrace(Trace):
+    def add(self, stage, seconds):
+        pass
+
+    def finish(self):
+        return self
+
+    def breakdown(self):
+        return []
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by (name, labels); rendered as Prometheus text"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], list] = {}
+        self._last_write = 0.0
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1.0):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, labels: Labels = ()):
+        with self._lock:
+            entry = self.histograms.get((name, labels))
+            if entry is None:
+                entry = self.histograms[(name, labels)] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4)"""
+        def fmt(labels: Labels, extra: Labels = ()) -> str:
+            pairs = labels + extra
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, bucket_count in zip(BUCKETS, buckets):
+                lines.append(f"{name}_bucket{fmt(labels, (('le', f'{bound:g}'),))} {bucket_count}")
+            lines.append(f"{name}_bucket{fmt(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def maybe_write_file(self):
+        if not METRICS_FILE:
+            return
+        now = time.monotonic()
+        if now - self._last_write < FILE_INTERVAL:
+            return
+        self._last_write = now
+        try:
+            self.write_file(METRICS_FILE)
+        except OSError as e:
+            logger.warning(f"[METRICS] Could not write {METRICS_FILE}: {e}")
+
+
+_registry = MetricsRegistry()
+_server: Optional[ThreadingHTTPServer] = None
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = _registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a daemon thread; at most one server per process"""
+    global _server, _server_failed
+    if not port or _server_failed:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                # e.g. a second Streamlit process on the same host; don't retry every request
+                logger.warning(f"[METRICS] Could not listen on port {port}: {e}")
+                _server_failed = True
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"[METRICS] Serving Prometheus metrics on :{port}/metrics")
+    return _server
+
+
+@contextmanager
+def _span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _registry.observe(STAGE_HISTOGRAM, seconds, (("stage", stage),))
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, seconds)
+
+
+def span(stage: str):
+    """Time a block as pipeline stage `stage`"""
+    if not ENABLED:
+        return _NOOP
+    return _span(stage)
+
+
+def timed(stage: str):
+    """Decorator form of `span()`; the check happens per call so METRICS can be toggled in tests"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """Increment counter `name` (conventionally ending in _total) with the given labels"""
+    if not ENABLED:
+        return
+    _registry.inc(name, tuple(sorted(labels.items())), value)
+
+
+def start_trace(name: str = "upload") -> Trace:
+    """Begin a request trace in the current context; call `finish()` on the result"""
+    if not ENABLED:
+        return _NoopTrace(name)
+    start_http_server()
+    trace = Trace(name)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+
+def submit(pool, fn, *args, **kwargs):
+    """`pool.submit` that carries the caller's trace into the worker thread"""
+    if not ENABLED:
+        return pool.submit(fn, *args, **kwargs)
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def render() -> str:
+    return _registry.render()
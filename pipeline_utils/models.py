@@ -0,0 +1,403 @@
+# pipeline_utils/models.py
+"""
+Lazy model registry with memory management.
+
+    python -m pipeline_utils.models [image]    # JSON latency + resident size report
+
+Models load on first use. Each model's resident size is recorded at load
+time. Two limits can bound memory per process:
+
+- MODEL_IDLE_SECONDS: models unused for longer than this are evicted by a
+  janitor thread.
+- MODEL_MEMORY_BUDGET_MB: least recently used models are evicted while
+  the loaded total is over budget.
+
+Evicted models reload transparently on the next `get()`. A process that
+forks workers can call `registry.preload()` first, so the weights are
+shared copy-on-write.
+"""
+import gc
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from pipeline_utils import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 0 disables idle eviction / the memory budget
+MODEL_IDLE_SECONDS = float(os.environ.get("MODEL_IDLE_SECONDS", "0"))
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+JANITOR_INTERVAL = float(os.environ.get("MODEL_JANITOR_INTERVAL", "30"))
+
+_MB = 1024 * 1024
+
+
+def _rss_bytes() -> Optional[int]:
+    """Current resident set size (Linux /proc); None elsewhere"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _collect_buffers(obj, out: Dict[int, int], depth: int = 0, _seen: Optional[Set[int]] = None):
+    """
+    Weight buffers reachable from `obj` as {storage key: nbytes}. Covers
+    torch modules/tensors, numpy arrays (memory-mapped ones are page cache,
+    not counted), Keras models and plain containers/attributes a few levels
+    deep. ONNX Runtime sessions are opaque; their size shows in the RSS delta.
+    """
+    _seen = _seen if _seen is not None else set()
+    if obj is None or depth > 4 or id(obj) in _seen or isinstance(obj, (str, bytes, int, float, type)):
+        return
+    _seen.add(id(obj))
+    module_type = type(obj).__module__ or ""
+    if module_type.startswith("torch"):
+        tensors = []
+        if hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+            tensors = list(obj.parameters()) + list(obj.buffers())
+        elif hasattr(obj, "untyped_storage"):
+            tensors = [obj]
+        for t in tensors:
+            storage = t.untyped_storage()
+            out[storage.data_ptr()] = storage.nbytes()
+        if tensors:
+            return
+    if isinstance(obj, np.ndarray):
+        if not isinstance(obj, np.memmap):
+            base = obj.base if isinstance(obj.base, np.ndarray) else obj
+            out[id(base)] = base.nbytes
+        return
+    if hasattr(obj, "weights") and hasattr(obj, "count_params"):
+        # Keras model
+        for w in obj.weights:
+            out[id(w)] = int(np.prod(w.shape)) * w.dtype.size
+        return
+    if type(obj).__name__ == "module" or module_type.startswith(("onnxruntime", "tensorflow", "keras")):
+        return
+    if isinstance(obj, dict):
+        children = list(obj.values())
+    elif isinstance(obj, (list, tuple, set)):
+        children = list(obj)
+    else:
+        children = list(getattr(obj, "__dict__", {}).values())
+    for child in children:
+        _collect_buffers(child, out, depth + 1, _seen)
+
+
+class ModelRegistry:
+    """
+    Process-wide lazy model holder. Modules register a loader per model at
+    import time; the model is only built on first `get()` (or by a
+    background warm-up), exactly once even under concurrent sessions.
+
+    Models a loader fetches through `get()` are recorded as its
+    dependencies: their weights are not counted twice, and they are not
+    evicted while a dependent (which still references them) is loaded.
+    """
+
+    def __init__(self, idle_seconds: float = MODEL_IDLE_SECONDS, budget_mb: float = MODEL_MEMORY_BUDGET_MB):
+        self._loaders: Dict[str, Callable] = {}
+        self._warm: Dict[str, bool] = {}
+        self._evictable: Dict[str, bool] = {}
+        self._on_evict: Dict[str, Callable] = {}
+        self._models: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._last_used: Dict[str, float] = {}
+        self._buffers: Dict[str, Dict[int, int]] = {}
+        self._rss_delta: Dict[str, int] = {}
+        self._deps: Dict[str, Set[str]] = {}
+        self._loads: Dict[str, int] = {}
+        self._loading = threading.local()
+        self._registry_lock = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._janitor_thread: Optional[threading.Thread] = None
+        self.idle_seconds = idle_seconds
+        self.budget_bytes = int(budget_mb * _MB)
+
+    def register(self, name: str, loader: Callable, warm: bool = True, evictable: bool = True,
+                 on_evict: Optional[Callable] = None):
+        """
+        `warm=False` keeps the model out of warm-up; it still loads on first
+        `get()`. `evictable=False` exempts it from idle/budget eviction (for
+        entries whose memory would not be released, e.g. an imported module).
+        `on_evict()` drops references the loader's library keeps elsewhere.
+        """
+        with self._registry_lock:
+            self._loaders[name] = loader
+            self._warm[name] = warm
+            self._evictable[name] = evictable
+            if on_evict is not None:
+                self._on_evict[name] = on_evict
+            self._locks.setdefault(name, threading.Lock())
+
+    def names(self):
+        return list(self._loaders)
+
+    def warm_names(self):
+        return [name for name in self._loaders if self._warm.get(name, True)]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def get(self, name: str):
+        stack = getattr(self._loading, "stack", None)
+        if stack:
+            self._deps.setdefault(stack[-1], set()).add(name)
+        model = self._models.get(name)
+        if model is not None:
+            self._last_used[name] = time.monotonic()
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        with self._locks[name]:
+            if name not in self._models:
+                self._load(name)
+            model = self._models[name]
+        self._last_used[name] = time.monotonic()
+        self._enforce_budget(keep=name)
+        return model
+
+    def _load(self, name: str):
+        logger.info(f"[MODELS] Loading {name}...")
+        stack = self._loading.__dict__.setdefault("stack", [])
+        stack.append(name)
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        try:
+            model = self._loaders[name]()
+        finally:
+            stack.pop()
+        self._load_seconds[name] = time.perf_counter() - start
+        rss_after = _rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            self._rss_delta[name] = max(0, rss_after - rss_before)
+        buffers: Dict[int, int] = {}
+        try:
+            _collect_buffers(model, buffers)
+        except Exception as e:
+            logger.warning(f"[MODELS] Could not size {name}: {e}")
+        self._buffers[name] = buffers
+        self._models[name] = model
+        self._loads[name] = self._loads.get(name, 0) + 1
+        metrics.inc("model_loads_total", model=name)
+        logger.info(f"[MODELS] Loaded {name} in {self._load_seconds[name]:.2f}s "
+                    f"({self.resident_bytes(name) / _MB:.1f} MB)")
+
+    def unload(self, name: str):
+        with self._locks.get(name, self._registry_lock):
+            self._models.pop(name, None)
+            self._buffers.pop(name, None)
+            self._last_used.pop(name, None)
+
+    # --- memory accounting and eviction ---
+
+    def resident_bytes(self, name: str) -> int:
+        """
+        Bytes held by a loaded model: its weight buffers minus those shared
+        with its dependencies. Falls back to the RSS growth during its load
+        when no buffers could be found (e.g. ONNX Runtime sessions).
+        """
+        if name not in self._models:
+            return 0
+        shared = set()
+        for dep in self._deps.get(name, ()):
+            shared.update(self._buffers.get(dep, {}))
+        own = sum(nbytes for key, nbytes in self._buffers.get(name, {}).items() if key not in shared)
+        if own < _MB:
+            # Opaque runtimes (ONNX Runtime, TensorFlow graphs) hold weights we can't walk
+            own = max(own, self._rss_delta.get(name, 0))
+        return own
+
+    def total_resident_bytes(self) -> int:
+        return sum(self.resident_bytes(name) for name in list(self._models))
+
+    def _dependents(self, name: str) -> List[str]:
+        return [other for other, deps in self._deps.items() if name in deps and other in self._models]
+
+    def _evictable_names(self, exclude: Optional[str] = None) -> List[str]:
+        """Loaded, evictable models without loaded dependents, least recently used first"""
+        names = [name for name in list(self._models)
+                 if name != exclude and self._evictable.get(name, True) and not self._dependents(name)]
+        return sorted(names, key=lambda n: self._last_used.get(n, 0.0))
+
+    def evict(self, name: str, reason: str = "manual") -> bool:
+        if name not in self._models:
+            return False
+        size = self.resident_bytes(name)
+        self.unload(name)
+        if name in self._on_evict:
+            try:
+                self._on_evict[name]()
+            except Exception as e:
+                logger.warning(f"[MODELS] on_evict for {name} failed: {e}")
+        # Weights are freed once in-flight callers drop their references
+        gc.collect()
+        metrics.inc("model_evictions_total", model=name, reason=reason)
+        logger.info(f"[MODELS] Evicted {name} ({reason}, {size / _MB:.1f} MB)")
+        return True
+
+    def evict_idle(self, idle_seconds: Optional[float] = None) -> List[str]:
+        """Evict models unused for `idle_seconds` (MODEL_IDLE_SECONDS by default)"""
+        idle_seconds = self.idle_seconds if idle_seconds is None else idle_seconds
+        if idle_seconds <= 0:
+            return []
+        evicted = []
+        # Repeat so a dependency becomes evictable once its idle dependents are gone
+        while True:
+            now = time.monotonic()
+            stale = [n for n in self._evictable_names() if now - self._last_used.get(n, now) >= idle_seconds]
+            if not stale:
+                return evicted
+            for name in stale:
+                if self.evict(name, "idle"):
+                    evicted.append(name)
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        if self.budget_bytes <= 0:
+            return
+        while self.total_resident_bytes() > self.budget_bytes:
+            candidates = self._evictable_names(exclude=keep)
+            if not candidates:
+                logger.warning(f"[MODELS] {self.total_resident_bytes() / _MB:.0f} MB resident exceeds the "
+                               f"{self.budget_bytes / _MB:.0f} MB budget but nothing else can be evicted")
+                return
+            self.evict(candidates[0], "budget")
+
+    def start_janitor(self, interval: float = JANITOR_INTERVAL) -> Optional[threading.Thread]:
+        """Background idle eviction; a no-op unless an idle timeout is configured"""
+        if self.idle_seconds <= 0:
+            return None
+        with self._registry_lock:
+            if self._janitor_thread is None:
+                def _run():
+                    while True:
+                        time.sleep(interval)
+                        try:
+                            self.evict_idle()
+                        except Exception as e:
+                            logger.warning(f"[MODELS] Idle eviction failed: {e}")
+
+                self._janitor_thread = threading.Thread(target=_run, name="model-janitor", daemon=True)
+                self._janitor_thread.start()
+        return self._janitor_thread
+
+    def preload(self, names: Optional[Iterable[str]] = None):
+        """
+        Load models synchronously, then move every live object into the GC's
+        permanent generation. Call this before forking workers: collections
+        in the children then never write to these objects' pages, so the
+        weights stay shared copy-on-write instead of being copied per worker.
+        """
+        for name in (list(names) if names is not None else self.warm_names()):
+            self.get(name)
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> threading.Thread:
+        """Load models on a daemon thread; repeated calls reuse the running/finished thread"""
+        with self._registry_lock:
+            if self._warmup_thread is None:
+                targets = list(names) if names is not None else self.warm_names()
+
+                def _run():
+                    for name in targets:
+                        try:
+                            self.get(name)
+                        except Exception as e:
+                            logger.warning(f"[MODELS] Warm-up of {name} failed: {e}")
+
+                self._warmup_thread = threading.Thread(target=_run, name="model-warmup", daemon=True)
+                self._warmup_thread.start()
+        return self._warmup_thread
+
+    def report(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "loaded": self.is_loaded(name),
+                "load_seconds": round(self._load_seconds.get(name, 0.0), 3),
+                "resident_mb": round(self.resident_bytes(name) / _MB, 1),
+                "rss_delta_mb": round(self._rss_delta.get(name, 0) / _MB, 1),
+                "idle_seconds": round(now - self._last_used[name], 1) if name in self._last_used else None,
+                "loads": self._loads.get(name, 0),
+            }
+            for name in self.names()
+        }
+
+
+registry = ModelRegistry()
+
+
+def _time_imports(modules):
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings[module] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+def latency_report(image_path: Optional[str] = None) -> dict:
+    """
+    Import-time and first-request latency of the pipeline, measured in this
+    (fresh) process. Imports should be fast because no model loads until a
+    stage needs it; the first-request numbers show what that deferral costs.
+    """
+    report = {"imports_s": _time_imports([
+        "emotion_utils.detector",
+        "location_utils.extract_gps",
+        "location_utils.geocoder",
+        "location_utils.landmark",
+        "pipeline_utils.pipeline",
+    ])}
+    report["models_loaded_after_import"] = [n for n in registry.names() if registry.is_loaded(n)]
+
+    from emotion_utils.detector import EmotionDetector
+    from location_utils.extract_gps import extract_gps
+    from location_utils.landmark import detect_landmark
+    from pipeline_utils.image_context import ImageContext
+
+    if image_path:
+        ctx = ImageContext.from_path(image_path)
+    else:
+        import io
+        import numpy as np
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.fromarray(np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)).save(buf, "JPEG")
+        ctx = ImageContext.from_bytes(buf.getvalue(), "synthetic.jpg")
+
+    first = {}
+    for stage, call in (
+        ("extract_gps", lambda: extract_gps(ctx)),
+        ("detect_emotions", lambda: EmotionDetector().detect_emotions(ctx)),
+        ("detect_landmark", lambda: detect_landmark(ctx)),
+    ):
+        start = time.perf_counter()
+        call()
+        first[stage] = round(time.perf_counter() - start, 3)
+    report["first_request_s"] = first
+    models = registry.report()
+    report["model_load_s"] = {name: info["load_seconds"] for name, info in models.items()}
+    report["model_resident_mb"] = {name: info["resident_mb"] for name, info in models.items()}
+    report["process_rss_mb"] = round((_rss_bytes() or 0) / _MB, 1)
+    return report
+
+
+if __name__ == "__main__":
+    # python -m pipeline_utils.models [image]  ->  JSON latency and memory report
+    print(json.dumps(latency_report(sys.argv[1] if len(sys.argv) > 1 else None), indent=2))
@@ -0,0 +1,234 @@
+# pipeline_utils/pipeline.py
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from location_utils import geocoder
+from location_utils.extract_gps import extract_gps, convert_gps
+from location_utils.geocoder import get_address_from_coords
+from location_utils.clip_onnx import CLIP_ENGINE
+from location_utils.landmark import CLIP_MODEL_NAME, detect_landmark, get_catalogue, query_landmark_coords
+from pipeline_utils import metrics
+from pipeline_utils.image_context import ImageContext
+from pipeline_utils.inference_worker import InferenceWorkerError, detect_landmark_remote, remote_available
+from pipeline_utils.result_cache import TRANSIENT_LOCATIONS, get_result_cache, result_key
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LANDMARK_THRESHOLD = 0.15
+LANDMARK_TOP_K = 5
+
+# Run the emotion and location branches of one upload side by side
+PIPELINE_CONCURRENT = os.environ.get("PIPELINE_CONCURRENT", "1") == "1"
+PIPELINE_THREADS = int(os.environ.get("PIPELINE_THREADS", "4"))
+# Start CLIP while the GPS reverse geocode is in flight (costs CPU when GPS wins)
+SPECULATIVE_LANDMARK = os.environ.get("SPECULATIVE_LANDMARK", "1") == "1"
+
+UNRESOLVED_ADDRESSES = ("Unknown location", "Invalid coordinates", "Geocoding service unavailable")
+
+
+@metrics.timed("exif")
+def _gps_coords(ctx: ImageContext):
+    gps_info = extract_gps(ctx)
+    if not gps_info:
+        return None
+    logger.info(f"[PIPELINE] GPS extraction successful: {list(gps_info.keys())}")
+    coords = convert_gps(gps_info)
+    if coords:
+        logger.info(f"[PIPELINE] GPS coordinates: {coords}")
+    else:
+        logger.info("[PIPELINE] No GPS data found in image")
+    return coords
+
+
+def _landmark_location(ctx: ImageContext, threshold: float, top_k: int,
+                       cancelled: Optional[threading.Event] = None) -> Optional[dict]:
+    """
+    CLIP landmark branch. Returns the fields it resolved, or None if
+    `cancelled` was set before it got to its network calls.
+    """
+    logger.info("[PIPELINE] Trying landmark detection...")
+    if remote_available():
+        try:
+            with metrics.span("clip"):
+                landmark = detect_landmark_remote(ctx, threshold, top_k)
+        except InferenceWorkerError as e:
+            logger.warning(f"[PIPELINE] Remote landmark detection failed: {e}")
+            return {"landmark_status": "not_detected", "failed_stages": ["landmark"]}
+    else:
+        landmark = detect_landmark(ctx, threshold=threshold, top_k=top_k)
+    if not landmark:
+        logger.info("[PIPELINE] No landmark detected with sufficient confidence")
+        return {"landmark_status": "not_detected"}
+
+    logger.info(f"[PIPELINE] CLIP predicted landmark: {landmark}")
+    if cancelled is not None and cancelled.is_set():
+        return None
+    coords_result, source = query_landmark_coords(landmark)
+    if not coords_result:
+        logger.info(f"[PIPELINE] No coordinates found for landmark: {landmark}")
+        return {"landmark": landmark, "landmark_status": "no_coords"}
+
+    lat, lon = coords_result
+    logger.info(f"[PIPELINE] Landmark coordinates: {lat}, {lon} (source: {source})")
+    if cancelled is not None and cancelled.is_set():
+        return None
+    addr = get_address_from_coords((lat, lon))
+    failed_stages = []
+    if addr and addr not in UNRESOLVED_ADDRESSES:
+        location = addr
+    else:
+        if addr in TRANSIENT_LOCATIONS:
+            # The name-only fallback stands in for an address we may get next time; not cacheable
+            failed_stages.append("geocode")
+        landmark_info = get_catalogue().get(landmark)
+        if landmark_info:
+            location = f"{landmark_info['name']}, {landmark_info['city']}"
+        else:
+            location = f"{landmark.title()} ({lat:.4f}, {lon:.4f})"
+        metrics.inc("pipeline_fallbacks_total", kind="landmark_address")
+        logger.info(f"[PIPELINE] Using landmark fallback: {location}")
+    logger.info(f"[PIPELINE] Final location: {location}")
+    return {"landmark": landmark, "landmark_status": "matched", "coords": (lat, lon),
+            "method": f"Landmark ({source})", "location": location, "failed_stages": failed_stages}
+
+
+def resolve_location(ctx: ImageContext, threshold: float = LANDMARK_THRESHOLD,
+                     top_k: int = LANDMARK_TOP_K, pool: Optional[ThreadPoolExecutor] = None) -> dict:
+    """
+    GPS EXIF first, CLIP landmark fallback second.
+
+    With a `pool`, the CLIP branch starts speculatively while the GPS
+    reverse geocode is still in flight and is discarded if GPS resolves.
+
+    `landmark_status` is None when the landmark fallback was not needed,
+    otherwise one of "matched", "no_coords" or "not_detected".
+    """
+    result = {"location": "Unknown", "method": "", "coords": None,
+              "landmark": None, "landmark_status": None}
+
+    coords = _gps_coords(ctx)
+    speculative, cancelled = None, threading.Event()
+    if coords:
+        if pool is not None and SPECULATIVE_LANDMARK:
+            speculative = metrics.submit(pool, _landmark_location, ctx, threshold, top_k, cancelled)
+        result["coords"] = coords
+        result["location"] = get_address_from_coords(coords)
+        result["method"] = "GPS Metadata"
+
+    if result["location"] not in ("Unknown", "Unknown location"):
+        if speculative is not None:
+            cancelled.set()
+            if not speculative.cancel():
+                logger.info("[PIPELINE] GPS resolved; discarding speculative landmark branch")
+        return result
+
+    metrics.inc("pipeline_fallbacks_total", kind="landmark")
+    landmark = speculative.result() if speculative is not None else None
+    if landmark is None:
+        landmark = _landmark_location(ctx, threshold, top_k)
+    result.update(landmark)
+    return result
+
+
+def _detect_emotions(detector, ctx: ImageContext) -> dict:
+    """Emotion branch; a failed inference worker shows up in `failed_stages`, not as an empty result"""
+    with metrics.span("emotion"):
+        try:
+            return {"detections": detector.detect_emotions(ctx), "failed_stages": []}
+        except InferenceWorkerError as e:
+            logger.warning(f"[PIPELINE] Remote emotion detection failed: {e}")
+            return {"detections": [], "failed_stages": ["emotion"]}
+
+
+def _merge(location: dict, emotions: dict) -> dict:
+    return dict(location, detections=emotions["detections"],
+                failed_stages=emotions["failed_stages"] + location.get("failed_stages", []))
+
+
+class PipelineExecutor:
+    """
+    Runs the emotion branch and the location branch of an upload in
+    parallel on a shared thread pool, so wall-clock latency tracks the
+    slowest branch instead of the sum of all stages.
+    """
+
+    def __init__(self, threads: int = PIPELINE_THREADS):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="pipeline")
+
+    def run(self, ctx: ImageContext, detector, threshold: float = LANDMARK_THRESHOLD,
+            top_k: int = LANDMARK_TOP_K) -> dict:
+        # Decode once up front so the branches don't race to decode the same bytes
+        with metrics.span("decode"):
+            _ = ctx.rgb
+        emotions = metrics.submit(self.pool, _detect_emotions, detector, ctx)
+        # The location branch runs on this thread; it hands CLIP to the pool when speculating
+        try:
+            result = resolve_location(ctx, threshold=threshold, top_k=top_k, pool=self.pool)
+        finally:
+            emotion_result = emotions.result()
+        return _merge(result, emotion_result)
+
+
+_executor: Optional[PipelineExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> PipelineExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = PipelineExecutor()
+    return _executor
+
+
+def pipeline_settings(detector, threshold: float, top_k: int) -> dict:
+    """Every knob that changes a pipeline result; part of the result-cache key"""
+    return {
+        "detector_backend": getattr(detector, "detector_backend", "opencv"),
+        "resolution": dict(vars(detector.resolution)) if hasattr(detector, "resolution") else None,
+        "clip_model": CLIP_MODEL_NAME,
+        "clip_engine": CLIP_ENGINE,
+        # Content, not path: editing the catalogue in place must not serve stale landmarks
+        "catalogue": get_catalogue().digest,
+        "threshold": threshold,
+        "top_k": top_k,
+        "geocoder_mode": geocoder.GEOCODER_MODE,
+    }
+
+
+def run_pipeline(ctx: ImageContext, detector, threshold: float = LANDMARK_THRESHOLD,
+                 top_k: int = LANDMARK_TOP_K, use_cache: bool = True) -> dict:
+    """
+    Emotion detection plus location resolution for one image. Results are
+    cached by image content + settings, so re-uploads skip every model.
+    """
+    cache = get_result_cache() if use_cache else None
+    key = None
+    if cache is not None:
+        key = result_key(ctx.sha256, pipeline_settings(detector, threshold, top_k))
+        cached = cache.get(key)
+        metrics.inc("result_cache_requests_total", outcome="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.info(f"[PIPELINE] Result cache hit for {ctx.name or ctx.sha256[:12]}")
+            return dict(cached, cached=True)
+
+    if PIPELINE_CONCURRENT:
+        result = get_executor().run(ctx, detector, threshold, top_k)
+    else:
+        with metrics.span("decode"):
+            _ = ctx.rgb
+        emotion_result = _detect_emotions(detector, ctx)
+        result = _merge(resolve_location(ctx, threshold=threshold, top_k=top_k), emotion_result)
+    if result["failed_stages"]:
+        # A worker or geocoder outage is not a property of the image; don't cache it
+        logger.info(f"[PIPELINE] Not caching result, failed stages: {result['failed_stages']}")
+        metrics.inc("pipeline_failed_stages_total", stages=",".join(result["failed_stages"]))
+    elif cache is not None:
+        cache.put(key, result)
+    return dict(result, cached=False)
@@ -0,0 +1,218 @@
+# pipeline_utils/render.py
+"""
+Display rendering for uploads.
+
+Boxes are drawn on a display-sized copy instead of the full-resolution
+frame, and the browser receives compressed previews rather than raw
+arrays. The original preview, the annotated preview and an annotated
+thumbnail are cached on disk by image content hash, so reruns and the
+history tab reuse them without decoding or encoding the upload again.
+"""
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from typing import List, Optional
+
+import cv2
+from PIL import Image
+
+from pipeline_utils.image_context import ImageContext
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DISPLAY_MAX_SIDE = int(os.environ.get("DISPLAY_MAX_SIDE", "1024"))
+THUMB_SIDE = int(os.environ.get("THUMB_SIDE", "160"))
+PREVIEW_FORMAT = os.environ.get("PREVIEW_FORMAT", "webp").lower()
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "80"))
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(".cache", "render"))
+RENDER_CACHE_MAX_FILES = int(os.environ.get("RENDER_CACHE_MAX_FILES", "20000"))
+
+
+def _webp_available() -> bool:
+    from PIL import features
+    return features.check("webp")
+
+
+def preview_format() -> str:
+    """PREVIEW_FORMAT, falling back to JPEG when Pillow was built without WebP"""
+    if PREVIEW_FORMAT == "webp" and _webp_available():
+        return "webp"
+    return "jpeg"
+
+
+def encode_image(rgb, fmt: Optional[str] = None, quality: int = PREVIEW_QUALITY) -> bytes:
+    fmt = fmt or preview_format()
+    buf = io.BytesIO()
+    Image.fromarray(rgb).save(buf, "WEBP" if fmt == "webp" else "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def scale_detections(detections: List[dict], scale: float) -> List[dict]:
+    """Detections with boxes mapped into a view resized by `scale`"""
+    if scale == 1:
+        return detections
+    return [dict(det, **{k: int(round(det[k] * scale)) for k in ("x", "y", "w", "h")}) for det in detections]
+
+
+def detections_digest(detections: List[dict]) -> str:
+    payload = json.dumps([[d["emotion"], d["confidence"], d["x"], d["y"], d["w"], d["h"]] for d in detections])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+class RenderCache:
+    """Encoded images on disk named by content hash; oldest files are evicted past `max_files`"""
+
+    def __init__(self, root: str = RENDER_CACHE_DIR, max_files: int = RENDER_CACHE_MAX_FILES):
+        self.root = root
+        self.max_files = max_files
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, name: str, data: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._puts += 1
+            check = self._puts % 256 == 0
+        if check:
+            self._evict()
+
+    def _evict(self):
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        excess = len(files) - self.max_files
+        if excess <= 0:
+            return
+        for _, path in sorted(files)[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        logger.info(f"[RENDER] Evicted {excess} cached renders")
+
+
+class Rendered:
+    """Encoded outputs for one upload"""
+
+    def __init__(self, preview: bytes, annotated: bytes, thumbnail: bytes, fmt: str):
+        self.preview = preview
+        self.annotated = annotated
+        self.thumbnail = thumbnail
+        self.format = fmt
+
+    @property
+    def mime(self) -> str:
+        return f"image/{self.format}"
+
+
+class Renderer:
+    def __init__(self, cache: Optional[RenderCache] = None, max_side: int = DISPLAY_MAX_SIDE,
+                 thumb_side: int = THUMB_SIDE):
+        self.cache = cache
+        self.max_side = max_side
+        self.thumb_side = thumb_side
+
+    def render(self, ctx: ImageContext, detections: List[dict], draw) -> Rendered:
+        """
+        `draw(bgr, detections)` draws boxes (EmotionDetector.draw_detections).
+        Everything is derived from one display-sized view of the upload.
+        """
+        fmt = preview_format()
+        sha = ctx.sha256
+        names = {
+            "preview": f"{sha}-preview-{self.max_side}.{fmt}",
+            "annotated": f"{sha}-annotated-{self.max_side}-{detections_digest(detections)}.{fmt}",
+            "thumbnail": thumbnail_name(sha, fmt),
+        }
+        cached = {k: self.cache.get(v) for k, v in names.items()} if self.cache else {}
+        if cached and all(cached.get(k) for k in ("preview", "annotated")):
+            return Rendered(cached["preview"], cached["annotated"], cached.get("thumbnail") or b"", fmt)
+
+        view = ctx.downscaled(self.max_side)
+        width, _ = ctx.size
+        scale = view.shape[1] / width
+        annotated = cv2.cvtColor(draw(cv2.cvtColor(view, cv2.COLOR_RGB2BGR), scale_detections(detections, scale)),
+                                 cv2.COLOR_BGR2RGB)
+        thumb_scale = self.thumb_side / max(annotated.shape[:2])
+        thumb = annotated if thumb_scale >= 1 else cv2.resize(
+            annotated, (max(1, round(annotated.shape[1] * thumb_scale)), max(1, round(annotated.shape[0] * thumb_scale))),
+            interpolation=cv2.INTER_AREA)
+
+        rendered = Rendered(
+            cached.get("preview") or encode_image(view, fmt),
+            encode_image(annotated, fmt),
+            encode_image(thumb, fmt, quality=70),
+            fmt,
+        )
+        if self.cache is not None:
+            try:
+                self.cache.put(names["preview"], rendered.preview)
+                self.cache.put(names["annotated"], rendered.annotated)
+                self.cache.put(names["thumbnail"], rendered.thumbnail)
+            except OSError as e:
+                logger.warning(f"[RENDER] Could not cache renders for {sha[:12]}: {e}")
+        return rendered
+
+
+def thumbnail_name(sha: str, fmt: Optional[str] = None) -> str:
+    return f"{sha}-thumb.{fmt or preview_format()}"
+
+
+_renderer: Optional[Renderer] = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> Renderer:
+    """Process-wide renderer; the disk cache is disabled with RENDER_CACHE_DIR=''"""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                cache = None
+                if RENDER_CACHE_DIR:
+                    try:
+                        cache = RenderCache(RENDER_CACHE_DIR)
+                    except OSError as e:
+                        logger.warning(f"[RENDER] Disk cache disabled, failed to open {RENDER_CACHE_DIR}: {e}")
+                _renderer = Renderer(cache)
+    return _renderer
+
+
+def thumbnail_data_uri(sha: Optional[str]) -> Optional[str]:
+    """Cached annotated thumbnail of an upload as a data: URI (for st.column_config.ImageColumn)"""
+    renderer = get_renderer()
+    if not sha or renderer.cache is None:
+        return None
+    fmt = preview_format()
+    data = renderer.cache.get(thumbnail_name(sha, fmt))
+    if not data:
+        return None
+    return f"data:image/{fmt};base64,{base64.b64encode(data).decode('ascii')}"
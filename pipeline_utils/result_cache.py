@@ -0,0 +1,158 @@
+# pipeline_utils/result_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(".cache", "results.sqlite"))
+MEMORY_ITEMS = int(os.environ.get("RESULT_CACHE_MEMORY_ITEMS", "256"))
+DISK_ITEMS = int(os.environ.get("RESULT_CACHE_DISK_ITEMS", "50000"))
+# Seconds a connection waits on another process's write lock before giving up
+BUSY_TIMEOUT = float(os.environ.get("RESULT_CACHE_BUSY_TIMEOUT", "30"))
+# Bump when the stored result layout or pipeline semantics change
+RESULT_CACHE_VERSION = 1
+
+# Results containing these locations are transient failures and are not cached
+TRANSIENT_LOCATIONS = ("Geocoding service unavailable",)
+
+
+def result_key(image_sha256: str, settings: dict) -> str:
+    """Content address: image hash plus every setting that can change the result"""
+    payload = json.dumps({"v": RESULT_CACHE_VERSION, "image": image_sha256, "settings": settings},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _json_default(value):
+    # numpy scalars coming out of the detectors
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+class ResultCache:
+    """
+    Two-tier cache of full pipeline results: a bounded in-memory LRU in
+    front of a SQLite table that survives restarts and is shared by every
+    process on the host.
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, memory_items: int = MEMORY_ITEMS,
+                 disk_items: int = DISK_ITEMS):
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                     timeout=BUSY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                   key TEXT PRIMARY KEY,
+                   value TEXT NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)")
+
+    def _remember(self, key: str, result: dict):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+            # The cache is an optimization: a locked or corrupt database is a miss, not an error
+            try:
+                row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                result = json.loads(row[0]) if row is not None else None
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning(f"[RESULT CACHE] Lookup failed, treating as a miss: {e}")
+                result = None
+            if result is None:
+                self.misses += 1
+                return None
+            try:
+                self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            except sqlite3.Error as e:
+                # Only the LRU order suffers
+                logger.warning(f"[RESULT CACHE] Failed to update last access: {e}")
+            if result.get("coords") is not None:
+                result["coords"] = tuple(result["coords"])
+            self._remember(key, result)
+            self.disk_hits += 1
+            return result
+
+    def put(self, key: str, result: dict):
+        if result.get("location") in TRANSIENT_LOCATIONS or result.get("failed_stages"):
+            return
+        value = json.dumps(result, default=_json_default, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, result)
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, last_access) VALUES (?, ?, ?)",
+                    (key, value, time.time()),
+                )
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= max(1, self.disk_items // 100):
+                    self._writes_since_evict = 0
+                    self._evict()
+            except sqlite3.Error as e:
+                logger.warning(f"[RESULT CACHE] Write failed, result kept in memory only: {e}")
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        overflow = count - self.disk_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            logger.info(f"[RESULT CACHE] Evicted {overflow} least recently used results")
+
+    def stats(self) -> dict:
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "memory_items": len(self._memory)}
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Process-wide result cache; None when disabled with RESULT_CACHE_PATH=''"""
+    global _cache
+    if not RESULT_CACHE_PATH:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = ResultCache()
+                except Exception as e:
+                    logger.warning(f"[RESULT CACHE] Disabled, failed to open {RESULT_CACHE_PATH}: {e}")
+                    return None
+    return _cache
@@ -0,0 +1,54 @@
+import io
+
+import pytest
+from PIL import Image
+
+from location_utils.exif_fast import ExifFormatError, read_gps, read_gps_info
+from location_utils.extract_gps import convert_gps, gps_from_image
+
+GPS_IFD = {1: "N", 2: (48.0, 51.0, 29.16), 3: "W", 4: (2.0, 17.0, 40.2), 6: 123.5}
+
+
+def _encode(fmt="JPEG", gps=None):
+    buf = io.BytesIO()
+    exif = Image.Exif()
+    if gps is not None:
+        exif[0x8825] = gps
+    Image.new("RGB", (32, 16)).save(buf, fmt, exif=exif)
+    return buf.getvalue()
+
+
+def test_jpeg_fast_path_matches_pil():
+    data = _encode(gps=GPS_IFD)
+    fast = read_gps_info(data)
+    reference = gps_from_image(Image.open(io.BytesIO(data)))
+    # The fast path only decodes the position tags
+    assert set(fast) == {"GPSLatitudeRef", "GPSLatitude", "GPSLongitudeRef", "GPSLongitude"}
+    for key, value in fast.items():
+        if isinstance(value, tuple):
+            assert value == pytest.approx(tuple(float(v) for v in reference[key]))
+        else:
+            assert value == reference[key]
+    assert convert_gps(fast) == convert_gps(reference)
+
+
+def test_read_gps_applies_hemisphere_refs():
+    assert read_gps(_encode(gps=GPS_IFD)) == (48.8581, -2.2945)
+
+
+def test_path_and_buffer_agree(tmp_path):
+    path = tmp_path / "photo.jpg"
+    data = _encode(gps=GPS_IFD)
+    path.write_bytes(data)
+    assert read_gps_info(str(path)) == read_gps_info(data)
+
+
+def test_jpeg_without_gps():
+    assert read_gps_info(_encode()) is None
+    assert read_gps(_encode()) is None
+
+
+def test_other_containers_are_rejected():
+    with pytest.raises(ExifFormatError):
+        read_gps_info(_encode("PNG"))
+    assert read_gps(_encode("PNG")) is None
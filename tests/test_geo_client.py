@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestServer
+
+from location_utils import geo_client
+from location_utils.geo_client import GeoClient, GeoServiceError
+from location_utils.geo_stub import make_app
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Retries sleep `delay + uniform(0, delay / 2)`; cancel the delay out so each backoff is 10 ms"""
+    monkeypatch.setattr(geo_client.random, "uniform", lambda low, high: 0.01 - 2 * high)
+
+
+def _run(app, scenario, **client_kwargs):
+    """Serve `app` on a local port and run `scenario(client, base_url)` against it"""
+    async def main():
+        server = TestServer(app)
+        await server.start_server()
+        base = str(server.make_url("")).rstrip("/")
+        client = GeoClient(nominatim_url=base, overpass_url=f"{base}/api/interpreter",
+                           nominatim_rate=1000, overpass_rate=1000, **client_kwargs)
+        try:
+            return await scenario(client, base)
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_identical_lookups_share_one_request():
+    async def scenario(client, _base):
+        return await asyncio.gather(*[client.reverse(3.139, 101.6869) for _ in range(5)]), client.stats()
+
+    results, stats = _run(make_app(latency=0.1), scenario)
+    assert len(set(results)) == 1 and results[0].startswith("Kuala Lumpur")
+    assert stats["requests"] == 1
+    assert stats["coalesced"] == 4
+
+
+def test_distinct_lookups_are_not_coalesced():
+    async def scenario(client, _base):
+        await asyncio.gather(client.reverse(3.139, 101.6869), client.reverse(2.9264, 101.6964))
+        return client.stats()
+
+    assert _run(make_app(latency=0.05), scenario)["coalesced"] == 0
+
+
+def test_service_unavailable_is_retried():
+    async def scenario(client, _base):
+        first = await client.reverse(3.139, 101.6869)
+        # The stub answers every second request with a 503
+        second = await client.reverse(2.9264, 101.6964)
+        return first, second, client.stats()
+
+    first, second, stats = _run(make_app(fail_every=2), scenario)
+    assert first and second
+    assert stats["retries"] == 1
+    assert stats["requests"] == 3
+
+
+def test_retries_give_up_with_geo_service_error():
+    async def scenario(client, _base):
+        with pytest.raises(GeoServiceError):
+            await client.reverse(3.139, 101.6869)
+        return client.stats()
+
+    stats = _run(make_app(fail_every=1), scenario, max_retries=2)
+    assert stats["requests"] == 2
+
+
+def test_client_errors_are_not_retried():
+    async def scenario(client, base):
+        client.nominatim_url = f"{base}/missing"
+        with pytest.raises(GeoServiceError, match="404"):
+            await client.reverse(3.139, 101.6869)
+        return client.stats()
+
+    stats = _run(make_app(), scenario)
+    assert stats["requests"] == 1
+    assert stats["retries"] == 0
+
+
+def test_overpass_query():
+    from location_utils.poi_index import overpass_name_regex
+
+    query = f'[out:json];node["name"~"{overpass_name_regex("Petronas")}",i];out center tags 50;'
+
+    async def scenario(client, _base):
+        return await client.overpass(query)
+
+    elements = _run(make_app(), scenario)["elements"]
+    assert len(elements) == 1
+    assert "Petronas" in elements[0]["tags"]["name"]
@@ -0,0 +1,75 @@
+import pytest
+
+from location_utils import geocache
+from location_utils.geocache import NEGATIVE, GeocodeCache, geohash
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() for the geocache module"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(geocache.time, "time", lambda: now[0])
+    return now
+
+
+def test_geohash_reference_values():
+    assert geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash(42.6, -5.6, 5) == "ezs42"
+
+
+def test_geohash_precision_is_a_prefix():
+    full = geohash(48.8584, 2.2945, 9)
+    assert len(full) == 9
+    assert geohash(48.8584, 2.2945, 5) == full[:5]
+
+
+def test_nearby_points_share_a_cell_and_distant_ones_do_not(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geo.sqlite"), precision=7)
+    assert cache.key(48.85840, 2.29450) == cache.key(48.85841, 2.29451)
+    assert cache.key(48.8584, 2.2945) != cache.key(40.6892, -74.0445)
+
+
+def test_hit_and_expiry(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "geo.sqlite"), ttl=100, negative_ttl=10)
+    assert cache.get(1.0, 2.0) is None
+    cache.put(1.0, 2.0, "Somewhere")
+    assert cache.get(1.0, 2.0) == "Somewhere"
+
+    clock[0] += 101
+    assert cache.get(1.0, 2.0) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_negative_results_use_their_own_ttl(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "geo.sqlite"), ttl=100, negative_ttl=10)
+    cache.put(1.0, 2.0, None)
+    assert cache.get(1.0, 2.0) is NEGATIVE
+
+    clock[0] += 11
+    assert cache.get(1.0, 2.0) is None
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_least_recently_used_rows_are_evicted(tmp_path, clock):
+    cache = GeocodeCache(str(tmp_path / "geo.sqlite"), max_entries=2)
+    for i in range(3):
+        clock[0] += 1
+        cache.put(float(i), float(i), f"place {i}")
+        if i == 1:
+            clock[0] += 1
+            assert cache.get(0.0, 0.0) == "place 0"
+
+    assert cache.get(0.0, 0.0) == "place 0"
+    assert cache.get(1.0, 1.0) is None
+    assert cache.get(2.0, 2.0) == "place 2"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_database_errors_are_misses(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geo.sqlite"))
+    cache.put(1.0, 2.0, "Somewhere")
+    cache._conn.close()
+
+    assert cache.get(1.0, 2.0) is None
+    cache.put(3.0, 4.0, "Elsewhere")
@@ -0,0 +1,129 @@
+import sqlite3
+import threading
+
+import pytest
+
+from pipeline_utils.history import (CsvHistoryStore, HistoryStore, SQLiteHistoryStore, bucket_starts,
+                                    cluster_precision)
+
+LEGACY_SCHEMA = ("CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL "
+                 "COLLATE NOCASE, emotion TEXT, confidence REAL, location TEXT, timestamp TEXT NOT NULL)")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteHistoryStore(str(tmp_path / "history.sqlite"))
+
+
+def _legacy_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SCHEMA)
+    conn.executemany("INSERT INTO history (username, emotion, confidence, location, timestamp) "
+                     "VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_history_store_is_abstract():
+    with pytest.raises(TypeError):
+        HistoryStore()
+
+
+def test_bucket_starts():
+    assert bucket_starts("2026-03-05 14:37:00") == [
+        ("all", ""), ("hour", "2026-03-05 14:00:00"), ("day", "2026-03-05"), ("week", "2026-03-02"),
+    ]
+    assert bucket_starts("garbage") == [("all", "")]
+
+
+def test_rollups_follow_appends(store):
+    store.append("Alice", "happy", 0.9, "Paris", timestamp="2026-03-05 10:00:00")
+    store.append("alice", "happy", 0.5, "Paris", timestamp="2026-03-05 11:00:00")
+    store.append("alice", "sad", 0.4, "Paris", timestamp="2026-03-06 09:00:00")
+    store.append("bob", "angry", 0.7, "Rome", timestamp="2026-03-06 09:00:00")
+
+    assert store.count("ALICE") == 3
+    counts = store.emotion_counts("alice").set_index("Emotion")
+    assert counts.loc["happy", "count"] == 2
+    assert counts.loc["happy", "mean_confidence"] == pytest.approx(0.7)
+
+    trend = store.emotion_trend("alice", bucket="day", periods=1)
+    assert trend["period"].tolist() == ["2026-03-06"]
+    assert trend["Emotion"].tolist() == ["sad"]
+    with pytest.raises(ValueError):
+        store.emotion_trend("alice", bucket="month")
+
+    page = store.page("alice", limit=2)
+    assert page["timestamp"].tolist() == ["2026-03-06 09:00:00", "2026-03-05 11:00:00"]
+
+
+def test_clusters_respect_scope_and_bbox(store):
+    store.append("alice", "happy", 0.9, "Paris", lat=48.8584, lon=2.2945)
+    store.append("alice", "happy", 0.9, "Paris", lat=48.8606, lon=2.3376)
+    store.append("bob", "sad", 0.9, "New York", lat=40.6892, lon=-74.0445)
+    store.append("bob", "sad", 0.9, "Nowhere", lat=123.0, lon=0.0)
+
+    paris = (48.0, 2.0, 49.0, 3.0)
+    assert store.clusters("alice", paris)["count"].sum() == 2
+    assert store.clusters("bob", paris).empty
+    assert store.clusters(None)["count"].sum() == 3
+    # A viewport across the antimeridian
+    assert store.clusters(None, (-10.0, 170.0, 10.0, -170.0)).empty
+
+
+def test_cluster_precision_gets_finer_as_the_viewport_shrinks():
+    assert cluster_precision((-90.0, -180.0, 90.0, 180.0)) < cluster_precision((48.0, 2.0, 49.0, 3.0))
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    _legacy_db(path, [("alice", "happy", 0.9, "Paris", "2026-03-05 10:00:00"),
+                      ("alice", "sad", 0.3, "Paris", "2026-03-06 10:00:00")])
+
+    store = SQLiteHistoryStore(path)
+    columns = {row[1] for row in store._conn.execute("PRAGMA table_info(history)")}
+    assert {"lat", "lon", "image_sha"} <= columns
+    assert store.count("alice") == 2
+
+    # Reopening must not rebuild or double-count anything
+    store.append("alice", "happy", 0.5, "Paris", lat=48.85, lon=2.35)
+    reopened = SQLiteHistoryStore(path)
+    assert reopened.count("alice") == 3
+    assert reopened.clusters("alice")["count"].sum() == 1
+
+
+def test_concurrent_first_open_of_a_legacy_database(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    _legacy_db(path, [("alice", "happy", 0.9, "Paris", "2026-03-05 10:00:00")])
+    errors, counts = [], []
+
+    def open_store():
+        try:
+            counts.append(SQLiteHistoryStore(path).count("alice"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=open_store) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert counts == [1] * 8
+
+
+def test_import_csv_runs_once(tmp_path, store):
+    csv_path = tmp_path / "history.csv"
+    csv_path.write_text("Username,Emotion,Confidence,Location,timestamp\n"
+                        "alice,happy,0.9,Paris,2026-03-05 10:00:00\n", encoding="utf-8")
+    assert store.import_csv(str(csv_path)) == 1
+    assert store.import_csv(str(csv_path)) == 0
+    assert store.count("alice") == 1
+
+
+def test_csv_store_keeps_numeric_usernames(tmp_path):
+    store = CsvHistoryStore(str(tmp_path / "history.csv"))
+    store.append("007", "happy", 0.9, "Paris", timestamp="2026-03-05 10:00:00")
+    store.append("alice", "sad", 0.4, "Paris", timestamp="2026-03-05 11:00:00")
+    assert store.count("007") == 1
+    assert store.emotion_counts("007")["Emotion"].tolist() == ["happy"]
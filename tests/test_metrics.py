@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline_utils import metrics
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    monkeypatch.setattr(metrics, "_registry", metrics.MetricsRegistry())
+
+
+@metrics.timed("work")
+def _work():
+    return 42
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    monkeypatch.setattr(metrics, "_registry", metrics.MetricsRegistry())
+    assert _work() == 42
+    metrics.inc("uploads_total")
+    assert metrics.start_trace().finish().breakdown() == []
+    assert metrics.render() == "\n"
+
+
+def test_timed_functions_feed_the_stage_histogram(enabled):
+    assert _work() == 42
+    text = metrics.render()
+    assert "# TYPE pipeline_stage_seconds histogram" in text
+    assert 'pipeline_stage_seconds_count{stage="work"} 1' in text
+
+
+def test_counters_render_sorted_labels(enabled):
+    metrics.inc("lookups_total", result="cache", service="poi")
+    metrics.inc("lookups_total", result="cache", service="poi")
+    assert 'lookups_total{result="cache",service="poi"} 2' in metrics.render()
+
+
+def test_trace_collects_spans_from_pool_threads(enabled):
+    trace = metrics.start_trace("upload")
+    with metrics.span("decode"):
+        pass
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        metrics.submit(pool, _work).result()
+        metrics.submit(pool, _work).result()
+    rows = {row["stage"]: row for row in trace.finish().breakdown()}
+    assert rows["decode"]["calls"] == 1
+    assert rows["work"]["calls"] == 2
+    assert "total (wall)" in rows
+    assert 'pipeline_request_seconds_count{trace="upload"} 1' in metrics.render()
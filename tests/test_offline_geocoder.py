@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from location_utils.offline_geocoder import OfflineGeocoder
+
+PLACES = [("Paris", 48.8566, 2.3522), ("London", 51.5072, -0.1276), ("Suva", -18.1248, 178.4501)]
+
+
+@pytest.fixture
+def geocoder():
+    names = [name for name, _, _ in PLACES]
+    lat = np.array([p[1] for p in PLACES])
+    lon = np.array([p[2] for p in PLACES])
+    return OfflineGeocoder(names, lat, lon, max_distance_km=50)
+
+
+def test_nearest_place(geocoder):
+    assert geocoder.reverse(48.86, 2.29) == "Paris"
+    assert geocoder.reverse(51.5, -0.2) == "London"
+
+
+def test_nearest_across_the_antimeridian(geocoder):
+    assert geocoder.reverse(-18.1, -179.9) is None
+    geocoder.max_distance_km = 500
+    assert geocoder.reverse(-18.1, -179.9) == "Suva"
+
+
+def test_places_beyond_max_distance_are_not_reported(geocoder):
+    assert geocoder.reverse(0.0, 0.0) is None
+
+
+def test_batch_keeps_input_order(geocoder):
+    coords = [(51.5, -0.1), (0.0, 0.0), (48.85, 2.35)]
+    assert geocoder.reverse_batch(coords) == ["London", None, "Paris"]
+    assert geocoder.reverse_batch([]) == []
+
+
+def test_load_csv_and_geonames(tmp_path):
+    csv_path = tmp_path / "places.csv"
+    csv_path.write_text("name,admin1,country,lat,lon\n"
+                        "Paris,Ile-de-France,France,48.8566,2.3522\n"
+                        "Broken,,,not-a-number,0\n", encoding="utf-8")
+    from_csv = OfflineGeocoder.load(str(csv_path))
+    assert len(from_csv) == 1
+    assert from_csv.reverse(48.85, 2.35) == "Paris, Ile-de-France, France"
+
+    txt_path = tmp_path / "cities500.txt"
+    cols = ["2988507", "Paris", "Paris", "", "48.85341", "2.3488", "P", "PPLC", "FR", "", "11"]
+    txt_path.write_text("\t".join(cols) + "\n", encoding="utf-8")
+    assert OfflineGeocoder.load(str(txt_path)).reverse(48.85, 2.35) == "Paris, 11, FR"
@@ -0,0 +1,101 @@
+import pytest
+
+from location_utils import poi_index
+from location_utils.geocache import NEGATIVE
+from location_utils.poi_index import PoiIndex, best_element, normalize_name, overpass_name_regex, trigrams
+
+ELEMENTS = [
+    {"type": "way", "id": 1, "center": {"lat": 48.8530, "lon": 2.3499},
+     "tags": {"name": "Cathédrale Notre-Dame de Paris", "wikidata": "Q2981", "tourism": "attraction"}},
+    {"type": "node", "id": 2, "lat": 48.8584, "lon": 2.2945,
+     "tags": {"name": "Tour Eiffel", "name:en": "Eiffel Tower", "wikidata": "Q243"}},
+    # Same name as the cathedral, less well known
+    {"type": "node", "id": 3, "lat": 45.0, "lon": 5.0, "tags": {"name": "Notre-Dame de Paris", "amenity": "cafe"}},
+    {"type": "node", "id": 4, "lat": 1.0, "lon": 1.0, "tags": {"amenity": "bench"}},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    idx = PoiIndex(str(tmp_path / "poi.sqlite"), ttl=100, negative_ttl=10)
+    assert idx.import_elements(ELEMENTS, region="paris") == 3
+    return idx
+
+
+def test_normalize_name():
+    assert normalize_name("  Cathédrale Notre-Dame de Paris ") == "cathedrale notre dame de paris"
+    assert trigrams("ab") == {"  a", " ab", "ab "}
+
+
+def test_exact_match_uses_any_name_tag(index):
+    match = index.find("Eiffel Tower")
+    assert match["match"] == "exact"
+    assert match["name"] == "Tour Eiffel"
+    assert (match["lat"], match["lon"]) == (48.8584, 2.2945)
+
+
+def test_prefix_match(index):
+    match = index.find("cathédrale notre")
+    assert match["match"] == "prefix"
+    assert match["name"] == "Cathédrale Notre-Dame de Paris"
+
+
+def test_trigram_match_tolerates_typos(index):
+    match = index.find("Eifel Tower")
+    assert match["match"] == "trigram"
+    assert match["name"] == "Tour Eiffel"
+    assert index.find("Colosseum") is None
+
+
+def test_better_ranked_feature_wins_a_shared_name(tmp_path):
+    idx = PoiIndex(str(tmp_path / "poi.sqlite"))
+    idx.import_elements(ELEMENTS + [{"type": "node", "id": 5, "lat": 0.0, "lon": 0.0,
+                                     "tags": {"name": "Cathédrale Notre-Dame de Paris"}}])
+    assert idx.find("Cathedrale Notre Dame de Paris")["lat"] == 48.8530
+
+
+def test_reimport_replaces_names(index):
+    renamed = dict(ELEMENTS[1], tags={"name": "Iron Lady"})
+    index.import_elements([renamed])
+    assert index.find("Iron Lady")["lat"] == 48.8584
+    assert index.find("Tour Eiffel") is None
+
+
+def test_lookup_cache_ttl(index, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(poi_index.time, "time", lambda: now[0])
+    index.remember("Big Ben", (51.5007, -0.1246), "Overpass")
+    index.remember("Nowhere Tower", None, "Overpass")
+    assert index.cached("big  ben") == ((51.5007, -0.1246), "Overpass")
+    assert index.cached("Nowhere Tower") is NEGATIVE
+
+    now[0] += 11
+    assert index.cached("Nowhere Tower") is None
+    assert index.cached("Big Ben") is not None
+    now[0] += 100
+    assert index.cached("Big Ben") is None
+
+
+def test_clear_negative(index):
+    index.remember("Nowhere Tower", None)
+    index.remember("Big Ben", (51.5007, -0.1246))
+    assert index.clear_negative() == 1
+    assert index.cached("Big Ben") is not None
+
+
+def test_database_errors_are_misses(index):
+    index._conn.close()
+    assert index.cached("Big Ben") is None
+    assert index.find("Eiffel Tower") is None
+    index.remember("Big Ben", (51.5007, -0.1246))
+
+
+def test_best_element_prefers_exact_names():
+    elements = [{"lat": 0, "lon": 0, "tags": {"name": "Eiffel Tower Replica", "wikidata": "Q1"}},
+                {"lat": 1, "lon": 1, "tags": {"name": "Eiffel Tower"}}]
+    assert best_element(elements, "eiffel tower")["lat"] == 1
+    assert best_element([{"tags": {"name": "x"}}], "x") is None
+
+
+def test_overpass_name_regex_escapes_metacharacters():
+    assert overpass_name_regex('St. Paul\'s (London) "x"') == 'St\\\\. Paul\'s \\\\(London\\\\) \\"x\\"'